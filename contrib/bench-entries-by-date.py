@@ -0,0 +1,73 @@
+"""Compare selecting the most recent entries of large feeds with a
+full sort and with :func:`djangofeeds.feedutil.entries_by_date`.
+
+Usage: python contrib/bench-entries-by-date.py
+
+"""
+import time
+import random
+from datetime import datetime, timedelta
+
+from django.conf import settings
+settings.configure()
+
+from djangofeeds.feedutil import entries_by_date, format_date
+
+LIMIT = 20
+
+
+def synthetic_entries(count):
+    """Entries as returned by the feed parser, in random order, some
+    without dates."""
+    start = datetime(2010, 1, 1)
+    entries = []
+    for i in xrange(count):
+        entry = {"title": "Entry %d" % i}
+        if i % 10:
+            date = start + timedelta(minutes=random.randint(0, 10 ** 6))
+            entry["updated_parsed"] = time.struct_time(date.timetuple())
+        entries.append(entry)
+    random.shuffle(entries)
+    return entries
+
+
+def full_sort(entries, limit=None):
+    """The full sort :func:`entries_by_date` used before."""
+    now = datetime.now()
+    sorted_entries = []
+    for counter, entry in enumerate(entries):
+        date = format_date(entry.get("updated_parsed") or
+                           entry.get("published_parsed") or
+                           entry.get("date_parsed") or
+                           now - timedelta(seconds=(counter * 30)))
+        entry["updated_parsed"] = date.timetuple()
+        entry["published_parsed"] = entry.get("published_parsed") or \
+                                        date.timetuple()
+        sorted_entries.append((date, entry))
+    sorted_entries.sort(key=lambda key: key[0])
+    sorted_entries.reverse()
+    return [entry for _date, entry in sorted_entries[:limit]]
+
+
+def bench(select, entries, number=20):
+    seconds = 0
+    for _ in xrange(number):
+        # Both modify the entries they select.
+        copies = [dict(entry) for entry in entries]
+        time_start = time.time()
+        select(copies, LIMIT)
+        seconds += time.time() - time_start
+    return seconds / number * 1000
+
+
+def main():
+    print "%8s %14s %14s" % ("entries", "full sort ms", "top-k ms")
+    for count in (100, 1000, 10000, 50000):
+        entries = synthetic_entries(count)
+        print "%8d %14.2f %14.2f" % (count,
+                                     bench(full_sort, entries),
+                                     bench(entries_by_date, entries))
+
+
+if __name__ == "__main__":
+    main()
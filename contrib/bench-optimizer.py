@@ -0,0 +1,48 @@
+"""Compare the post content optimizer engines.
+
+Usage: python contrib/bench-optimizer.py
+
+"""
+import timeit
+
+from django.conf import settings
+settings.configure()
+
+from djangofeeds.optimization import OPTIMIZER_ENGINES
+
+TRACKER = "http://feeds.feedburner.com/~r/Example/~4/aFiizovyBmA"
+
+PARAGRAPH = """<p>Lorem ipsum <b>dolor</b> sit amet,
+<a href="http://%d.example.com/">
+consectetur</a> adipiscing elit &amp; sed do eiusmod.<br><br><br>
+<img src="http://www.example.com/%d.jpg" width="400"></p>"""
+
+FOOTER = """<div class="feedflare"><a href="%s"><img src="%s" border="0">
+</a></div><img src="%s" height="1" width="1"/>""" % (TRACKER, TRACKER,
+                                                      TRACKER)
+
+
+def post(paragraphs):
+    return "\n".join(PARAGRAPH % (i, i)
+                        for i in xrange(paragraphs)) + FOOTER
+
+
+def bench(optimizer, html, number):
+    seconds = timeit.timeit(lambda: optimizer.optimize(html), number=number)
+    return seconds / number * 1e3
+
+
+def main():
+    engines = sorted(OPTIMIZER_ENGINES)
+    print "%10s %s" % ("paragraphs",
+                       " ".join("%14s" % (name + " ms") for name in engines))
+    for paragraphs in (1, 10, 100):
+        html = post(paragraphs)
+        number = max(2000 / paragraphs, 20)
+        print "%10d %s" % (paragraphs, " ".join(
+            "%14.3f" % bench(OPTIMIZER_ENGINES[name](), html, number)
+                for name in engines))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Compare the cost of tracker URL matching for growing rule lists.
+
+Usage: python contrib/bench-trackers.py
+
+"""
+import timeit
+
+from django.conf import settings
+settings.configure()
+
+from djangofeeds.optimization import TrackerMatcher
+
+URLS = ["http://feeds.feedburner.com/~r/Wulffmorgenthaler/~4/aFiizovyBmA",
+        "http://www.example.com/images/2010/05/photo.jpg",
+        "http://rss.feedsportal.com/c/32495/f/479227/s/20113027/mf.gif",
+        "http://static.example.org/a.png"]
+
+
+def rules(count):
+    return ["http://tracker%d.example.com/pixel/" % i for i in xrange(count)]
+
+
+def linear(services):
+
+    def looks_like_tracker(url):
+        for service in services:
+            if url.startswith(service):
+                return True
+        return False
+    return looks_like_tracker
+
+
+def bench(match, number=2000):
+    seconds = timeit.timeit(lambda: map(match, URLS), number=number)
+    return seconds / (number * len(URLS)) * 1e6
+
+
+def main():
+    print "%8s %14s %14s" % ("rules", "linear us/url", "matcher us/url")
+    for count in (10, 100, 1000, 10000):
+        services = rules(count)
+        print "%8d %14.2f %14.2f" % (count,
+                                     bench(linear(services)),
+                                     bench(TrackerMatcher(services).match))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Refresh thousands of feeds concurrently in a single process.
+
+Requires :mod:`gevent`.  Nothing is monkey patched: only the sockets
+opened by :class:`GreenFeedFetcher` are cooperative, everything else
+(the database, the cache, Redis) blocks the process as usual.
+
+"""
+import httplib as http
+
+import gevent
+import gevent.pool
+import gevent.queue
+import gevent.socket
+
+from djangofeeds.fetcher import FeedFetcher, DeadlineSocket
+from djangofeeds.importers import FeedImporter, ThreadedFeedRefresher
+from djangofeeds.ratelimit import LocalHostLimiter
+
+
+class GreenFeedFetcher(FeedFetcher):
+    """:class:`~djangofeeds.fetcher.FeedFetcher` using :mod:`gevent`
+    sockets, so requests only block the greenlet sending them."""
+
+    def connect(self, scheme, host, timeout, deadline, proxy=None):
+        if scheme == "https":
+            conn = http.HTTPSConnection(proxy.netloc if proxy else host)
+        else:
+            conn = http.HTTPConnection(proxy.netloc if proxy else host)
+        sock = gevent.socket.create_connection(
+                    (conn.host, conn.port),
+                    timeout=deadline.cap(timeout.connect))
+        if scheme == "https":
+            from gevent import ssl
+            if proxy is not None:
+                conn.set_tunnel(host, headers=proxy.headers)
+                conn.sock = sock
+                conn._tunnel()
+            sock = ssl.create_default_context().wrap_socket(
+                        sock, server_hostname=conn._tunnel_host or conn.host)
+        conn.sock = DeadlineSocket(sock, timeout.read, deadline)
+        return conn
+
+
+class GreenHostLimiter(LocalHostLimiter):
+    """:class:`~djangofeeds.ratelimit.LocalHostLimiter` waiting
+    for a free slot without blocking other greenlets."""
+
+    def wait(self, host, seconds):
+        gevent.sleep(seconds)
+
+
+class AsyncFeedImporter(FeedImporter):
+    """:class:`~djangofeeds.importers.FeedImporter` fetching feeds with
+    a :class:`GreenFeedFetcher`, and limiting requests per host with a
+    :class:`GreenHostLimiter` (unless other ones are given).
+
+    Use it with :class:`AsyncFeedRefresher` to refresh many feeds
+    at once.
+
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("fetcher", GreenFeedFetcher())
+        kwargs.setdefault("limiter", GreenHostLimiter())
+        super(AsyncFeedImporter, self).__init__(**kwargs)
+
+
+class AsyncFeedRefresher(ThreadedFeedRefresher):
+    """Refresh many feeds using :mod:`gevent` greenlets for fetching.
+
+    Up to :attr:`workers` feeds are fetched and parsed at the same time,
+    each with its own timeouts and within the per-host limits of the
+    importer.  The results are handed to :meth:`refresh` through a queue
+    of at most :attr:`chunksize` feeds, and written to the database one
+    at a time, as with :class:`~djangofeeds.importers.ThreadedFeedRefresher`.
+
+    :keyword importer: See :attr:`importer`, default is a new
+        :class:`AsyncFeedImporter`.
+    :keyword workers: See :attr:`workers`.
+    :keyword chunksize: See :attr:`chunksize`.
+
+    .. attribute:: workers
+
+        Number of feeds fetched concurrently.
+
+    .. attribute:: chunksize
+
+        Max number of fetched feeds waiting to be written.  Fetching
+        stops while the queue is full.  Default is :attr:`workers`.
+
+    """
+    workers = 100
+
+    def __init__(self, importer=None, workers=None, chunksize=None):
+        importer = importer or AsyncFeedImporter()
+        super(AsyncFeedRefresher, self).__init__(importer, workers)
+        self.chunksize = chunksize or self.workers
+
+    def refresh(self, feeds):
+        queue = gevent.queue.Queue(self.chunksize)
+        pool = gevent.pool.Pool(self.workers)
+
+        def fetch(feed_obj):
+            queue.put(self.fetch(feed_obj))
+
+        def fetch_all():
+            try:
+                for feed_obj in feeds:
+                    pool.spawn(fetch, feed_obj)
+                pool.join()
+            finally:
+                queue.put(StopIteration)
+
+        producer = gevent.spawn(fetch_all)
+        try:
+            for result in queue:
+                yield self.write(*result)
+            # Raises if iterating over ``feeds`` failed.
+            producer.get()
+        finally:
+            producer.kill()
+            pool.kill()
@@ -1,3 +1,6 @@
+from django.db import transaction
+from django.db.models import Max, Q, sql
+
 from djangofeeds.models import Post
 
 
@@ -6,8 +9,65 @@ class DatabaseBackend(object):
     def get_post_model(self):
         return Post
 
-    def all_posts_by_order(self, feed, **kwargs):
-        return feed.post_set.order_by("-date_published")
+    def all_posts_by_order(self, feed, fields=None, **kwargs):
+        posts = feed.post_set.order_by("-date_published")
+        if fields:
+            posts = posts.only(*fields)
+        return posts
 
     def get_post_count(self, feed):
         return feed.post_set.count()
+
+    def get_fingerprints(self, feed):
+        return set(feed.post_set.values_list("fingerprint", flat=True))
+
+    def get_date_newest_post(self, feed):
+        return feed.post_set.aggregate(newest=Max("date_published"))["newest"]
+
+    def expire_old_posts(self, feed, min_posts, max_posts):
+        by_date = feed.post_set.order_by("-date_published", "-id")
+        # The first post not kept, and whether there is a post after
+        # ``max_posts`` (so the feed has too many posts), in one query.
+        after_kept = by_date.values_list("date_published", "id")[
+                        min_posts:max(max_posts, min_posts) + 1]
+        after_kept = list(after_kept)
+        # Nothing is beyond ``min_posts`` (which may exceed
+        # ``max_posts``), or there are no more than ``max_posts``.
+        if not after_kept or len(after_kept) <= max_posts - min_posts:
+            return 0
+        # Everything at or beyond the first post not kept is expired.
+        date_published, post_id = after_kept[0]
+        expired = feed.post_set.filter(
+                    Q(date_published__lt=date_published) |
+                    Q(date_published=date_published, id__lte=post_id))
+        count = self._delete(expired)
+        feed.posts_removed(count)
+        return count
+
+    def _delete(self, posts):
+        """Delete ``posts`` (and their category and enclosure
+        relations) with one ``DELETE`` per table, without fetching
+        them first like :meth:`QuerySet.delete` does.
+
+        :returns: The number of posts deleted.
+
+        """
+        ids = posts.values("id")
+        for field in Post._meta.many_to_many:
+            through = field.rel.through._default_manager.filter(**{
+                            "%s__in" % field.m2m_field_name(): ids})
+            self._delete_query(through)
+        count = self._delete_query(posts)
+        transaction.commit_unless_managed(using=posts.db)
+        return count
+
+    def _delete_query(self, queryset):
+        # Relies on Django 1.4 internals: this is
+        # :meth:`sql.DeleteQuery.do_query`, with ``tables`` and
+        # ``where`` assigned by hand, but keeping the cursor for the
+        # row count.  The conditions of ``queryset`` must only refer
+        # to the table of the model.  Review this when upgrading Django.
+        query = sql.DeleteQuery(queryset.model)
+        query.tables = [queryset.model._meta.db_table]
+        query.where = queryset.query.where
+        return query.get_compiler(queryset.db).execute_sql(None).rowcount
@@ -1,11 +1,14 @@
-from itertools import imap
+import time
+import warnings
 from datetime import datetime
 
+from redis.exceptions import WatchError
 from redish.utils import maybe_datetime
 from redish.models import Model, Manager
 
 from djangofeeds import conf
-from djangofeeds.managers import DEFAULT_POST_LIMIT
+from djangofeeds.managers import DEFAULT_POST_LIMIT, is_unchanged
+from djangofeeds.models import Feed
 
 
 class InconsistencyWarning(UserWarning):
@@ -14,18 +17,32 @@ class InconsistencyWarning(UserWarning):
 
 class Entry(Model):
 
-    def prepare_save(self, fields):
+    def save(self):
+        self.id = self.id or self.objects.id(self.name)
+        pipe = self.objects.api.pipeline()
+        self.save_to(pipe)
+        pipe.execute()
+        return self.id
+
+    def save_to(self, pipe):
+        """Add the commands storing this entry to the pipeline ``pipe``.
+
+        The entry must already have an id.
+
+        """
+        pipe.set(self.id, self.objects.prepare_value(dict(self)))
+        pipe.zadd(self.sort_index.name, self.id,
+                  maybe_datetime(self.timestamp))
+        pipe.hset(self.guid_map.name, self.guid, self.id)
+        if self.get("fingerprint"):
+            pipe.hset(self.fingerprint_map.name, self.id, self.fingerprint)
         # Save set of recently imported feeds, for faster integrity checks.
-        self.recent_imports.add(self.feed_url)
-        return fields
-
-    def post_save(self):
-        self.sort_index.add(self.id, maybe_datetime(self.timestamp))
-        self.guid_map[self.guid] = self.id
+        pipe.sadd(self.recent_imports.name, self.feed_url)
 
     def post_delete(self):
         del(self.guid_map[self.guid])
         self.sort_index.remove(self.id)
+        self.objects.api.hdel(self.fingerprint_map.name, self.id)
 
     @property
     def sort_index(self):
@@ -35,6 +52,10 @@ class Entry(Model):
     def guid_map(self):
         return self.objects.get_guid_map(self["feed_url"])
 
+    @property
+    def fingerprint_map(self):
+        return self.objects.get_fingerprint_map(self["feed_url"])
+
     @property
     def recent_imports(self):
         return self.objects.Set("Recent:imports")
@@ -50,36 +71,149 @@ class Entries(Manager):
     db = "djangofeeds"
     model = Entry
 
-    def all_by_order(self, feed_url, limit=DEFAULT_POST_LIMIT):
+    def all_by_order(self, feed_url, limit=DEFAULT_POST_LIMIT, fields=None):
+        """Get the entries of a feed, most recent first.
+
+        All entries are fetched with a single ``MGET``.
+
+        :keyword limit: Maximum number of entries to return,
+            :const:`None` for all of them.
+        :keyword fields: If set, only these fields are included in
+            the returned entries.  Entries are stored as a single value,
+            so this only shapes the returned entries: the full entry,
+            ``content`` included, is still fetched and decoded.
+
+        """
         posts = []
+        if limit is not None and limit <= 0:
+            return posts
         index = self.get_sort_index(feed_url)
-        for key in index.revrange(0, limit):
-            try:
-                posts.append(self.get(key))
-            except KeyError:
+        keys = index.revrange(0, None if limit is None else limit - 1)
+        if not keys:
+            return posts
+        for key, value in zip(keys, self.api.mget(keys)):
+            if value is None:
                 warnings.warn(
                         "Sort index for %s has member %s, but the "
                         "related key does not exist anymore." % (
                             feed_url, key),
                         InconsistencyWarning)
                 index.remove(key)
-
+                continue
+            data = self.value_to_python(value)
+            if fields is not None:
+                data = dict((field, data[field])
+                                for field in fields if field in data)
+            posts.append(self.instance(key, **data))
         return posts
 
     def update_or_create(self, feed_obj, **fields):
-        fields.pop("feed", None)
-        fields["feed_url"] = feed_obj.feed_url
-        fields["timestamp"] = fields["date_updated"]
+        return self.bulk_upsert(feed_obj, [fields])[0]
 
+    def bulk_upsert(self, feed_obj, entries, prepare=None, fetch_pks=True):
+        """Create or update the entries of a feed.
+
+        The existing entries are looked up with one ``HMGET``/``MGET``
+        pair, and all new and changed entries are written in a single
+        pipeline.  The new entries always have their ids, so
+        ``fetch_pks`` is ignored.
+
+        """
+        feed_url = feed_obj.feed_url
         conf.FSCK_ON_UPDATE and self.fsck([feed_url], full=False)
+        entries = list(entries)
+        existing = self.get_many_by_guid(
+                        feed_url, [fields["guid"] for fields in entries])
+
+        posts, changed, by_guid = [], [], {}
+        for fields, entry in zip(entries, existing):
+            entry = by_guid.get(fields["guid"], entry)
+            if is_unchanged(entry, fields):
+                posts.append(entry)
+                continue
+
+            fields = prepare(dict(fields)) if prepare else dict(fields)
+            fields.pop("feed", None)
+            fields["feed_url"] = feed_url
+            fields["timestamp"] = fields["date_updated"]
+            if entry is None:
+                entry = self.instance(**fields)
+            else:
+                entry.update(fields)
+            if fields["guid"] not in by_guid:
+                changed.append(entry)
+            by_guid[fields["guid"]] = entry
+            posts.append(entry)
+        created = [post for post in changed if not post.id]
+        self.save_many(changed)
+        if created:
+            feed_obj.posts_added(len(created), max(
+                post.get("date_published") or post["date_updated"]
+                    for post in created))
+        return posts
 
-        try:
-            entry = self.get_by_guid(fields["feed_url"], fields["guid"])
-            entry.update(fields)
-            entry.save()
-            return entry
-        except KeyError:
-            return self.create(**fields)
+    def save_many(self, entries):
+        """Save ``entries`` in a single pipeline, allocating ids for the
+        new ones with one ``INCRBY``."""
+        if not entries:
+            return
+        new = [entry for entry in entries if not entry.id]
+        if new:
+            last_id = self.api.incr("ids:%s" % (self.model.name, ), len(new))
+            for i, entry in enumerate(new):
+                entry.id = "%s:%s" % (self.model.name,
+                                      last_id - len(new) + i + 1)
+        pipe = self.api.pipeline()
+        for entry in entries:
+            entry.save_to(pipe)
+        pipe.execute()
+
+    def iterscan(self, command, name=None, match=None, cursor_key=None,
+            resume=False, rate=None):
+        """Iterate over the batches returned by one of the cursor based
+        ``SCAN``, ``SSCAN``, ``HSCAN`` or ``ZSCAN`` commands, so large
+        keyspaces can be walked without blocking the server.
+
+        :param command: The scan method of the Redis client,
+            e.g. ``self.api.hscan``.
+        :keyword name: Key to scan, not used for ``SCAN``.
+        :keyword match: Only return keys/members matching this pattern.
+        :keyword cursor_key: Save the cursor under this key after each
+            batch has been processed, so the scan can be continued later
+            with ``resume``.
+        :keyword resume: Start from the cursor saved in ``cursor_key``.
+        :keyword rate: Maximum number of keys/members per second.
+
+        """
+        args = () if name is None else (name, )
+        cursor = 0
+        if resume and cursor_key:
+            cursor = int(self.api.get(cursor_key) or 0)
+        time_start, total = time.time(), 0
+        while True:
+            cursor, batch = command(*args + (cursor, ), match=match,
+                                    count=conf.FSCK_SCAN_COUNT)
+            cursor = int(cursor)
+            if batch:
+                yield batch
+            if cursor_key:
+                if cursor:
+                    self.api.set(cursor_key, cursor)
+                else:
+                    self.api.delete(cursor_key)
+            if not cursor:
+                break
+            if rate:
+                total += len(batch)
+                delay = total / float(rate) - (time.time() - time_start)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def _exists(self, keys):
+        pipe = self.api.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        return pipe.execute()
 
     def _verify_post_consistency(self, pk, post, clean=True):
         is_string = lambda s: isinstance(s, basestring)
@@ -92,9 +226,10 @@ class Entries(Manager):
                  "title": []}
 
         for key, checks in tests.items():
+            failure = None
             if key in post:
                 value = post[key]
-                if any(check(value) for check in checks):
+                if not all(check(value) for check in checks):
                     failure = "invalid"
             else:
                 failure = "missing"
@@ -106,102 +241,245 @@ class Entries(Manager):
                         failure, pk, key, value),
                     InconsistencyWarning)
                 if clean:
-                    del(self[pk])
-
-    def _verify_guidmap_consistency(self, feed_url, clean=True, full=False):
+                    self.api.delete(pk)
+                    if is_string(post.get("feed_url")):
+                        self.api.hdel(
+                            self.get_fingerprint_map(post["feed_url"]).name,
+                            pk)
+                return False
+        return True
+
+    def _verify_guidmap_consistency(self, feed_url, clean=True):
         # Verify that all pks in the guid map exists.
         guid_map = self.get_guid_map(feed_url)
-        reverse = dict((pk, guid) for guid, pk in guid_map.items())
-        pks = reverse.keys()
-        postdata = self.api.mget(pks)
         issues = 0
-        if any(post is None for post in postdata):
-            for i, post in enumerate(postdata):
-                if post is None:
+        for items in self.iterscan(self.api.hscan, guid_map.name):
+            guids, pks = items.keys(), items.values()
+            for guid, pk, exists in zip(guids, pks, self._exists(pks)):
+                if not exists:
                     warnings.warn(
                         "Guid map for %s has value %s for %s, but the "
                         "related key does not exist anymore." % (
-                            feed_url, pks[i], guid_map[pks[i]]),
+                            feed_url, pk, guid),
                         InconsistencyWarning)
                     if clean:
-                        del(guid_map[pks[i]])
+                        self.api.hdel(guid_map.name, guid)
                     issues += 1
-        if full:
-            # Verify that all entries in the system is in one or more
-            # guid maps.
-            seen = set()
-            entrypks = set(self.keys("Entry:*"))
-            for guidmap in imap(self.Dict, self.keys("*:guidmap")):
-                seen.update(set(guidmap.values()))
-            for missing in entrypks ^ seen:
-                warnings.warn(
-                    "Loose entry not in any guid map: %s (%s)" % (
-                            missing, self[missing]),
-                        InconsistencyWarning)
-                if clean:
-                    del(self[missing])
-                issues += 1
+        return issues
 
+    def _verify_fingerprint_map(self, feed_url, clean=True):
+        # Verify that all pks in the fingerprint map exists.
+        fingerprint_map = self.get_fingerprint_map(feed_url)
+        issues = 0
+        for items in self.iterscan(self.api.hscan, fingerprint_map.name):
+            pks = items.keys()
+            for pk, exists in zip(pks, self._exists(pks)):
+                if not exists:
+                    warnings.warn(
+                        "Fingerprint map for %s has field %s, but the "
+                        "related key does not exist anymore." % (
+                            feed_url, pk),
+                        InconsistencyWarning)
+                    if clean:
+                        self.api.hdel(fingerprint_map.name, pk)
+                    issues += 1
         return issues
 
-    def _verify_sort_index_consistency(self, feed_url, clean=True, full=False):
+    def _posts_removed(self, feed_url, count):
+        # The post count of a feed is the size of its sort index, so
+        # keep it in sync when members are removed.
+        for feed in Feed.objects.filter(feed_url=feed_url):
+            feed.posts_removed(count)
+
+    def _verify_sort_index_consistency(self, feed_url, clean=True):
         # Verify that all pks in the sort index exists.
-        index = self.get_sort_index(self, feed_url)
-        pks = list(index)
-        postdata = self.api.mget(pks)
+        index = self.get_sort_index(feed_url)
         issues = 0
-        if any(post is None for post in postdata):
-            for i, post in enumerate(postdata):
-                if post is None:
+        for items in self.iterscan(self.api.zscan, index.name):
+            pks = [pk for pk, _ in items]
+            for pk, exists in zip(pks, self._exists(pks)):
+                if not exists:
                     warnings.warn(
                         "Sort index for %s has member %s, but the "
                         "related key does not exist anymore." % (
-                            feed_url, pks[i]),
+                            feed_url, pk),
                         InconsistencyWarning)
                     if clean:
-                        index.remove(pks[i])
+                        self.api.zrem(index.name, pk)
                     issues += 1
-        if full:
-            # Verify that all entries in the system is in one or more
-            # sort indices.
-            seen = set()
-            entrypks = set(self.keys("Entry:*"))
-            for index in imap(self.SortedSet, self.iterkeys("*:sort")):
-                seen.update(set(index))
-            for missing in entrypks ^ seen:
-                warnings.warn(
-                    "Loose entry not in any sort index: %s (%s)" % (
-                            missing, self[missing]),
-                        InconsistencyWarning)
-                if clean:
-                    del(self[missing])
-                issues += 1
+        if clean and issues:
+            self._posts_removed(feed_url, issues)
         return issues
 
-    def fsck(self, feed_urls=None, clean=True, full=False):
-        if feed_urls is None:
-            # Verify all existing feeds.
-            _gkeys = set(k[:-8] for k in self.keys("*:guidmap"))
-            _skeys = set(k[:-5] for k in self.keys("*:sort"))
-            feed_urls = _gkeys | _skeys
+    def _verify_entries(self, pks, clean=True):
+        # Verify that the entries are valid, and that they are in the
+        # guid map and sort index of their feed.
+        issues = 0
+        posts = []
+        for pk, value in zip(pks, self.api.mget(pks)):
+            if value is None:
+                continue  # deleted since the keys were scanned.
+            post = self.value_to_python(value)
+            if self._verify_post_consistency(pk, post, clean):
+                posts.append((pk, post))
+            else:
+                issues += 1
+
+        pipe = self.api.pipeline(transaction=False)
+        for pk, post in posts:
+            pipe.hget(self.get_guid_map(post["feed_url"]).name, post["guid"])
+            pipe.zscore(self.get_sort_index(post["feed_url"]).name, pk)
+        found = pipe.execute()
+
+        pipe, removed = self.api.pipeline(), {}
+        for i, (pk, post) in enumerate(posts):
+            mapped, score = found[i * 2:i * 2 + 2]
+            if mapped == pk and score is not None:
+                continue
+            warnings.warn(
+                "Loose entry not in %s: %s (%s)" % (
+                    "guid map" if mapped != pk else "sort index", pk, post),
+                InconsistencyWarning)
+            if clean:
+                pipe.delete(pk)
+                pipe.zrem(self.get_sort_index(post["feed_url"]).name, pk)
+                pipe.hdel(self.get_fingerprint_map(post["feed_url"]).name, pk)
+                if mapped == pk:
+                    pipe.hdel(self.get_guid_map(post["feed_url"]).name,
+                              post["guid"])
+                if score is not None:
+                    feed_url = post["feed_url"]
+                    removed[feed_url] = removed.get(feed_url, 0) + 1
+            issues += 1
+        pipe.execute()
+        for feed_url, count in removed.items():
+            self._posts_removed(feed_url, count)
+        return issues
 
-        for feed_url in feed_urls:
-            self._verify_guidmap_consistency(feed_url, clean, full)
-            self._verify_sort_index_consistency(feed_url, clean, full)
+    def fsck(self, feed_urls=None, clean=True, full=False, recent=False,
+            resume=False, rate=None):
+        """Check the post store for inconsistencies, and repair them
+        if ``clean`` is set.
+
+        Keys are walked using ``SCAN`` and friends, so the check can run
+        against a live server.
+
+        :keyword feed_urls: List of feeds to check. Default is to check
+            all feeds.
+        :keyword recent: Only check the feeds imported since the last
+            time the recent feeds were checked (kept in the
+            ``Recent:imports`` set).
+        :keyword full: Also check all entries, removing invalid entries
+            and those missing from the guid map or sort index of
+            their feed.
+        :keyword resume: Continue an interrupted check from the last
+            saved cursor.
+        :keyword rate: Maximum number of keys to check per second.
+            Default is :data:`~djangofeeds.conf.FSCK_RATE_LIMIT`.
+
+        Returns the number of issues found.
+
+        """
+        rate = rate or conf.FSCK_RATE_LIMIT
+        recent_imports = self.Set("Recent:imports").name
+        if feed_urls is not None:
+            batches = [feed_urls]
+        elif recent:
+            batches = self.iterscan(self.api.sscan, recent_imports,
+                                    rate=rate)
+        else:
+            batches = ([key[:-len(":guidmap")] for key in keys]
+                        for keys in self.iterscan(self.api.scan,
+                                    match="*:guidmap", rate=rate,
+                                    cursor_key="fsck:cursor:feeds",
+                                    resume=resume))
 
+        issues = 0
         if full:
-            for pk, post in self.iteritems("Entry:*"):
-                self._verify_post_consistency(pk, post, clean)
+            # Done first, as removing invalid entries leaves references
+            # to them for the feed checks to clean up.
+            for pks in self.iterscan(self.api.scan, match="Entry:*",
+                                     rate=rate, resume=resume,
+                                     cursor_key="fsck:cursor:entries"):
+                issues += self._verify_entries(pks, clean)
+
+        for batch in batches:
+            for feed_url in batch:
+                issues += self._verify_guidmap_consistency(feed_url, clean)
+                issues += self._verify_sort_index_consistency(feed_url,
+                                                              clean)
+                issues += self._verify_fingerprint_map(feed_url, clean)
+            if recent and feed_urls is None:
+                self.api.srem(recent_imports, *batch)
+        return issues
+
+    def expire(self, feed_url, limit=50, max_posts=None):
+        """Remove all but the ``limit`` most recent entries of a feed.
+
+        The entries, their sort index members, guid map and
+        fingerprint fields are removed in one transaction.
+
+        :keyword max_posts: Only expire if the feed has more than this
+            number of entries.
+
+        :returns: The number of entries removed.
+
+        """
+        index = self.get_sort_index(feed_url).name
+        guid_map = self.get_guid_map(feed_url).name
+        fingerprint_map = self.get_fingerprint_map(feed_url).name
+        pipe = self.api.pipeline()
+        try:
+            while True:
+                try:
+                    pipe.watch(index)
+                    if max_posts is not None and \
+                            pipe.zcard(index) <= max_posts:
+                        return 0
+                    expired = pipe.zrevrange(index, limit, -1)
+                    if not expired:
+                        return 0
+                    guids = [self.value_to_python(value)["guid"]
+                                for value in pipe.mget(expired)
+                                    if value is not None]
+                    pipe.multi()
+                    pipe.zremrangebyrank(index, 0, -(limit + 1))
+                    pipe.delete(*expired)
+                    pipe.hdel(fingerprint_map, *expired)
+                    if guids:
+                        pipe.hdel(guid_map, *guids)
+                    pipe.execute()
+                    return len(expired)
+                except WatchError:
+                    continue
+        finally:
+            pipe.reset()
 
     def get_by_guid(self, feed_url, guid):
         return self.get(self.get_guid_map(feed_url)[guid])
 
+    def get_many_by_guid(self, feed_url, guids):
+        """Get the entries for a list of guids, with :const:`None` for
+        the guids not found."""
+        if not guids:
+            return []
+        pks = self.api.hmget(self.get_guid_map(feed_url).name, guids)
+        found = [pk for pk in pks if pk is not None]
+        values = found and dict(zip(found, self.api.mget(found))) or {}
+        return [self.instance(pk, **self.value_to_python(values[pk]))
+                    if values.get(pk) is not None else None
+                        for pk in pks]
+
     def get_sort_index(self, feed_url):
         return self.SortedSet((feed_url, "sort"))
 
     def get_guid_map(self, feed_url):
         return self.Dict((feed_url, "guidmap"))
 
+    def get_fingerprint_map(self, feed_url):
+        """Fingerprints of the entries of a feed, by entry id."""
+        return self.Dict((feed_url, "fingerprints"))
+
 
 class RedisBackend(object):
     _entry = None
@@ -217,6 +495,25 @@ class RedisBackend(object):
     def get_post_count(self, feed):
         return len(self.Entry.objects.get_sort_index(feed.feed_url))
 
+    def get_fingerprints(self, feed):
+        # Read from the fingerprint hash, without fetching the entries.
+        # Entries stored before it existed are missing, their posts are
+        # then just optimized again.
+        objects = self.Entry.objects
+        return set(objects.api.hvals(
+                        objects.get_fingerprint_map(feed.feed_url).name))
+
+    def get_date_newest_post(self, feed):
+        newest = self.Entry.objects.all_by_order(feed.feed_url, limit=1,
+                                                 fields=["date_published"])
+        return newest[0].get("date_published") if newest else None
+
+    def expire_old_posts(self, feed, min_posts, max_posts):
+        count = self.Entry.objects.expire(feed.feed_url, limit=min_posts,
+                                          max_posts=max_posts)
+        count and feed.posts_removed(count)
+        return count
+
     @property
     def Entry(self):
         if self._entry is None:
@@ -13,9 +13,22 @@ DEFAULT_NUM_POSTS = -1
 DEFAULT_CACHE_MIN = 30
 DEFAULT_ENTRY_WORD_LIMIT = 100
 DEFAULT_FEED_TIMEOUT = 10
+DEFAULT_FEED_TOTAL_TIMEOUT = 60
+DEFAULT_HOST_CONCURRENCY = 4
+DEFAULT_HOST_RATE = 2
+DEFAULT_HOST_BURST = 10
+DEFAULT_HOST_LIMIT_WAIT = 10
+DEFAULT_HOST_LIMIT_RETRY_DELAY = 60
+DEFAULT_REFRESH_BATCH_SIZE = 20
 DEFAULT_REFRESH_EVERY = 3 * 60 * 60             # 3 hours
 DEFAULT_FEED_LOCK_EXPIRE = 60 * 3               # lock expires in 3 minutes.
 DEFAULT_MIN_REFRESH_INTERVAL = timedelta(seconds=60 * 20)
+DEFAULT_MAX_REFRESH_INTERVAL = timedelta(days=1)
+DEFAULT_NOT_MODIFIED_BACKOFF = 1.5
+DEFAULT_ERROR_BACKOFF = 2
+DEFAULT_SUSPEND_AFTER_FAILURES = 10
+DEFAULT_PROBE_INTERVAL = timedelta(days=1)
+DEFAULT_PROBE_TIMEOUT = 5
 DEFAULT_FEED_LOCK_CACHE_KEY_FMT = "djangofeeds.import_lock.%s"
 
 """ .. data:: STORE_ENCLOSURES
@@ -51,13 +64,102 @@ MIN_REFRESH_INTERVAL = getattr(settings, "DJANGOFEEDS_MIN_REFRESH_INTERVAL",
 """
 .. data:: FEED_TIMEOUT
 
-    Timeout in seconds for the feed to refresh.
+    Timeout in seconds for connecting to the server, and for every
+    read while receiving the feed.
     Default: 10 seconds
     Taken from: ``settings.DJANGOFEEDS_FEED_TIMEOUT``.
 """
 FEED_TIMEOUT = getattr(settings, "DJANGOFEEDS_FEED_TIMEOUT",
                        DEFAULT_FEED_TIMEOUT)
 
+"""
+.. data:: FEED_TOTAL_TIMEOUT
+
+    Max time in seconds for fetching a feed, including redirects and
+    downloading the body.  Stops servers sending the feed a few bytes
+    at a time from holding on to a worker.
+    Default: 60 seconds
+    Taken from: ``settings.DJANGOFEEDS_FEED_TOTAL_TIMEOUT``.
+"""
+FEED_TOTAL_TIMEOUT = getattr(settings, "DJANGOFEEDS_FEED_TOTAL_TIMEOUT",
+                             DEFAULT_FEED_TOTAL_TIMEOUT)
+
+""" .. data:: HOST_LIMITER
+
+    Limits the requests to a single host, ``"local"`` for a limit per
+    process, ``"redis"`` for a limit shared by every worker using the
+    Redis server configured by the ``REDIS_POST_*`` settings, or the
+    name of a :class:`~djangofeeds.ratelimit.HostLimiter` class.
+    Set to ``None`` to disable.
+    Default: ``"local"``
+    Taken from: ``settings.DJANGOFEEDS_HOST_LIMITER``.
+
+"""
+HOST_LIMITER = getattr(settings, "DJANGOFEEDS_HOST_LIMITER", "local")
+
+""" .. data:: HOST_CONCURRENCY
+
+    Max number of requests in progress to a single host.
+    Default: 4
+    Taken from: ``settings.DJANGOFEEDS_HOST_CONCURRENCY``.
+
+"""
+HOST_CONCURRENCY = getattr(settings, "DJANGOFEEDS_HOST_CONCURRENCY",
+                           DEFAULT_HOST_CONCURRENCY)
+
+""" .. data:: HOST_RATE
+
+    Max number of requests per second to a single host, on average.
+    Default: 2
+    Taken from: ``settings.DJANGOFEEDS_HOST_RATE``.
+
+"""
+HOST_RATE = getattr(settings, "DJANGOFEEDS_HOST_RATE", DEFAULT_HOST_RATE)
+
+""" .. data:: HOST_BURST
+
+    Number of requests allowed in a row to a host that has been idle,
+    before :data:`HOST_RATE` kicks in.
+    Default: 10
+    Taken from: ``settings.DJANGOFEEDS_HOST_BURST``.
+
+"""
+HOST_BURST = getattr(settings, "DJANGOFEEDS_HOST_BURST", DEFAULT_HOST_BURST)
+
+""" .. data:: HOST_LIMIT_WAIT
+
+    Max seconds to wait for the host limit before giving up on a
+    refresh.
+    Default: 10
+    Taken from: ``settings.DJANGOFEEDS_HOST_LIMIT_WAIT``.
+
+"""
+HOST_LIMIT_WAIT = getattr(settings, "DJANGOFEEDS_HOST_LIMIT_WAIT",
+                          DEFAULT_HOST_LIMIT_WAIT)
+
+""" .. data:: HOST_LIMIT_RETRY_DELAY
+
+    Seconds to wait before trying again to refresh a feed
+    that hit the host limit.
+    Default: 60
+    Taken from: ``settings.DJANGOFEEDS_HOST_LIMIT_RETRY_DELAY``.
+
+"""
+HOST_LIMIT_RETRY_DELAY = getattr(settings,
+                                 "DJANGOFEEDS_HOST_LIMIT_RETRY_DELAY",
+                                 DEFAULT_HOST_LIMIT_RETRY_DELAY)
+
+""" .. data:: REFRESH_BATCH_SIZE
+
+    Max number of feeds refreshed by a single
+    :func:`~djangofeeds.tasks.refresh_feed_batch` task.
+    Default: 20
+    Taken from: ``settings.DJANGOFEEDS_REFRESH_BATCH_SIZE``.
+
+"""
+REFRESH_BATCH_SIZE = getattr(settings, "DJANGOFEEDS_REFRESH_BATCH_SIZE",
+                             DEFAULT_REFRESH_BATCH_SIZE)
+
 
 def _interval(interval):
     if isinstance(interval, int):
@@ -97,6 +199,76 @@ REFRESH_EVERY = getattr(settings, "DJANGOFEEDS_REFRESH_EVERY",
 FEED_LAST_REQUESTED_REFRESH_LIMIT = getattr(settings,
                     "FEED_LAST_REQUESTED_REFRESH_LIMIT", None)
 
+"""
+.. data:: MAX_REFRESH_INTERVAL
+
+    The longest time the scheduler waits before refreshing a feed again.
+    (in seconds)
+    Default: 1 day
+    Taken from: ``settings.DJANGOFEEDS_MAX_REFRESH_INTERVAL``.
+
+"""
+MAX_REFRESH_INTERVAL = _interval(getattr(settings,
+                                 "DJANGOFEEDS_MAX_REFRESH_INTERVAL",
+                                 DEFAULT_MAX_REFRESH_INTERVAL))
+
+""" .. data:: NOT_MODIFIED_BACKOFF
+
+    The refresh interval of a feed is multiplied by this factor for
+    each refresh in a row that didn't find any new posts.
+    Default: 1.5
+    Taken from: ``settings.DJANGOFEEDS_NOT_MODIFIED_BACKOFF``.
+
+"""
+NOT_MODIFIED_BACKOFF = getattr(settings, "DJANGOFEEDS_NOT_MODIFIED_BACKOFF",
+                               DEFAULT_NOT_MODIFIED_BACKOFF)
+
+""" .. data:: ERROR_BACKOFF
+
+    The refresh interval of a feed is multiplied by this factor for
+    each refresh in a row that failed.
+    Default: 2
+    Taken from: ``settings.DJANGOFEEDS_ERROR_BACKOFF``.
+
+"""
+ERROR_BACKOFF = getattr(settings, "DJANGOFEEDS_ERROR_BACKOFF",
+                        DEFAULT_ERROR_BACKOFF)
+
+""" .. data:: SUSPEND_AFTER_FAILURES
+
+    Deactivate a feed after this many refreshes in a row failed.
+    Suspended feeds are only probed every :data:`PROBE_INTERVAL`, and
+    activated again once they respond. Set to ``None`` to never
+    deactivate failing feeds.
+    Default: 10
+    Taken from: ``settings.DJANGOFEEDS_SUSPEND_AFTER_FAILURES``.
+
+"""
+SUSPEND_AFTER_FAILURES = getattr(settings,
+                                 "DJANGOFEEDS_SUSPEND_AFTER_FAILURES",
+                                 DEFAULT_SUSPEND_AFTER_FAILURES)
+
+"""
+.. data:: PROBE_INTERVAL
+
+    How often suspended feeds are probed for recovery. (in seconds)
+    Default: 1 day
+    Taken from: ``settings.DJANGOFEEDS_PROBE_INTERVAL``.
+
+"""
+PROBE_INTERVAL = _interval(getattr(settings, "DJANGOFEEDS_PROBE_INTERVAL",
+                                   DEFAULT_PROBE_INTERVAL))
+
+""" .. data:: PROBE_TIMEOUT
+
+    Timeout in seconds when probing a suspended feed.
+    Default: 5
+    Taken from: ``settings.DJANGOFEEDS_PROBE_TIMEOUT``.
+
+"""
+PROBE_TIMEOUT = getattr(settings, "DJANGOFEEDS_PROBE_TIMEOUT",
+                        DEFAULT_PROBE_TIMEOUT)
+
 
 """ .. data:: ROUTING_KEY_PREFIX
 
@@ -119,9 +291,23 @@ FEED_LOCK_CACHE_KEY_FMT = getattr(settings,
                             "DJANGOFEEDS_FEED_LOCK_CACHE_KEY_FMT",
                             DEFAULT_FEED_LOCK_CACHE_KEY_FMT)
 
+""" .. data:: FEED_LOCK
+
+    Lock making sure a feed is only refreshed by one worker at a time,
+    ``"cache"`` to use the Django cache, ``"redis"`` to use the Redis
+    server configured by the ``REDIS_POST_*`` settings, or the name of
+    a :class:`~djangofeeds.locks.FeedLock` class.
+    Set to ``None`` to disable.
+    Default: ``"cache"``
+    Taken from: ``settings.DJANGOFEEDS_FEED_LOCK``.
+
+"""
+FEED_LOCK = getattr(settings, "DJANGOFEEDS_FEED_LOCK", "cache")
+
 """ .. data:: FEED_LOCK_EXPIRE
 
-    Time in seconds which after the feed lock expires.
+    Time in seconds which after the feed lock expires, unless it's
+    renewed by the worker refreshing the feed.
     Default: 3 minutes
     Taken from: ``settings.DJANGOFEEDS_FEED_LOCK_EXPIRE``.
 
@@ -148,3 +334,23 @@ REDIS_POST_DB = getattr(settings,
 FSCK_ON_UPDATE = getattr(settings,
                          "DJANGOFEEDS_FSCK_ON_UPDATE",
                          False)
+
+""" .. data:: FSCK_SCAN_COUNT
+
+    Number of keys to ask for in each ``SCAN`` call when checking the
+    Redis post store.
+    Default: 1000
+    Taken from: ``settings.DJANGOFEEDS_FSCK_SCAN_COUNT``.
+
+"""
+FSCK_SCAN_COUNT = getattr(settings, "DJANGOFEEDS_FSCK_SCAN_COUNT", 1000)
+
+""" .. data:: FSCK_RATE_LIMIT
+
+    Maximum number of keys to check per second when checking the
+    Redis post store, :const:`None` for no limit.
+    Default: :const:`None`
+    Taken from: ``settings.DJANGOFEEDS_FSCK_RATE_LIMIT``.
+
+"""
+FSCK_RATE_LIMIT = getattr(settings, "DJANGOFEEDS_FSCK_RATE_LIMIT", None)
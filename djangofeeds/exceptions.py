@@ -5,6 +5,10 @@ class TimeoutError(Exception):
     """The operation timed-out."""
 
 
+class HostRateLimitedError(Exception):
+    """Too many requests to the feed's host, try again later."""
+
+
 class FeedCriticalError(Exception):
     """An unrecoverable feed error happened.
 
@@ -19,3 +23,7 @@ class FeedCriticalError(Exception):
 class FeedNotFoundError(FeedCriticalError):
     """The feed URL provided did not exist."""
     status = http.NOT_FOUND
+
+
+class FeedTooLargeError(FeedCriticalError):
+    """The feed is larger than the allowed size."""
@@ -1,5 +1,5 @@
 import time
-import urllib
+import heapq
 import urllib2
 import re
 import pytz
@@ -11,9 +11,10 @@ from django.utils.text import truncate_html_words
 from django.utils.hashcompat import md5_constructor
 
 from djangofeeds import conf
-from djangofeeds.optimization import PostContentOptimizer
+from djangofeeds.fetcher import default_fetcher
+from djangofeeds.optimization import get_content_optimizer
 from django.utils.timezone import utc
-feed_content_optimizer = PostContentOptimizer()
+feed_content_optimizer = get_content_optimizer()
 
 GUID_FIELDS = frozenset(("title", "link", "author"))
 
@@ -39,6 +40,25 @@ def safe_encode(value):
         return b64encode(value)
 
 
+def fingerprint(fields):
+    """Return a digest of post fields, used to detect if a post
+    has changed since it was last imported.
+
+    The ``feed`` and ``fingerprint`` fields are not included.
+
+    """
+    def as_str(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, basestring):
+            return safe_encode(value)
+        return str(value)
+
+    return md5sum("\0".join("%s=%s" % (key, as_str(value))
+                    for key, value in sorted(fields.items())
+                        if key not in ("feed", "fingerprint")))
+
+
 def generate_guid(entry):
     """Generate missing guid for post entry."""
     return md5sum("|".join(safe_encode(entry.get(key) or "")
@@ -80,13 +100,12 @@ def search_links_url(url, source=''):
     # For testing we pass directly the html in source
     if not source:
         try:
-            sock = urllib.urlopen(url)
-        except IOError, e:
+            response = default_fetcher.fetch(url)
+        except Exception:
             return []
-        try:
-            source = sock.read()
-        finally:
-            sock.close()
+        if not 200 <= response.status < 300:
+            return []
+        source = response.read()
 
     links = regex_html(source)
     return [urllib2.urlparse.urljoin(url, link) for link in links]
@@ -109,9 +128,23 @@ def get_entry_guid(feed_obj, entry):
     return guid
 
 
+def date_sort_key(date):
+    """Key sorting dates like :func:`format_date` would, without
+    creating a :class:`~datetime.datetime` for every date."""
+    if isinstance(date, time.struct_time):
+        return tuple(date[:6]) + (0, )
+    return (date.year, date.month, date.day, date.hour, date.minute,
+            date.second, date.microsecond)
+
+
 def entries_by_date(entries, limit=None):
     """Sort the feed entries by date
 
+    Only the ``limit`` most recent entries are picked out (with
+    :func:`heapq.nlargest`), and only these have their dates
+    normalized.  Entries with the same date are ordered last
+    entry first.
+
     :param entries: Entries given from :mod:`feedparser``.
     :param limit: Limit number of posts.
 
@@ -126,9 +159,18 @@ def entries_by_date(entries, limit=None):
                 entry.get("date_parsed") or
                 now - timedelta(seconds=(counter * 30)))
 
+    # The counter breaks ties, so entries are never compared.
+    candidates = ((date_sort_key(date), counter, date, entry)
+                    for counter, entry in enumerate(entries)
+                        for date in (find_date(entry, counter), ))
+    if limit is not None and limit >= 0:
+        selected = heapq.nlargest(limit, candidates)
+    else:
+        selected = sorted(candidates, reverse=True)[:limit]
+
     sorted_entries = []
-    for counter, entry in enumerate(entries):
-        date = format_date(find_date(entry, counter))
+    for _key, _counter, date, entry in selected:
+        date = format_date(date)
         # the found date is put into the entry
         # because some feed just don't have any valid dates.
         # This will ensure that the posts will be properly ordered
@@ -136,15 +178,13 @@ def entries_by_date(entries, limit=None):
         entry["updated_parsed"] = date.timetuple()
         entry["published_parsed"] = entry.get("published_parsed") or \
                                         date.timetuple()
-        sorted_entries.append((date, entry))
-
-    sorted_entries.sort(key=lambda key: key[0])
-    sorted_entries.reverse()
-    return [entry for _date, entry in sorted_entries[:limit]]
+        sorted_entries.append(entry)
+    return sorted_entries
 
 
-def find_post_content(feed_obj, entry):
-    """Find the correct content field for a post."""
+def find_raw_post_content(feed_obj, entry):
+    """Find the correct content field for a post, without
+    truncating or optimizing it (see :func:`optimize_post_content`)."""
     try:
         content = entry["content"][0]["value"]
     except (IndexError, KeyError):
@@ -153,6 +193,7 @@ def find_post_content(feed_obj, entry):
     if '<img' not in content:
         # if there's no image and the we add an image to the feed
         def build_img(img_dict):
+            img_dict = dict(img_dict)
             try:
                 # The tag is url instead of src... pain
                 img = "<img src='%s'" % img_dict.get("url")
@@ -170,6 +211,11 @@ def find_post_content(feed_obj, entry):
         except (IndexError, KeyError):
             img = ""
         content = img + content
+    return content
+
+
+def optimize_post_content(content):
+    """Truncate post content and remove trackers and excessive markup."""
     try:
         content = truncate_html_words(content, conf.DEFAULT_ENTRY_WORD_LIMIT)
     except UnicodeDecodeError:
@@ -178,6 +224,11 @@ def find_post_content(feed_obj, entry):
     return feed_content_optimizer.optimize(content)
 
 
+def find_post_content(feed_obj, entry):
+    """Find the correct content field for a post."""
+    return optimize_post_content(find_raw_post_content(feed_obj, entry))
+
+
 def date_to_datetime(field_name):
     """Given a post field, convert its :mod:`feedparser` date tuple to
     :class:`datetime.datetime` objects.
@@ -1,15 +1,22 @@
+from __future__ import with_statement
+
 import time
 import socket
 import feedparser
 import httplib as http
-import urllib2
 
 from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
 from djangofeeds import conf
 from djangofeeds import models
 from djangofeeds import feedutil
 from djangofeeds import exceptions
+from djangofeeds.stats import RefreshStats
+from djangofeeds.fetcher import default_fetcher, is_http_url, Response
+from djangofeeds.ratelimit import limiter_or_default, host_for_url
 from djangofeeds.utils import get_default_logger, truncate_field_data
 from djangofeeds.backends import backend_or_default
 from django.utils.timezone import utc
@@ -24,6 +31,10 @@ class FeedImporter(object):
     :keyword include_categories: See :attr:`include_categories`.
     :keyword include_enclosures: See :attr:`include_enclosures`.
     :keyword timeout: See :attr:`timeout`.
+    :keyword fetcher: See :attr:`fetcher`.
+    :keyword limiter: See :attr:`limiter`.
+    :keyword stats: See :attr:`stats`.
+    :keyword postpone_rate_limited: See :attr:`postpone_rate_limited`.
 
     .. attribute:: post_limit
 
@@ -47,24 +58,53 @@ class FeedImporter(object):
 
     .. attribute:: timeout
 
-        Default feed timeout.
+        Default feed timeout, either a number of seconds or a
+        :class:`~djangofeeds.fetcher.Timeout`.
+
+    .. attribute:: fetcher
+
+        The :class:`~djangofeeds.fetcher.FeedFetcher` used to fetch
+        HTTP feeds.  (Default:
+        :data:`~djangofeeds.fetcher.default_fetcher`, reusing
+        connections with every other importer in the process.)
+
+    .. attribute:: limiter
+
+        The :class:`~djangofeeds.ratelimit.HostLimiter` limiting
+        requests to a single host (see
+        :data:`~djangofeeds.conf.HOST_LIMITER`).
 
     .. attribute:: parser
 
         The feed parser used. (Default: :mod:`feedparser`.)
 
+    .. attribute:: stats
+
+        :class:`~djangofeeds.stats.RefreshStats` instance counting
+        the outcome of every feed refresh.
+
+    .. attribute:: postpone_rate_limited
+
+        By default, feeds that can't be refreshed because their host
+        is rate limited are postponed by
+        :data:`~djangofeeds.conf.HOST_LIMIT_RETRY_DELAY`.  If disabled,
+        :meth:`update_feed` raises
+        :exc:`~djangofeeds.exceptions.HostRateLimitedError` instead,
+        so the caller can retry.
+
     """
     parser = feedparser
     post_limit = conf.DEFAULT_POST_LIMIT
     include_categories = conf.STORE_CATEGORIES
     include_enclosures = conf.STORE_ENCLOSURES
     update_on_import = True
+    postpone_rate_limited = True
     post_model = models.Post
     feed_model = models.Feed
     category_model = models.Category
     enclosure_model = models.Enclosure
     post_field_handlers = {
-        "content": feedutil.find_post_content,
+        "content": feedutil.find_raw_post_content,
         "date_published": feedutil.date_to_datetime("published_parsed"),
         "date_updated": feedutil.date_to_datetime("updated_parsed"),
         "link": lambda feed_obj, entry: entry.get("link") or feed_obj.feed_url,
@@ -74,6 +114,9 @@ class FeedImporter(object):
                                                     "(no title)").strip(),
         "author": lambda feed_obj, entry: entry.get("author", "").strip(),
     }
+    post_field_optimizers = {
+        "content": feedutil.optimize_post_content,
+    }
 
     def __init__(self, **kwargs):
         self.post_limit = kwargs.get("post_limit", self.post_limit)
@@ -85,11 +128,16 @@ class FeedImporter(object):
         self.include_enclosures = kwargs.get("include_enclosures",
                                         self.include_enclosures)
         self.timeout = kwargs.get("timeout", conf.FEED_TIMEOUT)
+        self.fetcher = kwargs.get("fetcher") or default_fetcher
+        self.limiter = limiter_or_default(kwargs.get("limiter"))
+        self.stats = kwargs.get("stats") or RefreshStats()
+        self.postpone_rate_limited = kwargs.get("postpone_rate_limited",
+                                        self.postpone_rate_limited)
         self.backend = backend_or_default(kwargs.get("backend"))
         self.post_model = self.backend.get_post_model()
 
     def parse_feed(self, feed_url, etag=None, modified=None, timeout=None,
-            maxlen=None):
+            maxlen=None, body_digest=None, parse=True):
         """Parse feed using the current feed parser.
 
         :param feed_url: URL to the feed to parse.
@@ -97,42 +145,112 @@ class FeedImporter(object):
         :keyword etag: E-tag recevied from last parse (if any).
         :keyword modified: ``Last-Modified`` HTTP header received from last
             parse (if any).
-        :keyword timeout: Parser timeout in seconds.
+        :keyword timeout: :class:`~djangofeeds.fetcher.Timeout` or
+            number of seconds, default is :attr:`timeout`.
+        :keyword maxlen: Max size of the feed in bytes.  The download
+            is aborted as soon as more than this has been received.
+        :keyword body_digest: Digest of the body received from last
+            parse (if any).  If the body is the same it is not parsed,
+            and the result only has the ``status``, ``href``, ``etag``,
+            ``body_digest`` and ``body_unchanged`` keys.
+
+        :keyword parse: If false, return what would have been parsed
+            instead (the :class:`~djangofeeds.fetcher.Response`, or
+            ``feed_url`` if it's not a HTTP URL), see :meth:`parse_fields`.
+            Not modified responses have nothing to parse, so the result
+            only has the ``status``, ``href`` and ``etag`` keys.
+
+        The digest of the body is stored in the ``body_digest`` key
+        of the result.
+
+        :raises djangofeeds.exceptions.FeedTooLargeError: if the feed
+            is larger than ``maxlen``.
+        :raises djangofeeds.exceptions.HostRateLimitedError: if the
+            :attr:`limiter` didn't allow a request to the host in time.
 
         """
-        prev_timeout = socket.getdefaulttimeout()
-        timeout = timeout or self.timeout
+        if not is_http_url(feed_url):
+            if not parse:
+                return feed_url
+            return self.parser.parse(feed_url, etag=etag, modified=modified)
+
+        response = self.fetch(feed_url, etag=etag, modified=modified,
+                              timeout=timeout or self.timeout, maxlen=maxlen)
+        digest = response.digest
+        if digest == body_digest and response.status != http.NOT_MODIFIED \
+                and response.status in models.ACCEPTED_STATUSES:
+            return feedparser.FeedParserDict(status=response.status,
+                                    href=response.url,
+                                    etag=response.headers.get("etag"),
+                                    body_digest=digest,
+                                    body_unchanged=True)
+        if not parse:
+            if response.status == http.NOT_MODIFIED:
+                return feedparser.FeedParserDict(status=response.status,
+                                    href=response.url,
+                                    etag=response.headers.get("etag"))
+            return response
+        return self.parse_response(response)
+
+    def parse_response(self, response):
+        """Parse a :class:`~djangofeeds.fetcher.Response`."""
+        feed = self.parser.parse(response)
+        feed["body_digest"] = response.digest
+        return feed
 
-        socket.setdefaulttimeout(timeout)
-        try:
-            if maxlen:
-                headers = self.early_headers(feed_url)
-                contentlen = int(headers.get("content-length") or 0)
-                if contentlen > maxlen:
-                    raise exceptions.FeedCriticalError(
-                        unicode(models.FEED_GENERIC_ERROR_TEXT))
-
-            feed = self.parser.parse(feed_url,
-                                     etag=etag,
-                                     modified=modified)
-        finally:
-            socket.setdefaulttimeout(prev_timeout)
+    def parse_fields(self, feed_obj, source, fingerprints=()):
+        """Parse a feed fetched with ``parse=False``, and the fields of
+        its posts, without touching the database.
 
-        return feed
+        The result can be passed on to :meth:`update_feed`, which then
+        only has to write the posts.  This is the CPU bound part of a
+        refresh, see :class:`ProcessFeedRefresher`.
 
-    def early_headers(self, feed_url):
+        :param feed_obj: The Feed object.
+        :param source: As returned by :meth:`fetch_feed` with
+            ``parse=False``.
+        :keyword fingerprints: Fingerprints of the posts already stored,
+            these posts are not optimized (see
+            :meth:`post_fields_unoptimized`).
 
-        class HeadRequest(urllib2.Request):
+        """
+        if isinstance(source, Response):
+            feed = self.parse_response(source)
+        else:
+            feed = self.parser.parse(source)
+        # Not always picklable.
+        feed.pop("bozo_exception", None)
+        entries = feedutil.entries_by_date(feed.get("entries", []),
+                                           self.post_limit)
+        post_fields, optimized = [], set()
+        for entry in entries:
+            fields = self.post_fields_unoptimized(entry, feed_obj)
+            if fields["fingerprint"] not in fingerprints:
+                fields = self.optimize_post_fields(fields)
+                optimized.add(fields["fingerprint"])
+            post_fields.append(fields)
+        feed["entries"] = entries
+        feed["post_fields"] = post_fields
+        feed["optimized"] = optimized
+        return feed
 
-            def get_method(self):
-                return "HEAD"
+    def fetch(self, feed_url, **kwargs):
+        """Fetch ``feed_url`` using :attr:`fetcher`, within the
+        host limits."""
+        if self.limiter is None:
+            return self.fetcher.fetch(feed_url, **kwargs)
+        with self.limiter.limit(host_for_url(feed_url)):
+            return self.fetcher.fetch(feed_url, **kwargs)
 
-        return urllib2.urlopen(HeadRequest(feed_url)).headers
+    def early_headers(self, feed_url, timeout=None):
+        return self.fetcher.head(feed_url,
+                                 timeout=timeout or self.timeout).headers
 
     def real_headers(self, feed_url):
-        return urllib2.urlopen(urllib2.Request(feed_url))
+        return self.fetcher.fetch(feed_url, timeout=self.timeout)
 
-    def import_feed(self, feed_url, force=None, local=False):
+    def import_feed(self, feed_url, force=None, local=False,
+            ignore_validators=False, scheduled=False):
         """Import feed.
 
         If feed is not seen before it will be created, otherwise
@@ -141,6 +259,8 @@ class FeedImporter(object):
         :param feed_url: URL to the feed to import.
         :keyword force: Force import of feed even if it's been updated
             recently.
+        :keyword ignore_validators: See :meth:`fetch_feed`.
+        :keyword scheduled: See :meth:`update_feed`.
         """
         feed_url = feed_url.strip()
         feed = None
@@ -153,6 +273,11 @@ class FeedImporter(object):
                 self.feed_model.objects.create(feed_url=feed_url, sort=0)
                 raise exceptions.TimeoutError(
                         unicode(models.FEED_TIMEDOUT_ERROR_TEXT))
+            except exceptions.HostRateLimitedError:
+                raise
+            except (IOError, http.HTTPException):
+                # Could not connect, treated as a missing feed.
+                feed = {}
             except Exception:
                 feed = {"status": 500}
 
@@ -187,7 +312,9 @@ class FeedImporter(object):
             feed_obj.categories.add(*self.get_categories(feed.channel))
 
         if self.update_on_import:
-            feed_obj = self.update_feed(feed_obj, feed=feed, force=force)
+            feed_obj = self.update_feed(feed_obj, feed=feed, force=force,
+                                    ignore_validators=ignore_validators,
+                                    scheduled=scheduled)
 
         return feed_obj
 
@@ -207,7 +334,87 @@ class FeedImporter(object):
                       name=name.strip(),
                       domain=domain and domain.strip() or "")
 
-    def update_feed(self, feed_obj, feed=None, force=False):
+    def is_fresh(self, feed_obj, now=None):
+        """Return true if the feed has been refreshed within
+        :data:`~djangofeeds.conf.MIN_REFRESH_INTERVAL`."""
+        now = now or datetime.utcnow().replace(tzinfo=utc)
+        return bool(feed_obj.date_last_refresh and
+                    now < feed_obj.date_last_refresh +
+                    conf.MIN_REFRESH_INTERVAL)
+
+    def fetch_feed(self, feed_obj, ignore_validators=False, timeout=None,
+            parse=True):
+        """Fetch and parse an existing feed.
+
+        Does not touch the database, so it is safe to call from
+        worker threads.  The result can be passed on to :meth:`update_feed`.
+
+        :param feed_obj: the Feed object
+        :keyword ignore_validators: Don't send the E-tag and
+            ``Last-Modified`` headers from the previous refresh, so
+            the whole feed is downloaded even if it has not changed,
+            and parse it even if the body is the same as last time.
+        :keyword timeout: Timeout in seconds, default is :attr:`timeout`.
+        :keyword parse: See :meth:`parse_feed`.
+
+        """
+        last_modified = etag = body_digest = None
+        if not ignore_validators:
+            if feed_obj.http_last_modified:
+                last_modified = feed_obj.http_last_modified.timetuple()
+            etag = feed_obj.http_etag or None
+            body_digest = feed_obj.http_body_digest or None
+        if etag or last_modified:
+            self.stats.incr("conditional")
+
+        return self.parse_feed(feed_obj.feed_url,
+                               etag=etag,
+                               modified=last_modified,
+                               timeout=timeout,
+                               body_digest=body_digest,
+                               parse=parse)
+
+    def probe_feed(self, feed_obj):
+        """Check if a suspended feed responds again.
+
+        Sends a conditional request with the short
+        :data:`~djangofeeds.conf.PROBE_TIMEOUT`, and does not import
+        anything.
+
+        :returns: :const:`True` if the feed could be fetched.
+
+        """
+        try:
+            feed = self.fetch_feed(feed_obj, timeout=conf.PROBE_TIMEOUT)
+        except Exception:
+            return False
+        if "status" not in feed and not feed.get("entries"):
+            # The parser hides network errors, nothing was received.
+            return False
+        return not feed_obj.is_error_status(feed.get("status", http.OK))
+
+    def save_fetch_error(self, feed_obj, exc):
+        """Record the exception raised by :meth:`fetch_feed` on the feed.
+
+        :raises djangofeeds.exceptions.HostRateLimitedError: if the host
+            is rate limited, and :attr:`postpone_rate_limited` is
+            disabled.
+
+        """
+        if isinstance(exc, exceptions.HostRateLimitedError):
+            # Not the feed's fault, try again soon.
+            self.stats.incr("rate_limited")
+            if not self.postpone_rate_limited:
+                raise exc
+            feed_obj.postpone(conf.HOST_LIMIT_RETRY_DELAY)
+            return feed_obj
+        self.stats.incr("errors")
+        if isinstance(exc, socket.timeout):
+            return feed_obj.save_timeout_error()
+        return feed_obj.save_generic_error()
+
+    def update_feed(self, feed_obj, feed=None, force=False,
+            ignore_validators=False, scheduled=False):
         """Update (refresh) feed.
 
         The feed must already exist in the system, if not you have
@@ -215,53 +422,86 @@ class FeedImporter(object):
 
         :param feed_obj: the Feed object
         :keyword feed: If feed has already been parsed you can pass the
-            structure returned by the parser so it doesn't have to be parsed
-            twice.
+            structure returned by the parser (or :meth:`parse_fields`)
+            so it doesn't have to be parsed twice.
         :keyword force: Force refresh of the feed even if it has been
-            recently refreshed already.
+            recently refreshed already.  The feed is still only
+            downloaded if it has been modified, unless
+            ``ignore_validators`` is set.
+        :keyword ignore_validators: See :meth:`fetch_feed`.
+        :keyword scheduled: The feed was selected by
+            :meth:`~djangofeeds.managers.FeedManager.due`, which already
+            applied its backoff, so it's refreshed even though
+            dispatching it moved :attr:`next_refresh_at` ahead.
 
         """
         now = datetime.utcnow().replace(tzinfo=utc)
-        already_fresh = (feed_obj.date_last_refresh and
-                         now < feed_obj.date_last_refresh +
-                         conf.MIN_REFRESH_INTERVAL)
+        self.stats.incr("feeds")
 
-        if already_fresh and not force:
+        if self.is_fresh(feed_obj, now) and not force:
             self.logger.info(
                     "Feed %s is fresh. Skipping refresh." % feed_obj.feed_url)
+            self.stats.incr("fresh")
+            return feed_obj
+
+        if feed_obj.is_backing_off(now) and not (force or scheduled):
+            self.logger.info("Feed %s failed %d times in a row. "
+                             "Skipping refresh until %s." % (
+                                feed_obj.feed_url, feed_obj.failure_count,
+                                feed_obj.next_refresh_at))
+            self.stats.incr("backoff")
             return feed_obj
 
+        # Suspended feeds refreshed anyway are activated again if the
+        # refresh succeeds.
+        suspended = feed_obj.is_suspended
         limit = self.post_limit
         if not feed:
-            last_modified = None
-            if feed_obj.http_last_modified and not force:
-                last_modified = feed_obj.http_last_modified.timetuple()
-            etag = feed_obj.http_etag if not force else None
-
             try:
-                feed = self.parse_feed(feed_obj.feed_url,
-                                       etag=etag,
-                                       modified=last_modified)
-            except socket.timeout:
-                return feed_obj.save_timeout_error()
-            except Exception:
-                return feed_obj.save_generic_error()
+                feed = self.fetch_feed(feed_obj,
+                                       ignore_validators=ignore_validators)
+            except Exception, exc:
+                return self.save_fetch_error(feed_obj, exc)
 
         # Feed can be local/ not fetched with HTTP client.
         status = feed.get("status", http.OK)
-        if status == http.NOT_MODIFIED and not force:
+        if status == http.NOT_MODIFIED or feed.get("body_unchanged"):
+            # Unchanged bodies are counted apart from real 304s.
+            self.stats.incr("unchanged" if feed.get("body_unchanged")
+                                else "not_modified")
+            feed_obj.not_modified_count += 1
+            if suspended:
+                feed_obj.reactivate()
+            feed_obj.failure_count = 0
+            feed_obj.last_error = u""
+            feed_obj.schedule_refresh(now, save=True)
             return feed_obj
 
         if feed_obj.is_error_status(status):
+            self.stats.incr("errors")
             return feed_obj.set_error_status(status)
 
-        if feed.entries:
+        post_count = feed_obj.post_count
+        if feed.entries and "post_fields" in feed:
+            self.import_entries(feed.entries, feed_obj,
+                                post_fields=feed["post_fields"],
+                                optimized=feed["optimized"])
+        elif feed.entries:
             sorted_by_date = feedutil.entries_by_date(feed.entries, limit)
-            for entry in sorted_by_date:
-                self.import_entry(entry, feed_obj)
-
+            self.import_entries(sorted_by_date, feed_obj)
+        if feed_obj.post_count > post_count:
+            feed_obj.not_modified_count = 0
+        else:
+            feed_obj.not_modified_count += 1
+
+        if suspended:
+            feed_obj.reactivate()
         feed_obj.date_last_refresh = now
+        feed_obj.last_error = u""
+        feed_obj.failure_count = 0
+        feed_obj.schedule_refresh(now)
         feed_obj.http_etag = feed.get("etag", "")
+        feed_obj.http_body_digest = feed.get("body_digest", "")
         if hasattr(feed, "modified") and feed.modified:
             try:
                 as_ts = time.mktime(feed.modified)
@@ -273,7 +513,8 @@ class FeedImporter(object):
         self.logger.debug("uf: %s Saving feed object..." % (
                             feed_obj.feed_url))
 
-        feed_obj.save()
+        feed_obj.save_state()
+        self.stats.incr("updated")
         return feed_obj
 
     def create_enclosure(self, **kwargs):
@@ -291,8 +532,28 @@ class FeedImporter(object):
 
     def post_fields_parsed(self, entry, feed_obj):
         """Parse post fields."""
-        return dict((key, handler(feed_obj, entry))
+        return self.optimize_post_fields(
+                    self.post_fields_unoptimized(entry, feed_obj))
+
+    def post_fields_unoptimized(self, entry, feed_obj):
+        """Parse post fields, but leave out the expensive
+        :attr:`post_field_optimizers`.
+
+        The fingerprint is calculated from these fields, so it can be used
+        to find out if the post has changed before optimizing it.
+
+        """
+        fields = dict((key, handler(feed_obj, entry))
                         for key, handler in self.post_field_handlers.items())
+        fields["fingerprint"] = feedutil.fingerprint(fields)
+        return fields
+
+    def optimize_post_fields(self, fields):
+        """Apply :attr:`post_field_optimizers` to parsed post fields."""
+        for key, optimize in self.post_field_optimizers.items():
+            if key in fields:
+                fields[key] = optimize(fields[key])
+        return fields
 
     def import_entry(self, entry, feed_obj):
         """Import feed post entry."""
@@ -310,3 +571,209 @@ class FeedImporter(object):
             feed_obj.feed_url))
 
         return post
+
+    def import_entries(self, entries, feed_obj, post_fields=None,
+            optimized=()):
+        """Import a list of feed post entries in bulk.
+
+        :keyword post_fields: The fields of the entries, if they have
+            already been parsed (see :meth:`parse_fields`).
+        :keyword optimized: Fingerprints of the ``post_fields``
+            already optimized.
+
+        """
+        self.logger.debug("ie: %s Importing %d entries..." % (
+            feed_obj.feed_url, len(entries)))
+
+        def prepare(fields):
+            # Only called for posts that are new or changed.
+            self.stats.incr("entries_written")
+            if fields["fingerprint"] in optimized:
+                return fields
+            return self.optimize_post_fields(fields)
+
+        fields = post_fields
+        if fields is None:
+            fields = [self.post_fields_unoptimized(entry, feed_obj)
+                        for entry in entries]
+        posts = self.post_model.objects.bulk_upsert(feed_obj, fields,
+                        prepare=prepare,
+                        fetch_pks=self.include_enclosures or
+                                  self.include_categories)
+        self.stats.incr("entries", len(fields))
+
+        if self.include_enclosures or self.include_categories:
+            for entry, post in zip(entries, posts):
+                if post is None:
+                    continue
+                if self.include_enclosures:
+                    post.enclosures.add(*(self.get_enclosures(entry) or []))
+                if self.include_categories:
+                    post.categories.add(*(self.get_categories(entry) or []))
+
+        self.logger.debug("ie: %s %d entries successfully imported..." % (
+            feed_obj.feed_url, len(posts)))
+
+        return posts
+
+
+class ThreadedFeedRefresher(object):
+    """Refresh many feeds using a pool of threads for fetching.
+
+    Fetching and parsing happens in the worker threads, while all
+    database writes are serialized in the thread calling :meth:`refresh`.
+
+    :keyword importer: See :attr:`importer`.
+    :keyword workers: See :attr:`workers`.
+    :keyword chunksize: See :attr:`chunksize`.
+
+    .. attribute:: importer
+
+        The :class:`FeedImporter` used to fetch and update feeds.
+
+    .. attribute:: workers
+
+        Number of threads fetching feeds concurrently.
+
+    .. attribute:: chunksize
+
+        Number of feeds handed to the pool at a time, this bounds the
+        number of parsed feeds held in memory.  Default is four times
+        the number of workers.
+
+    """
+    workers = 10
+
+    def __init__(self, importer=None, workers=None, chunksize=None):
+        self.importer = importer or FeedImporter()
+        self.workers = workers or self.workers
+        self.chunksize = chunksize or self.workers * 4
+
+    @property
+    def stats(self):
+        return self.importer.stats
+
+    def fetch(self, feed_obj):
+        """Fetch a feed in a worker thread.
+
+        :returns: ``(feed_obj, feed, exc)`` tuple, where ``feed`` is
+            :const:`None` if the feed is fresh, backing off after errors,
+            or the fetch failed.
+
+        """
+        if self.importer.is_fresh(feed_obj) or feed_obj.is_backing_off():
+            return feed_obj, None, None
+        try:
+            return feed_obj, self.fetch_feed(feed_obj), None
+        except Exception, exc:
+            return feed_obj, None, exc
+
+    def fetch_feed(self, feed_obj):
+        return self.importer.fetch_feed(feed_obj)
+
+    def write(self, feed_obj, feed, exc):
+        """Store the result of :meth:`fetch` in the database."""
+        if exc is not None:
+            self.importer.stats.incr("feeds")
+            return self.importer.save_fetch_error(feed_obj, exc)
+        # update_feed skips fresh and backing off feeds by itself.
+        return self.importer.update_feed(feed_obj, feed=feed)
+
+    def refresh(self, feeds):
+        """Refresh feeds, yielding the feed objects as they are stored.
+
+        :param feeds: Iterable of feed objects.
+
+        """
+        feeds = iter(feeds)
+        pool = ThreadPool(self.workers)
+        try:
+            while True:
+                chunk = list(islice(feeds, self.chunksize))
+                if not chunk:
+                    break
+                for result in pool.imap_unordered(self.fetch, chunk):
+                    yield self.write(*result)
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+_worker_importers = {}
+
+
+def _parse_fields(importer_cls, post_limit, feed_obj, source, fingerprints):
+    # Runs in the pool processes of ProcessFeedRefresher.
+    importer = _worker_importers.get((importer_cls, post_limit))
+    if importer is None:
+        importer = _worker_importers[(importer_cls, post_limit)] = \
+                        importer_cls(post_limit=post_limit)
+    return importer.parse_fields(feed_obj, source, fingerprints)
+
+
+class ProcessFeedRefresher(ThreadedFeedRefresher):
+    """Refresh many feeds using threads for fetching, and a pool
+    of processes for parsing.
+
+    Fetching feeds is I/O bound, but parsing them and optimizing the
+    posts is CPU bound, so in :class:`ThreadedFeedRefresher` it can't
+    use more than one core.  Here the fetched feeds are parsed by
+    :meth:`FeedImporter.parse_fields` in :attr:`processes` worker
+    processes, while database access still only happens in the
+    thread calling :meth:`refresh`.
+
+    :keyword processes: See :attr:`processes`.
+
+    .. attribute:: processes
+
+        Number of processes parsing feeds, default is the number of
+        CPUs.
+
+    """
+    processes = None
+
+    def __init__(self, importer=None, workers=None, chunksize=None,
+            processes=None):
+        super(ProcessFeedRefresher, self).__init__(importer, workers,
+                                                   chunksize)
+        self.processes = processes or self.processes
+
+    def fetch_feed(self, feed_obj):
+        return self.importer.fetch_feed(feed_obj, parse=False)
+
+    def parse(self, parsers, feed_obj, source):
+        """Send a fetched feed to the ``parsers`` pool."""
+        return parsers.apply_async(_parse_fields, (
+                    self.importer.__class__, self.importer.post_limit,
+                    feed_obj, source,
+                    self.importer.backend.get_fingerprints(feed_obj)))
+
+    def refresh(self, feeds):
+        feeds = iter(feeds)
+        pool = ThreadPool(self.workers)
+        parsers = Pool(self.processes)
+        try:
+            while True:
+                chunk = list(islice(feeds, self.chunksize))
+                if not chunk:
+                    break
+                parsing = []
+                for feed_obj, source, exc in pool.imap_unordered(self.fetch,
+                                                                 chunk):
+                    if source is None or isinstance(source, dict):
+                        # Failed, skipped, or the body has not changed.
+                        yield self.write(feed_obj, source, exc)
+                    else:
+                        parsing.append((feed_obj, self.parse(
+                                                parsers, feed_obj, source)))
+                for feed_obj, result in parsing:
+                    try:
+                        feed, exc = result.get(), None
+                    except Exception, exc:
+                        feed = None
+                    yield self.write(feed_obj, feed, exc)
+        finally:
+            pool.terminate()
+            pool.join()
+            parsers.terminate()
+            parsers.join()
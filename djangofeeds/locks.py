@@ -0,0 +1,291 @@
+"""Locks making sure a feed is only refreshed by one worker at a time."""
+from __future__ import with_statement
+
+import time
+import heapq
+import itertools
+import threading
+from uuid import uuid4
+
+from djangofeeds import conf
+from djangofeeds.backends import symbol_by_name
+from djangofeeds.stats import RefreshStats
+
+LOCK_ALIASES = {
+    "cache": "djangofeeds.locks.CacheLock",
+    "redis": "djangofeeds.locks.RedisLock",
+}
+
+""" .. data:: stats
+
+    Lock counters for this process: ``acquired``, ``contended``
+    (someone else had the lock) and ``lost`` (the lock expired
+    before it was released).
+
+"""
+stats = RefreshStats()
+
+
+class LockRenewer(object):
+    """Renew all the locks held by this process from a single thread.
+
+    The locks are kept in a heap ordered by when they are due for
+    renewal, so the thread only wakes up when there is something to
+    do, however many locks are held.
+
+    """
+
+    def __init__(self):
+        self._due = []
+        self._seq = itertools.count()
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def add(self, lock):
+        """Renew ``lock`` every :attr:`~FeedLock.renew_interval`
+        seconds until it's released."""
+        with self._changed:
+            self._schedule(lock)
+            if self._thread is None or not self._thread.is_alive():
+                # Not running yet, or we are in a forked child.
+                self._thread = threading.Thread(target=self.run,
+                                            name="djangofeeds-lock-renewer")
+                self._thread.daemon = True
+                self._thread.start()
+            self._changed.notify()
+
+    def _schedule(self, lock):
+        heapq.heappush(self._due, (time.time() + lock.renew_interval,
+                                   self._seq.next(), lock))
+
+    def _next_due(self):
+        with self._changed:
+            while True:
+                # Released locks are dropped when they come up.
+                while self._due and not self._due[0][2].held:
+                    heapq.heappop(self._due)
+                if not self._due:
+                    self._changed.wait()
+                    continue
+                delay = self._due[0][0] - time.time()
+                if delay <= 0:
+                    return heapq.heappop(self._due)[2]
+                self._changed.wait(delay)
+
+    def run(self):
+        while True:
+            lock = self._next_due()
+            try:
+                renewed = lock.renew_if_held()
+            except Exception:
+                # e.g. the server is down, try again next time.
+                renewed = lock.held
+            if renewed:
+                with self._changed:
+                    self._schedule(lock)
+
+
+""" .. data:: renewer
+
+    :class:`LockRenewer` renewing the locks held by this process.
+
+"""
+renewer = LockRenewer()
+
+
+class FeedLock(object):
+    """Lock expiring after :attr:`expire` seconds, unless renewed.
+
+    While the lock is held it is renewed every :attr:`renew_interval`
+    seconds (by the :data:`renewer` shared by all locks in the
+    process), so long refreshes are not refreshed again by someone
+    else.
+
+    :param key: Name of the lock.
+    :keyword expire: See :attr:`expire`.
+
+    .. attribute:: expire
+
+        Seconds before the lock expires.  Default is
+        :data:`~djangofeeds.conf.FEED_LOCK_EXPIRE`.
+
+    .. attribute:: token
+
+        Unique value identifying this holder of the lock.
+
+    .. attribute:: renew_interval
+
+        Seconds between renewals, a third of :attr:`expire`.
+
+    """
+
+    def __init__(self, key, expire=None, **kwargs):
+        self.key = key
+        self.expire = expire or conf.FEED_LOCK_EXPIRE
+        self.renew_interval = self.expire / 3.0
+        self.token = uuid4().hex
+        self.held = False
+        self._mutex = threading.Lock()
+
+    def _acquire(self):
+        raise NotImplementedError("FeedLock._acquire")
+
+    def _release(self):
+        raise NotImplementedError("FeedLock._release")
+
+    def renew(self):
+        """Extend the lock :attr:`expire` seconds from now.
+
+        :returns: :const:`False` if the lock is no longer ours.
+
+        """
+        raise NotImplementedError("FeedLock.renew")
+
+    def acquire(self):
+        """Try to acquire the lock, without blocking.
+
+        :returns: :const:`True` if the lock was acquired.
+
+        """
+        if not self._acquire():
+            stats.incr("contended")
+            return False
+        stats.incr("acquired")
+        self.held = True
+        renewer.add(self)
+        return True
+
+    def release(self):
+        """Release the lock, if it's still ours."""
+        with self._mutex:
+            # Waits for a renewal in progress, so it can't
+            # take the lock again after it's released.
+            self.held = False
+            self._release()
+
+    def renew_if_held(self):
+        """Renew the lock unless it has been released.
+
+        :returns: :const:`True` if it should be renewed again later.
+
+        """
+        with self._mutex:
+            if not self.held:
+                return False
+            if not self.renew():
+                stats.incr("lost")
+                return False
+            return True
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        if self.held:
+            self.release()
+
+
+class CacheLock(FeedLock):
+    """:class:`FeedLock` using the Django cache.
+
+    Acquiring the lock is atomic (``cache.add``), release and renewal
+    are only as atomic as the cache backend allows.
+
+    :keyword cache: The cache to use, default is the Django cache.
+
+    """
+
+    def __init__(self, key, expire=None, cache=None, **kwargs):
+        super(CacheLock, self).__init__(key, expire, **kwargs)
+        if cache is None:
+            from django.core.cache import cache
+        self.cache = cache
+
+    def _acquire(self):
+        return self.cache.add(self.key, self.token, self.expire)
+
+    def _release(self):
+        if self.cache.get(self.key) == self.token:
+            self.cache.delete(self.key)
+
+    def renew(self):
+        if self.cache.get(self.key) != self.token:
+            return False
+        self.cache.set(self.key, self.token, self.expire)
+        return True
+
+
+class RedisLock(FeedLock):
+    """:class:`FeedLock` using the Redis server configured by the
+    ``REDIS_POST_*`` settings.
+
+    The lock is acquired with ``SET NX PX``, and only released or
+    renewed by the holder of the lock.
+
+    :keyword client: :class:`redis.Redis` instance to use.
+
+    """
+
+    # KEYS: lock.  ARGV: token, expire in milliseconds.
+    renew_script = """
+        if redis.call("GET", KEYS[1]) == ARGV[1] then
+            return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+
+    # KEYS: lock.  ARGV: token.
+    release_script = """
+        if redis.call("GET", KEYS[1]) == ARGV[1] then
+            return redis.call("DEL", KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, key, expire=None, client=None, **kwargs):
+        super(RedisLock, self).__init__(key, expire, **kwargs)
+        if client is None:
+            from redish.client import Client
+            client = Client(host=conf.REDIS_POST_HOST,
+                            port=conf.REDIS_POST_PORT,
+                            db=conf.REDIS_POST_DB).api
+        self.client = client
+
+    @property
+    def expire_ms(self):
+        return int(self.expire * 1000)
+
+    def _acquire(self):
+        return bool(self.client.set(self.key, self.token,
+                                    px=self.expire_ms, nx=True))
+
+    def _release(self):
+        self.client.eval(self.release_script, 1, self.key, self.token)
+
+    def renew(self):
+        return bool(self.client.eval(self.renew_script, 1, self.key,
+                                     self.token, self.expire_ms))
+
+
+def feed_lock(feed_url, expire=None, lock=None, **kwargs):
+    """Lock for refreshing the feed at ``feed_url``, or :const:`None`
+    if locks are disabled.
+
+    Feeds are always locked by URL (stripped, like
+    :meth:`~djangofeeds.importers.FeedImporter.import_feed` does), so
+    refreshes started with only the URL and those started with the
+    feed object use the same lock.
+
+    :keyword lock: The lock class to use, default is
+        :data:`~djangofeeds.conf.FEED_LOCK`.  :const:`False` disables
+        the lock.
+
+    Any other keyword arguments are passed on to the lock class.
+
+    """
+    lock = conf.FEED_LOCK if lock is None else lock
+    if not lock:
+        return None
+    return symbol_by_name(lock, LOCK_ALIASES)(
+            conf.FEED_LOCK_CACHE_KEY_FMT % (feed_url.strip(), ), expire,
+            **kwargs)
@@ -1,26 +1,96 @@
+from datetime import datetime
+
 from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import utc
 
+from djangofeeds import conf
 from djangofeeds.models import Feed
+from djangofeeds.importers import FeedImporter
+from djangofeeds.utils import get_default_logger
 
 
 @transaction.commit_manually
-def expire_posts(min_posts=20, commit_every=10000):
+def expire_posts(min_posts=20, max_posts=120, commit_every=10000,
+        logger=None):
     """Expire old posts for all feeds in the system.
 
+    Feeds are selected by their stored post count, so on databases
+    created before :attr:`~djangofeeds.models.Feed.post_count` was
+    added, :func:`update_post_counts` must have been run first;
+    until then every feed has a count of 0 and is never expired.
+
     :keyword min_posts: Maximum number of posts to keep in a feed.
         Default is 20.
+    :keyword max_posts: Only expire posts in feeds with more than this
+        number of posts. Default is 120.
     :keyword commit_every: Commit transaction every ``n`` posts.
         Default is 10,000.
+    :keyword logger: The :class:`logging.Logger` instance used for
+        logging messages.
+
+    :returns: The number of posts deleted.
 
     """
-    total = 0
-    for feed in Feed.objects.all():
-        print("Expiring posts for %s" % feed.feed_url)
+    logger = logger or get_default_logger()
+    total = uncommitted = 0
+    for feed in Feed.objects.filter(post_count__gt=max_posts).iterator():
+        logger.debug("Expiring posts for %s" % feed.feed_url)
         try:
-            deleted = feed.expire_old_posts(min_posts=min_posts)
+            deleted = feed.expire_old_posts(min_posts=min_posts,
+                                            max_posts=max_posts)
         except BaseException:
             transaction.rollback()
+            uncommitted = 0
+            logger.error("Expiring posts for %s failed" % feed.feed_url,
+                         exc_info=True)
         else:
             total += deleted
-            if not total % commit_every:
+            uncommitted += deleted
+            if uncommitted >= commit_every:
                 transaction.commit()
+                uncommitted = 0
+    transaction.commit()
+    logger.info("Expired %d posts" % total)
+    return total
+
+
+def update_post_counts():
+    """Recalculate the post count and date of newest post for all
+    feeds.
+
+    Must be run once after the columns have been added to an existing
+    database, before :func:`expire_posts` is used.
+
+    """
+    for feed in Feed.objects.all().iterator():
+        feed.recount_posts()
+
+
+def probe_suspended_feeds(importer=None, limit=None):
+    """Probe the suspended feeds due for a check, and activate the
+    ones responding again.
+
+    Feeds still failing are probed again after
+    :data:`~djangofeeds.conf.PROBE_INTERVAL`.
+
+    :keyword importer: :class:`~djangofeeds.importers.FeedImporter`
+        used to probe the feeds.
+    :keyword limit: Max number of feeds to probe.
+
+    :returns: The number of feeds activated again.
+
+    """
+    importer = importer or FeedImporter()
+    now = datetime.utcnow().replace(tzinfo=utc)
+    feeds = Feed.objects.suspended().filter(
+                Q(next_refresh_at__lte=now) | Q(next_refresh_at__isnull=True))
+    reactivated = 0
+    for feed in feeds.order_by("next_refresh_at")[:limit]:
+        if importer.probe_feed(feed):
+            feed.reactivate()
+            reactivated += 1
+        else:
+            Feed.objects.filter(pk=feed.pk).update(
+                    next_refresh_at=now + conf.PROBE_INTERVAL)
+    return reactivated
@@ -5,35 +5,90 @@ from optparse import make_option
 
 from django.core.management.base import NoArgsCommand
 
-from djangofeeds.tasks import refresh_feed
-from djangofeeds.models import Feed
-from djangofeeds.importers import FeedImporter
+from djangofeeds.tasks import refresh_feed, dispatch_due_feeds
+from djangofeeds.tasks import refresh_feed_batch, dispatch_due_feed_batches
+from djangofeeds.tasks import batches_by_host
+from djangofeeds.models import Feed, Category, Enclosure
+from djangofeeds.importers import FeedImporter, ThreadedFeedRefresher
+from djangofeeds.importers import ProcessFeedRefresher
 
 
 def print_feed_summary(feed_obj):
     """Dump a summary of the feed (how many posts etc.)."""
-    posts = feed_obj.get_posts()
-    enclosures_count = sum([post.enclosures.count() for post in posts])
-    categories_count = sum([post.categories.count() for post in posts]) \
+    enclosures_count = Enclosure.objects.filter(post__feed=feed_obj).count()
+    categories_count = Category.objects.filter(post__feed=feed_obj).count() \
                         + feed_obj.categories.count()
     sys.stderr.write("*** Total %d posts, %d categories, %d enclosures\n" % \
-            (len(posts), categories_count, enclosures_count))
-
-
-def refresh_all(verbose=True):
-    """ Refresh all feeds in the system. """
-    importer = FeedImporter()
-    for feed_obj in importer.feed_model.objects.all():
-        sys.stderr.write(">>> Refreshing feed %s...\n" % \
+            (feed_obj.post_count, categories_count, enclosures_count))
+
+
+def refresh_all(verbose=True, workers=None, due=False, processes=None,
+        green=False):
+    """Refresh all feeds in the system.
+
+    :keyword workers: Number of threads fetching feeds concurrently,
+        if not set the feeds are refreshed one at a time.
+    :keyword due: Only refresh the feeds due for refresh.
+    :keyword processes: Number of processes parsing the fetched feeds
+        (see :class:`~djangofeeds.importers.ProcessFeedRefresher`).
+    :keyword green: Fetch ``workers`` feeds concurrently using
+        :mod:`gevent` (see
+        :class:`~djangofeeds.asyncimporter.AsyncFeedRefresher`).
+
+    """
+    if green:
+        from djangofeeds.asyncimporter import AsyncFeedImporter
+        importer = AsyncFeedImporter()
+    else:
+        importer = FeedImporter()
+    feeds = importer.feed_model.objects
+    feeds = (feeds.due() if due else feeds.all()).iterator()
+    if green:
+        from djangofeeds.asyncimporter import AsyncFeedRefresher
+        refresher = AsyncFeedRefresher(importer, workers=workers)
+        refreshed = refresher.refresh(feeds)
+    elif processes:
+        refresher = ProcessFeedRefresher(importer, workers=workers,
+                                         processes=processes)
+        refreshed = refresher.refresh(feeds)
+    elif workers and workers > 1:
+        refresher = ThreadedFeedRefresher(importer, workers=workers)
+        refreshed = refresher.refresh(feeds)
+    else:
+        refreshed = (importer.update_feed(feed_obj) for feed_obj in feeds)
+
+    for feed_obj in refreshed:
+        sys.stderr.write(">>> Refreshed feed %s...\n" % \
                 (feed_obj.name))
-        feed_obj = importer.update_feed(feed_obj)
 
         if verbose:
             print_feed_summary(feed_obj)
 
+    sys.stderr.write("*** Refreshed %s\n" % (importer.stats.summary(), ))
+    return importer.stats
+
+
+def refresh_all_feeds_delayed(from_file=None, batch_size=None):
+    """Send tasks refreshing all feeds in the system (or the
+    feed URLs listed in ``from_file``).
+
+    Suspended feeds are left to
+    :func:`~djangofeeds.tasks.probe_suspended_feeds`, feeds
+    deactivated by hand are refreshed too.
+
+    :keyword batch_size: Send the feeds in batches grouped by host
+        (see :func:`~djangofeeds.tasks.refresh_feed_batch`), instead of
+        a task per feed.
+
+    """
+    feeds = Feed.objects.exclude(pk__in=Feed.objects.suspended())
+    if batch_size and from_file is None:
+        feeds = feeds.values_list("id", "feed_url").iterator()
+        for host, feed_ids in batches_by_host(feeds, batch_size):
+            refresh_feed_batch.delay(feed_ids, host=host, force=True)
+        return
 
-def refresh_all_feeds_delayed(from_file=None):
-    urls = (feed.feed_url for feed in Feed.objects.all())
+    urls = (feed.feed_url for feed in feeds)
     if from_file is not None:
         with file(from_file) as feedfile:
             urls = iter(feedfile.readlines())
@@ -49,6 +104,23 @@ class Command(NoArgsCommand):
         make_option('--file', '-f', action="store", dest="file",
                     help="Import all feeds from a file with feed URLs "
                     "seperated by newline."),
+        make_option('--workers', '-w', action="store", type="int",
+                    dest="workers", default=0,
+                    help="Number of threads fetching feeds concurrently"),
+        make_option('--processes', '-p', action="store", type="int",
+                    dest="processes", default=0,
+                    help="Number of processes parsing the fetched feeds"),
+        make_option('--gevent', '-g',
+                    action="store_true", dest="green", default=False,
+                    help="Fetch feeds concurrently using gevent, "
+                    "--workers at a time"),
+        make_option('--due', '-d',
+                    action="store_true", dest="due", default=False,
+                    help="Only refresh the feeds due for refresh"),
+        make_option('--batch-size', '-b', action="store", type="int",
+                    dest="batch_size", default=0,
+                    help="With --lazy, send the feeds in batches of "
+                    "this size, grouped by host"),
     )
 
     help = ("Refresh feeds", )
@@ -59,7 +131,16 @@ class Command(NoArgsCommand):
     def handle_noargs(self, **options):
         lazy = options.get("lazy")
         from_file = options.get("file")
-        if from_file or lazy:
-            refresh_all_feeds_delayed(from_file)
+        due = options.get("due")
+        batch_size = options.get("batch_size")
+        if lazy and due and not from_file:
+            if batch_size:
+                dispatch_due_feed_batches(batch_size=batch_size)
+            else:
+                dispatch_due_feeds()
+        elif from_file or lazy:
+            refresh_all_feeds_delayed(from_file, batch_size=batch_size)
         else:
-            refresh_all()
+            refresh_all(workers=options.get("workers"), due=due,
+                        processes=options.get("processes"),
+                        green=options.get("green"))
@@ -1,10 +1,12 @@
+from __future__ import with_statement
+
 import pytz
 from datetime import timedelta, datetime
 
-from django.db import models
+from django.db import connections, models, transaction
 from django.db.models.query import QuerySet
-from django.core.exceptions import MultipleObjectsReturned
 
+from djangofeeds import conf
 from djangofeeds.utils import truncate_field_data
 
 """ .. data:: DEFAULT_POST_LIMIT
@@ -16,14 +18,22 @@ from djangofeeds.utils import truncate_field_data
 DEFAULT_POST_LIMIT = 25
 
 
-def update_with_dict(obj, fields):
+def update_with_dict(obj, fields, save=True):
     """Update and save a model from the values of a :class:`dict`."""
     set_value = lambda (name, val): setattr(obj, name, val)
     map(set_value, fields.items())
-    obj.save()
+    save and obj.save()
     return obj
 
 
+def is_unchanged(obj, fields):
+    """Return true if ``fields`` has the same fingerprint as the one
+    stored for ``obj``."""
+    fingerprint = fields.get("fingerprint")
+    return bool(fingerprint) and fingerprint == getattr(obj, "fingerprint",
+                                                        None)
+
+
 class ExtendedQuerySet(QuerySet):
 
     def update_or_create(self, **kwargs):
@@ -32,7 +42,8 @@ class ExtendedQuerySet(QuerySet):
         if not created:
             fields = dict(kwargs.pop("defaults", {}))
             fields.update(kwargs)
-            update_with_dict(obj, fields)
+            if not is_unchanged(obj, fields):
+                update_with_dict(obj, fields)
 
         return obj
 
@@ -56,6 +67,26 @@ class ExtendedQuerySet(QuerySet):
             query["ratio__lt"] = max
         return self.filter(**query)
 
+    def due(self, now=None):
+        """Select the active feeds due for refresh, most overdue first.
+
+        Feeds never scheduled are always due.
+
+        """
+        now = now or datetime.now(pytz.utc)
+        return self.filter(is_active=True).filter(
+                    models.Q(next_refresh_at__lte=now) |
+                    models.Q(next_refresh_at__isnull=True)) \
+                        .order_by("next_refresh_at")
+
+    def suspended(self):
+        """Select the feeds deactivated because they kept failing
+        (see :data:`~djangofeeds.conf.SUSPEND_AFTER_FAILURES`)."""
+        if not conf.SUSPEND_AFTER_FAILURES:
+            return self.none()
+        return self.filter(is_active=False,
+                           failure_count__gte=conf.SUSPEND_AFTER_FAILURES)
+
     def frequency(self, min=None, max=None):
         """Select feeds based on update frequency.
 
@@ -93,6 +124,12 @@ class FeedManager(ExtendedManager):
     def frequency(self, *args, **kwargs):
         return self.get_query_set().frequency(*args, **kwargs)
 
+    def due(self, *args, **kwargs):
+        return self.get_query_set().due(*args, **kwargs)
+
+    def suspended(self):
+        return self.get_query_set().suspended()
+
 
 class PostManager(ExtendedManager):
     """Manager class for Posts"""
@@ -103,16 +140,123 @@ class PostManager(ExtendedManager):
         return self.all().order_by(*ordering)[:limit]
 
     def update_or_create(self, feed_obj, **fields):
-        """Update post with new values."""
-        super_update = super(PostManager, self).update_or_create
-        defaults = truncate_field_data(self.model, fields)
-        try:
-            return super_update(guid=defaults["guid"], feed=feed_obj,
-                                         defaults=defaults)
-        except MultipleObjectsReturned:
-            self.filter(guid=defaults["guid"], feed=feed_obj).delete()
-            super_update(guid=defaults["guid"], feed=feed_obj,
-                         defaults=defaults)
+        """Update post with new values.
+
+        Goes through :meth:`bulk_upsert`, so the post count of the
+        feed is kept up to date.
+
+        """
+        return self.bulk_upsert(feed_obj, [fields])[0]
+
+    def bulk_upsert(self, feed_obj, entries, prepare=None, fetch_pks=True):
+        """Update or create many posts of a feed at once.
+
+        Existing posts are fetched in a single query, new posts are
+        inserted using one :meth:`bulk_create`, and changed posts
+        are updated with one ``executemany``, all in one transaction.
+        Posts with an unchanged fingerprint are not written at all.
+
+        :param feed_obj: The feed the posts belongs to.
+        :param entries: List of post fields, as returned by
+            :meth:`djangofeeds.importers.FeedImporter.post_fields_parsed`.
+        :keyword prepare: Optional function called with the fields of
+            the posts that are about to be written, returning the
+            fields to write.  Used to postpone expensive work until we
+            know that the post is new or has changed.
+        :keyword fetch_pks: :meth:`bulk_create` doesn't set the primary
+            keys of the new posts, if this is set they are fetched with
+            an extra query.  Only needed to add related objects
+            (enclosures, categories) to the new posts.
+
+        :returns: List of posts in the same order as ``entries``.
+
+        """
+        entries = [truncate_field_data(self.model, dict(fields,
+                                                        feed=feed_obj))
+                        for fields in entries]
+        # If a guid is repeated the last entry wins, as it would
+        # when saving them one by one.
+        by_guid = dict((fields["guid"], fields) for fields in entries)
+
+        posts, duplicates = {}, []
+        for post in self.filter(feed=feed_obj, guid__in=by_guid.keys()):
+            if post.guid in posts:
+                duplicates.append(post.pk)
+            else:
+                posts[post.guid] = post
+
+        if prepare is not None:
+            for guid, fields in by_guid.items():
+                if not is_unchanged(posts.get(guid), fields):
+                    by_guid[guid] = truncate_field_data(self.model,
+                                                        prepare(fields))
+
+        new_posts = []
+        for fields in entries:
+            guid = fields["guid"]
+            if guid not in posts:
+                posts[guid] = None
+                new_posts.append(self.model(**by_guid[guid]))
+
+        changed = []
+        for guid, post in posts.items():
+            fields = by_guid[guid]
+            if post is not None and not is_unchanged(post, fields):
+                changed.append((update_with_dict(post, fields, save=False),
+                                fields))
+
+        with transaction.commit_on_success(using=self.db):
+            if duplicates:
+                self.filter(pk__in=duplicates).delete()
+            if changed:
+                self.update_many(changed)
+            if new_posts:
+                self.bulk_create(new_posts)
+
+        if duplicates:
+            feed_obj.posts_removed(len(duplicates))
+        if new_posts:
+            feed_obj.posts_added(len(new_posts), max(post.date_published
+                                                     for post in new_posts))
+            if fetch_pks:
+                posts.update((post.guid, post) for post in self.filter(
+                    feed=feed_obj,
+                    guid__in=[post.guid for post in new_posts]))
+            else:
+                posts.update((post.guid, post) for post in new_posts)
+
+        return [posts.get(entry["guid"]) for entry in entries]
+
+    def update_many(self, changed):
+        """Write changed posts, with one ``executemany`` for every
+        set of changed fields.
+
+        :param changed: List of ``(post, fields)`` tuples, where
+            ``fields`` are the names of the fields to write.
+
+        """
+        by_fields = {}
+        for post, fields in changed:
+            names = tuple(sorted(name for name in fields if name != "feed"))
+            by_fields.setdefault(names, []).append(post)
+
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        cursor = connection.cursor()
+        for names, posts in by_fields.items():
+            fields = [opts.get_field(name) for name in names]
+            sql = "UPDATE %s SET %s WHERE %s = %%s" % (
+                    qn(opts.db_table),
+                    ", ".join("%s = %%s" % qn(field.column)
+                                for field in fields),
+                    qn(opts.pk.column))
+            cursor.executemany(sql, [
+                [field.get_db_prep_save(getattr(post, field.attname),
+                                        connection=connection)
+                    for field in fields] + [post.pk]
+                        for post in posts])
+        transaction.set_dirty(using=self.db)
 
 
 class CategoryManager(ExtendedManager):
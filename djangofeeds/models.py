@@ -4,7 +4,7 @@ from datetime import datetime, timedelta
 from django.utils.timezone import utc
 
 from django.db import models
-from django.db.models import signals
+from django.db.models import signals, F, Q
 from django.utils.translation import ugettext_lazy as _
 from django.utils.hashcompat import md5_constructor
 
@@ -39,6 +39,9 @@ FEED_ERROR_CHOICES = (
         (FEED_GENERIC_ERROR, FEED_GENERIC_ERROR_TEXT),
 )
 
+# Feed fields only written by atomic updates, see Feed.save_state.
+POST_STATS_FIELDS = ("post_count", "date_newest_post")
+
 
 def timedelta_seconds(delta):
     """Convert :class:`datetime.timedelta` to seconds.
@@ -111,6 +114,29 @@ class Feed(models.Model):
 
         The apparent importance of this feed.
 
+    .. attribute:: post_count
+
+        Number of posts stored for this feed, kept up to date by the
+        importer and when posts are expired.
+
+    .. attribute:: date_newest_post
+
+        Publication date of the most recent post in this feed.
+
+    .. attribute:: next_refresh_at
+
+        When the feed is due to be refreshed, see :meth:`schedule_refresh`.
+
+    .. attribute:: not_modified_count
+
+        Number of refreshes in a row that didn't find any new posts.
+
+    .. attribute:: failure_count
+
+        Number of refreshes in a row that failed.  The feed is
+        deactivated when this reaches
+        :data:`~djangofeeds.conf.SUSPEND_AFTER_FAILURES`.
+
     """
     supports_categories = False
     supports_enclosures = False
@@ -124,6 +150,9 @@ class Feed(models.Model):
                                  null=True, max_length=200)
     http_last_modified = models.DateTimeField(_(u"Last-Modified"), null=True,
                                               editable=False, blank=True)
+    http_body_digest = models.CharField(_(u"body digest"), max_length=40,
+                                        editable=False, blank=True,
+                                        default="")
     date_last_refresh = models.DateTimeField(_(u"date of last refresh"),
                                         null=True, blank=True, editable=False)
     categories = models.ManyToManyField(Category)
@@ -139,6 +168,19 @@ class Feed(models.Model):
                                                auto_now_add=True)
     is_active = models.BooleanField(_(u"is active"), default=True)
     freq = models.IntegerField(_(u"frequency"), default=conf.REFRESH_EVERY)
+    post_count = models.PositiveIntegerField(_(u"post count"), default=0,
+                                             editable=False)
+    date_newest_post = models.DateField(_(u"date of newest post"),
+                                        null=True, blank=True,
+                                        editable=False)
+    next_refresh_at = models.DateTimeField(_(u"next refresh"), null=True,
+                                           blank=True, editable=False,
+                                           db_index=True)
+    not_modified_count = models.PositiveIntegerField(
+                                        _(u"refreshes without new posts"),
+                                        default=0, editable=False)
+    failure_count = models.PositiveIntegerField(_(u"failed refreshes"),
+                                                default=0, editable=False)
 
     objects = FeedManager()
 
@@ -156,10 +198,77 @@ class Feed(models.Model):
 
     def get_posts(self, **kwargs):
         """Get all :class:`Post`s for this :class:`Feed` in order."""
-        return self.poststore.all_posts_by_order(self)
+        return self.poststore.all_posts_by_order(self, **kwargs)
 
     def get_post_count(self):
-        return self.poststore.get_post_count(self)
+        return self.post_count
+
+    def posts_added(self, count, date_newest=None):
+        """Account for ``count`` new posts, storing the new post
+        count right away.
+
+        The count is incremented in the database, not overwritten,
+        so posts expired by someone else meanwhile are not lost.
+
+        """
+        if isinstance(date_newest, datetime):
+            date_newest = date_newest.date()
+        self.post_count += count
+        if date_newest and (self.date_newest_post is None or
+                            date_newest > self.date_newest_post):
+            self.date_newest_post = date_newest
+        if self.pk:
+            Feed.objects.filter(pk=self.pk).update(
+                    post_count=F("post_count") + count)
+            if date_newest:
+                Feed.objects.filter(Q(date_newest_post__isnull=True) |
+                                    Q(date_newest_post__lt=date_newest),
+                                    pk=self.pk).update(
+                        date_newest_post=date_newest)
+
+    def posts_removed(self, count):
+        """Account for ``count`` expired posts, storing the new
+        post count right away (see :meth:`posts_added`)."""
+        self.post_count = max(self.post_count - count, 0)
+        if not self.post_count:
+            self.date_newest_post = None
+        if self.pk and not Feed.objects.filter(pk=self.pk,
+                post_count__gt=count).update(
+                    post_count=F("post_count") - count):
+            Feed.objects.filter(pk=self.pk).update(post_count=0,
+                                                   date_newest_post=None)
+
+    def recount_posts(self):
+        """Recalculate :attr:`post_count` and :attr:`date_newest_post`
+        from the posts stored for this feed."""
+        self.post_count = self.poststore.get_post_count(self)
+        self.date_newest_post = self.poststore.get_date_newest_post(self)
+        if isinstance(self.date_newest_post, datetime):
+            self.date_newest_post = self.date_newest_post.date()
+        if self.pk:
+            Feed.objects.filter(pk=self.pk).update(
+                    post_count=self.post_count,
+                    date_newest_post=self.date_newest_post)
+
+    def save_state(self):
+        """Save the feed, except for :attr:`post_count` and
+        :attr:`date_newest_post`.
+
+        These are only changed by :meth:`posts_added`,
+        :meth:`posts_removed` and :meth:`recount_posts`, so a
+        refresh doesn't overwrite the count stored by someone else
+        expiring posts at the same time.  New feeds are saved as usual.
+
+        """
+        if not self.pk:
+            self.save()
+            return self
+        fields = dict((field.name, field.pre_save(self, False))
+                        for field in self._meta.local_fields
+                            if not field.primary_key and
+                                field.name not in POST_STATS_FIELDS)
+        Feed.objects.filter(pk=self.pk).update(**fields)
+        return self
 
     def frequencies(self, limit=None, order="-date_updated"):
         posts = self.post_set.values("date_updated").order_by(order)[0:limit]
@@ -193,13 +302,92 @@ class Feed(models.Model):
         :returns: The number of messages deleted.
 
         """
-        by_date = self.post_set.order_by("-date_published")
-        if len(by_date) > max_posts:
-            expired_posts = [post["id"]
-                                for post in by_date.values("id")[min_posts:]]
-            Post.objects.filter(pk__in=expired_posts).delete()
-            return len(expired_posts)
-        return 0
+        return self.poststore.expire_old_posts(self, min_posts, max_posts)
+
+    def refresh_interval(self, now=None):
+        """How long to wait before refreshing this feed again.
+
+        Starts out with the measured posting frequency (:attr:`freq`),
+        backing off for every refresh in a row without new posts
+        (see :data:`~djangofeeds.conf.NOT_MODIFIED_BACKOFF`) and for every
+        refresh in a row that failed
+        (see :data:`~djangofeeds.conf.ERROR_BACKOFF`).  Feeds not requested
+        by anyone within
+        :data:`~djangofeeds.conf.FEED_LAST_REQUESTED_REFRESH_LIMIT` are
+        refreshed as seldom as possible.
+
+        :returns: :class:`datetime.timedelta` between
+            :data:`~djangofeeds.conf.MIN_REFRESH_INTERVAL` and
+            :data:`~djangofeeds.conf.MAX_REFRESH_INTERVAL`.
+
+        """
+        now = now or datetime.now(utc)
+        seconds = (self.freq or conf.REFRESH_EVERY) * \
+                    conf.NOT_MODIFIED_BACKOFF ** min(self.not_modified_count,
+                                                     20)
+        failures = self.failure_count or int(bool(self.last_error))
+        seconds *= conf.ERROR_BACKOFF ** min(failures, 20)
+        unused_limit = conf.FEED_LAST_REQUESTED_REFRESH_LIMIT
+        if unused_limit and self.date_last_requested and \
+                now - self.date_last_requested > conf._interval(unused_limit):
+            return conf.MAX_REFRESH_INTERVAL
+        return min(max(timedelta(seconds=seconds), conf.MIN_REFRESH_INTERVAL),
+                   conf.MAX_REFRESH_INTERVAL)
+
+    def schedule_refresh(self, now=None, save=False):
+        """Set :attr:`next_refresh_at` using :meth:`refresh_interval`.
+
+        :keyword save: Store the schedule right away, otherwise it's
+            stored the next time the feed is saved.
+
+        """
+        now = now or datetime.now(utc)
+        self.next_refresh_at = now + self.refresh_interval(now)
+        if save and self.pk:
+            Feed.objects.filter(pk=self.pk).update(
+                    next_refresh_at=self.next_refresh_at,
+                    not_modified_count=self.not_modified_count,
+                    failure_count=self.failure_count,
+                    last_error=self.last_error)
+
+    def postpone(self, seconds, now=None):
+        """Refresh the feed again in ``seconds``, without counting
+        it as an error."""
+        now = now or datetime.now(utc)
+        self.next_refresh_at = now + timedelta(seconds=seconds)
+        if self.pk:
+            Feed.objects.filter(pk=self.pk).update(
+                    next_refresh_at=self.next_refresh_at)
+
+    def is_backing_off(self, now=None):
+        """Return true if the last refresh failed and the backoff
+        interval has not passed yet."""
+        now = now or datetime.now(utc)
+        return bool(self.failure_count and self.next_refresh_at and
+                    now < self.next_refresh_at)
+
+    @property
+    def is_suspended(self):
+        """True if the feed was deactivated because it kept failing."""
+        threshold = conf.SUSPEND_AFTER_FAILURES
+        return bool(not self.is_active and threshold and
+                    self.failure_count >= threshold)
+
+    def suspend(self, now=None):
+        """Deactivate the feed until a probe finds it working again
+        (see :meth:`reactivate`)."""
+        now = now or datetime.now(utc)
+        self.is_active = False
+        self.next_refresh_at = now + conf.PROBE_INTERVAL
+
+    def reactivate(self):
+        """Activate a suspended feed again, making it due for refresh
+        right away."""
+        self.is_active = True
+        self.failure_count = 0
+        self.last_error = u""
+        self.next_refresh_at = None
+        return self.save_state()
 
     def is_error_status(self, status):
         return status == http.NOT_FOUND or status not in ACCEPTED_STATUSES
@@ -213,8 +401,13 @@ class Feed(models.Model):
     def save_error(self, error_msg):
         self._set_last_error = True
         self.last_error = error_msg
-        self.save()
-        return self
+        self.failure_count += 1
+        threshold = conf.SUSPEND_AFTER_FAILURES
+        if threshold and self.failure_count >= threshold:
+            self.suspend()
+        else:
+            self.schedule_refresh()
+        return self.save_state()
 
     def save_generic_error(self):
         return self.save_error(FEED_GENERIC_ERROR)
@@ -311,6 +504,11 @@ class Post(models.Model):
 
         List of media attachments for this post.
 
+    .. attribute:: fingerprint
+
+        Digest of the post fields when it was last imported,
+        the post is not written again unless this changes.
+
     """
 
     feed = models.ForeignKey(Feed, null=False, blank=False)
@@ -324,6 +522,8 @@ class Post(models.Model):
     date_updated = models.DateTimeField(_(u"date updated"))
     enclosures = models.ManyToManyField(Enclosure, blank=True)
     categories = models.ManyToManyField(Category)
+    fingerprint = models.CharField(_(u"fingerprint"), max_length=32,
+                                   blank=True, editable=False)
 
     objects = PostManager()
 
@@ -1,12 +1,15 @@
 import BeautifulSoup
 from HTMLParser import HTMLParseError
+from sgmllib import SGMLParser, SGMLParseError
 from django.conf import settings
 import re
+import urlparse
 
 DJANGOFEEDS_REMOVE_TRACKERS = getattr(settings,
     "DJANGOFEEDS_REMOVE_TRACKERS", True)
 
-# The obvious tracker images
+# The obvious tracker images, see :class:`TrackerMatcher` for the
+# supported rules.
 DJANGOFEEDS_TRACKER_SERVICES = getattr(settings,
     "DJANGOFEEDS_TRACKER_SERVICES", [
     'http://feedads',
@@ -25,6 +28,80 @@ DJANGOFEEDS_TRACKER_SERVICES = getattr(settings,
 DJANGOFEEDS_SMALL_IMAGE_LIMIT = getattr(settings,
     "DJANGOFEEDS_SMALL_IMAGE_LIMIT", 50)
 
+# Engine used to optimize post content, see :data:`OPTIMIZER_ENGINES`.
+DJANGOFEEDS_CONTENT_OPTIMIZER = getattr(settings,
+    "DJANGOFEEDS_CONTENT_OPTIMIZER", "beautifulsoup")
+
+
+class TrackerMatcher(object):
+    """Match URLs against a list of tracker rules.
+
+    The rules are compiled once, so the cost of matching an URL does
+    not grow with the number of prefix and host rules.
+
+    :param rules: List of rules, each one of:
+
+        * ``"host:example.com"`` -- any URL on ``example.com`` or one of
+          its subdomains.
+        * A pattern containing ``*`` -- glob matching the whole URL,
+          e.g. ``"http://*.feedsportal.com/c/*/mf.gif"``.
+        * Anything else -- URL prefix, e.g. ``"http://feedads"``.
+
+    """
+    HOST_PREFIX = "host:"
+    GLOB_WILDCARD = "*"
+
+    def __init__(self, rules):
+        self.prefixes = {}
+        self.hosts = set()
+        globs = []
+        for rule in rules:
+            if rule.startswith(self.HOST_PREFIX):
+                self.hosts.add(rule[len(self.HOST_PREFIX):].lower())
+            elif self.GLOB_WILDCARD in rule:
+                globs.append(re.escape(rule).replace(r"\*", ".*"))
+            elif rule:
+                node = self.prefixes
+                for char in rule:
+                    node = node.setdefault(char, {})
+                node[None] = True
+        self.glob_re = None
+        if globs:
+            self.glob_re = re.compile("(?:%s)\Z" % "|".join(globs))
+
+    def match_prefix(self, url):
+        node = self.prefixes
+        for char in url:
+            node = node.get(char)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    def match_host(self, url):
+        try:
+            host = urlparse.urlsplit(url).hostname
+        except ValueError:
+            return False
+        if not host:
+            return False
+        labels = host.split(".")
+        for i in xrange(len(labels)):
+            if ".".join(labels[i:]) in self.hosts:
+                return True
+        return False
+
+    def match(self, url):
+        """Return True if ``url`` matches any of the rules."""
+        return bool(self.match_prefix(url)
+                    or (self.hosts and self.match_host(url))
+                    or (self.glob_re and self.glob_re.match(url)))
+
+
+#: Matcher for :data:`DJANGOFEEDS_TRACKER_SERVICES`.
+default_tracker_matcher = TrackerMatcher(DJANGOFEEDS_TRACKER_SERVICES)
+
 
 class PostContentOptimizer(object):
     """Remove diverse abberation and annoying content in the posts.
@@ -66,12 +143,12 @@ class PostContentOptimizer(object):
 
     """
 
+    def __init__(self, tracker_matcher=None):
+        self.tracker_matcher = tracker_matcher or default_tracker_matcher
+
     def looks_like_tracker(self, url):
         """Return True if the image URL has to be removed."""
-        for service in DJANGOFEEDS_TRACKER_SERVICES:
-            if url.startswith(service):
-                return True
-        return False
+        return self.tracker_matcher.match(url)
 
     def optimize(self, html):
         """Remove unecessary spaces, <br> and image tracker."""
@@ -131,3 +208,306 @@ class PostContentOptimizer(object):
             if link_href and "://" in link_href:
                 if self.looks_like_tracker(link_href):
                     link.replaceWith("")
+
+
+class _StreamingOptimizerParser(SGMLParser):
+    """Single pass HTML parser writing optimized markup to a buffer.
+
+    Follows the parsing rules of :class:`BeautifulSoup.BeautifulSoup`
+    (tag nesting, self-closing and quote tags, whitespace handling and
+    escaping), but writes each element out as soon as it is known
+    instead of building a tree, skipping excessive ``<br>`` tags and
+    trackers on the way.
+
+    It is built on :class:`sgmllib.SGMLParser` rather than
+    :class:`HTMLParser.HTMLParser` because BeautifulSoup 3 is too:
+    the two tokenize broken markup differently (``<a<``, bare ``<``,
+    unquoted attributes), so only the same tokenizer with the same
+    nesting rules gives byte-identical output, and stored posts do not
+    change when the engine is switched.  The nesting tables are read
+    from :class:`BeautifulSoup.BeautifulSoup`, not copied; the
+    equivalence tests in ``test_beacon`` catch changes in how they are
+    applied.
+
+    Tokenizing is most of the remaining cost (about half, and
+    :class:`HTMLParser.HTMLParser` is only ~10% faster at it), so this
+    is about 2-2.5 times faster than :class:`PostContentOptimizer`
+    rather than the 5-10 times of a tokenizer-only pass, see
+    ``contrib/bench-optimizer.py``.
+
+    """
+    ROOT = BeautifulSoup.BeautifulSoup.ROOT_TAG_NAME
+    SELF_CLOSING_TAGS = BeautifulSoup.BeautifulSoup.SELF_CLOSING_TAGS
+    PRESERVE_WHITESPACE_TAGS = \
+            BeautifulSoup.BeautifulSoup.PRESERVE_WHITESPACE_TAGS
+    QUOTE_TAGS = BeautifulSoup.BeautifulSoup.QUOTE_TAGS
+    NESTABLE_TAGS = BeautifulSoup.BeautifulSoup.NESTABLE_TAGS
+    RESET_NESTING_TAGS = BeautifulSoup.BeautifulSoup.RESET_NESTING_TAGS
+    MARKUP_MASSAGE = BeautifulSoup.BeautifulSoup.MARKUP_MASSAGE
+    STRIP_ASCII_SPACES = BeautifulSoup.BeautifulSoup.STRIP_ASCII_SPACES
+    ATTR_ENTITY_RE = re.compile("&(#\d+|#x[0-9a-fA-F]+|\w+);")
+    XML_ENTITIES = BeautifulSoup.BeautifulSoup.XML_ENTITIES_TO_SPECIAL_CHARS
+    BARE_AMPERSAND_OR_BRACKET = \
+            BeautifulSoup.NavigableString.BARE_AMPERSAND_OR_BRACKET
+    CHARSET_RE = BeautifulSoup.BeautifulSoup.CHARSET_RE
+    ESCAPES = {"<": "&lt;", ">": "&gt;", "&": "&amp;"}
+
+    def __init__(self, optimizer, remove_trackers=True):
+        SGMLParser.__init__(self)
+        self.optimizer = optimizer
+        self.remove_trackers = remove_trackers
+        self.out = []
+        self.current_data = []
+        self.tag_stack = [self.ROOT]
+        self.quote_stack = []
+        # Depth of the tracker link being skipped, if any.
+        self.skip_depth = None
+        # start with true to remove any starting br tag
+        self.last_one_is_br = True
+
+    def optimize(self, html):
+        for fix, m in self.MARKUP_MASSAGE:
+            html = fix.sub(m, html)
+        # Like BeautifulSoup, an incomplete trailing token is dropped.
+        self.feed(html)
+        self.end_data()
+        while len(self.tag_stack) > 1:
+            self.pop_tag()
+        return u"".join(self.out)
+
+    def escape(self, text):
+        return self.BARE_AMPERSAND_OR_BRACKET.sub(
+                    lambda m: self.ESCAPES[m.group(0)], text)
+
+    def convert_attr_entity(self, match):
+        x = match.group(1)
+        if x in self.XML_ENTITIES or x[0] != "#":
+            return u"&%s;" % x
+        if len(x) > 1 and x[1] == "x":
+            return unichr(int(x[2:], 16))
+        return unichr(int(x[1:]))
+
+    def format_attr(self, key, val):
+        val = self.ATTR_ENTITY_RE.sub(self.convert_attr_entity, val)
+        fmt = u'%s="%s"'
+        if '"' in val:
+            fmt = u"%s='%s'"
+            if "'" in val:
+                val = val.replace("'", "&squot;")
+        return fmt % (key, self.escape(val))
+
+    def write(self, data):
+        if self.skip_depth is None:
+            self.out.append(data)
+
+    def end_data(self, fmt=None):
+        if not self.current_data:
+            return
+        data = u"".join(self.current_data)
+        self.current_data = []
+        if (data.translate(self.STRIP_ASCII_SPACES) == "" and
+                not self.PRESERVE_WHITESPACE_TAGS.intersection(
+                    self.tag_stack)):
+            data = "\n" if "\n" in data else " "
+        if fmt is None:
+            self.write(self.escape(data))
+        elif fmt == "<?%s?>":
+            self.write(fmt % data)
+        else:
+            self.write(fmt % self.escape(data))
+
+    def push_tag(self, name, attrs):
+        depth = len(self.tag_stack)
+        if self.skip_depth is None:
+            skip = False
+            if depth == 1:
+                skip = name == "br" and self.last_one_is_br
+                self.last_one_is_br = name == "br"
+            if self.remove_trackers and not skip:
+                skip = self.is_tracker(name, dict(attrs))
+            if skip:
+                self.skip_depth = depth
+            else:
+                self.out.append(u"<%s%s%s>" % (name,
+                    "".join(" " + self.format_attr(key, val)
+                                for key, val in attrs),
+                    " /" if name in self.SELF_CLOSING_TAGS else ""))
+        self.tag_stack.append(name)
+
+    def pop_tag(self):
+        name = self.tag_stack.pop()
+        if self.skip_depth == len(self.tag_stack):
+            self.skip_depth = None
+        elif name not in self.SELF_CLOSING_TAGS:
+            self.write(u"</%s>" % name)
+
+    def is_tracker(self, name, attrs):
+        optimizer = self.optimizer
+        if name == "img":
+            image_source = attrs.get("src", "")
+            if not image_source or optimizer.looks_like_tracker(image_source):
+                return True
+            try:
+                image_width = int(attrs.get("width",
+                    DJANGOFEEDS_SMALL_IMAGE_LIMIT))
+            except ValueError:
+                return False
+            return image_width < DJANGOFEEDS_SMALL_IMAGE_LIMIT
+        if name == "a":
+            link_href = attrs.get("href")
+            return bool(link_href and "://" in link_href and
+                        optimizer.looks_like_tracker(link_href))
+        return False
+
+    def pop_to_tag(self, name, inclusive=True):
+        if name == self.ROOT:
+            return
+        pops = 0
+        for i in xrange(len(self.tag_stack) - 1, 0, -1):
+            if name == self.tag_stack[i]:
+                pops = len(self.tag_stack) - i
+                break
+        if not inclusive:
+            pops -= 1
+        for i in xrange(pops):
+            self.pop_tag()
+
+    def smart_pop(self, name):
+        reset_triggers = self.NESTABLE_TAGS.get(name)
+        is_nestable = reset_triggers is not None
+        is_reset_nesting = name in self.RESET_NESTING_TAGS
+        for i in xrange(len(self.tag_stack) - 1, 0, -1):
+            p = self.tag_stack[i]
+            if p == name and not is_nestable:
+                return self.pop_to_tag(name)
+            if ((is_nestable and p in reset_triggers) or
+                    (not is_nestable and is_reset_nesting and
+                        p in self.RESET_NESTING_TAGS)):
+                return self.pop_to_tag(p, inclusive=False)
+
+    def start_meta(self, attrs):
+        # The output is always utf-8, so rewrite the declared charset.
+        http_equiv = content_index = None
+        for i, (key, value) in enumerate(attrs):
+            key = key.lower()
+            if key == "http-equiv":
+                http_equiv = value
+            elif key == "content":
+                content_index = i
+        if http_equiv and content_index is not None:
+            key, content = attrs[content_index]
+            attrs[content_index] = (key, self.CHARSET_RE.sub(
+                    lambda m: m.group(1) + "utf-8", content))
+        self.unknown_starttag("meta", attrs)
+
+    def convert_charref(self, name):
+        try:
+            n = int(name)
+        except ValueError:
+            return
+        if not 0 <= n <= 127:
+            return
+        return self.convert_codepoint(n)
+
+    def unknown_starttag(self, name, attrs):
+        if self.quote_stack:
+            self.handle_data("<%s%s>" % (name, "".join(
+                ' %s="%s"' % (key, val) for key, val in attrs)))
+            return
+        self.end_data()
+        self_closing = name in self.SELF_CLOSING_TAGS
+        if not self_closing:
+            self.smart_pop(name)
+        self.push_tag(name, attrs)
+        if self_closing:
+            self.pop_tag()
+        if name in self.QUOTE_TAGS:
+            self.quote_stack.append(name)
+            self.literal = 1
+
+    def unknown_endtag(self, name):
+        if self.quote_stack and self.quote_stack[-1] != name:
+            self.handle_data("</%s>" % name)
+            return
+        self.end_data()
+        self.pop_to_tag(name)
+        if self.quote_stack and self.quote_stack[-1] == name:
+            self.quote_stack.pop()
+            self.literal = len(self.quote_stack) > 0
+
+    def handle_data(self, data):
+        self.current_data.append(data)
+
+    def handle_special(self, text, fmt):
+        self.end_data()
+        self.handle_data(text)
+        self.end_data(fmt)
+
+    def handle_pi(self, text):
+        if text[:3] == "xml":
+            text = u"xml version='1.0' encoding='utf-8'"
+        self.handle_special(text, "<?%s?>")
+
+    def handle_comment(self, text):
+        self.handle_special(text, "<!--%s-->")
+
+    def handle_decl(self, data):
+        self.handle_special(data, "<!%s>")
+
+    def handle_charref(self, ref):
+        self.handle_data("&#%s;" % ref)
+
+    def handle_entityref(self, ref):
+        self.handle_data("&%s;" % ref)
+
+    def parse_declaration(self, i):
+        if self.rawdata[i:i + 9] == "<![CDATA[":
+            k = self.rawdata.find("]]>", i)
+            if k == -1:
+                k = len(self.rawdata)
+            self.handle_special(self.rawdata[i + 9:k], "<![CDATA[%s]]>")
+            return k + 3
+        try:
+            return SGMLParser.parse_declaration(self, i)
+        except SGMLParseError:
+            self.handle_data(self.rawdata[i:])
+            return len(self.rawdata)
+
+
+class StreamingContentOptimizer(PostContentOptimizer):
+    """Post content optimizer working in a single pass over the markup.
+
+    Gives the same result as :class:`PostContentOptimizer`, but never
+    builds a document tree: excessive ``<br>`` tags, trackers and small
+    images are dropped while the content is being tokenized.
+
+    """
+
+    def optimize(self, html):
+        """Remove unecessary spaces, <br> and image tracker."""
+        html = html.strip()
+        markup = html
+        if not isinstance(markup, unicode):
+            try:
+                markup = markup.decode("utf-8")
+            except UnicodeDecodeError:
+                markup = markup.decode("latin-1")
+        parser = _StreamingOptimizerParser(self,
+                        remove_trackers=DJANGOFEEDS_REMOVE_TRACKERS)
+        try:
+            optimized = parser.optimize(markup)
+        except (HTMLParseError, SGMLParseError):
+            return html
+        return optimized.strip().encode("utf-8")
+
+
+#: Available post content optimizers, selected by the
+#: ``DJANGOFEEDS_CONTENT_OPTIMIZER`` setting.
+OPTIMIZER_ENGINES = {"beautifulsoup": PostContentOptimizer,
+                     "streaming": StreamingContentOptimizer}
+
+
+def get_content_optimizer(engine=None):
+    """Get an instance of the post content optimizer ``engine``
+    (by default the one configured by ``DJANGOFEEDS_CONTENT_OPTIMIZER``)."""
+    return OPTIMIZER_ENGINES[engine or DJANGOFEEDS_CONTENT_OPTIMIZER]()
@@ -0,0 +1,249 @@
+"""Per-host politeness: limit concurrent requests and request rate
+to a single host."""
+from __future__ import with_statement
+
+import time
+import threading
+from uuid import uuid4
+from contextlib import contextmanager
+from urlparse import urlsplit
+
+from djangofeeds import conf
+from djangofeeds.backends import symbol_by_name
+from djangofeeds.exceptions import HostRateLimitedError
+
+LIMITER_ALIASES = {
+    "local": "djangofeeds.ratelimit.LocalHostLimiter",
+    "redis": "djangofeeds.ratelimit.RedisHostLimiter",
+}
+
+
+def host_for_url(url):
+    """The host name (and port) requests to ``url`` are limited by."""
+    netloc = urlsplit(url).netloc.lower()
+    return netloc.rsplit("@", 1)[-1]
+
+
+class HostLimiter(object):
+    """Limit requests to a single host.
+
+    Every host has a cap on the number of requests in progress at the
+    same time, and a token bucket limiting the request rate.
+
+    :keyword concurrency: See :attr:`concurrency`.
+    :keyword rate: See :attr:`rate`.
+    :keyword burst: See :attr:`burst`.
+
+    .. attribute:: concurrency
+
+        Max number of requests in progress to a single host.
+
+    .. attribute:: rate
+
+        Max number of requests per second to a single host, on average.
+
+    .. attribute:: burst
+
+        Max number of requests to a host that has been idle
+        for a while, before :attr:`rate` kicks in.
+
+    """
+    poll_interval = 0.1
+
+    def __init__(self, concurrency=None, rate=None, burst=None):
+        self.concurrency = concurrency or conf.HOST_CONCURRENCY
+        self.rate = float(rate or conf.HOST_RATE)
+        self.burst = burst or conf.HOST_BURST
+
+    def try_acquire(self, host):
+        """Try to start a request to ``host``.
+
+        :returns: ``(token, wait)`` tuple.  ``token`` is passed on
+            to :meth:`release` when the request is done, or is
+            :const:`None` if the request can't start now, in which case
+            ``wait`` is the number of seconds to wait before trying again.
+
+        """
+        raise NotImplementedError("HostLimiter.try_acquire")
+
+    def release(self, host, token):
+        """Done with the request started by :meth:`try_acquire`."""
+        raise NotImplementedError("HostLimiter.release")
+
+    def wait(self, host, seconds):
+        time.sleep(seconds)
+
+    def acquire(self, host, timeout=None):
+        """Wait until a request to ``host`` can start.
+
+        :keyword timeout: Max seconds to wait, default is
+            :data:`~djangofeeds.conf.HOST_LIMIT_WAIT`.
+
+        :returns: The token to pass on to :meth:`release`.
+        :raises djangofeeds.exceptions.HostRateLimitedError: if
+            the request couldn't start within ``timeout``.
+
+        """
+        timeout = conf.HOST_LIMIT_WAIT if timeout is None else timeout
+        give_up = time.time() + timeout
+        while True:
+            token, wait = self.try_acquire(host)
+            if token is not None:
+                return token
+            left = give_up - time.time()
+            if left <= 0:
+                raise HostRateLimitedError(
+                        "Too many requests to %s" % (host, ))
+            self.wait(host, min(wait or self.poll_interval, left))
+
+    @contextmanager
+    def limit(self, host, timeout=None):
+        """Context wrapping a single request to ``host``,
+        see :meth:`acquire`."""
+        token = self.acquire(host, timeout=timeout)
+        try:
+            yield
+        finally:
+            self.release(host, token)
+
+
+class LocalHostLimiter(HostLimiter):
+    """:class:`HostLimiter` for the threads of a single process."""
+
+    def __init__(self, *args, **kwargs):
+        super(LocalHostLimiter, self).__init__(*args, **kwargs)
+        self._active = {}
+        self._buckets = {}
+        self._changed = threading.Condition(threading.Lock())
+
+    def try_acquire(self, host):
+        with self._changed:
+            now = time.time()
+            tokens, updated = self._buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            self._buckets[host] = (tokens, now)
+            if self._active.get(host, 0) >= self.concurrency:
+                return None, None
+            if tokens < 1:
+                return None, (1 - tokens) / self.rate
+            self._buckets[host] = (tokens - 1, now)
+            self._active[host] = self._active.get(host, 0) + 1
+            return True, 0
+
+    def release(self, host, token):
+        with self._changed:
+            self._active[host] -= 1
+            if not self._active[host]:
+                del(self._active[host])
+            self._changed.notify_all()
+
+    def wait(self, host, seconds):
+        # Woken up early when another request is done.
+        with self._changed:
+            self._changed.wait(seconds)
+
+
+class RedisHostLimiter(HostLimiter):
+    """:class:`HostLimiter` shared by every worker using the same
+    Redis server (configured by the ``REDIS_POST_*`` settings).
+
+    Time is measured by the Redis server, not by the workers, so the
+    limits hold even if their clocks differ.  Requires Redis 3.2 or
+    later.
+
+    :keyword client: :class:`redis.Redis` instance to use.
+    :keyword lease: See :attr:`lease`.
+
+    .. attribute:: lease
+
+        Requests in progress are only counted for this many seconds,
+        so requests from a worker that died are not counted forever.
+        Default is twice the :data:`~djangofeeds.conf.FEED_TOTAL_TIMEOUT`.
+
+    """
+    prefix = "djangofeeds:host"
+
+    # KEYS: bucket hash, active requests sorted set.
+    # ARGV: rate, burst, concurrency, token, lease.
+    # Returns {acquired, milliseconds to wait}.
+    # The server's clock is used, as the clocks of the workers sharing
+    # the bucket may disagree.  Writing after TIME requires effects
+    # replication (Redis 3.2, the default since Redis 5).
+    acquire_script = """
+        redis.replicate_commands()
+        local time = redis.call("TIME")
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local lease = tonumber(ARGV[5])
+        redis.call("ZREMRANGEBYSCORE", KEYS[2], "-inf", now)
+        if redis.call("ZCARD", KEYS[2]) >= tonumber(ARGV[3]) then
+            return {0, 0}
+        end
+        local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(now - updated, 0) * rate)
+        local acquired = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            acquired = 1
+            redis.call("ZADD", KEYS[2], now + lease, ARGV[4])
+            redis.call("EXPIRE", KEYS[2], math.ceil(lease))
+        end
+        redis.call("HMSET", KEYS[1], "tokens", tokens, "updated", now)
+        redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+        if acquired == 1 then
+            return {1, 0}
+        end
+        return {0, math.ceil((1 - tokens) / rate * 1000)}
+    """
+
+    def __init__(self, *args, **kwargs):
+        client = kwargs.pop("client", None)
+        self.lease = kwargs.pop("lease", None) or \
+                        conf.FEED_TOTAL_TIMEOUT * 2
+        super(RedisHostLimiter, self).__init__(*args, **kwargs)
+        if client is None:
+            from redish.client import Client
+            client = Client(host=conf.REDIS_POST_HOST,
+                            port=conf.REDIS_POST_PORT,
+                            db=conf.REDIS_POST_DB).api
+        self.client = client
+        self._acquire = client.register_script(self.acquire_script)
+
+    def keys(self, host):
+        return ["%s:%s:bucket" % (self.prefix, host),
+                "%s:%s:active" % (self.prefix, host)]
+
+    def try_acquire(self, host):
+        token = uuid4().hex
+        acquired, wait = self._acquire(keys=self.keys(host),
+                                       args=[self.rate, self.burst,
+                                             self.concurrency, token,
+                                             self.lease])
+        if acquired:
+            return token, 0
+        return None, wait and wait / 1000.0
+
+    def release(self, host, token):
+        self.client.zrem(self.keys(host)[1], token)
+
+
+_limiter_cache = {}
+
+
+def limiter_or_default(limiter=None):
+    """Return the :class:`HostLimiter` configured by
+    :data:`~djangofeeds.conf.HOST_LIMITER`, shared by the whole process.
+
+    :keyword limiter: Use this limiter instead, either an instance or
+        the name of the class.
+
+    """
+    limiter = limiter or conf.HOST_LIMITER
+    if not limiter or isinstance(limiter, HostLimiter):
+        return limiter or None
+    if limiter not in _limiter_cache:
+        _limiter_cache[limiter] = symbol_by_name(limiter, LIMITER_ALIASES)()
+    return _limiter_cache[limiter]
@@ -0,0 +1,64 @@
+"""Counters and timings for feed refresh runs."""
+from __future__ import with_statement
+
+import time
+import threading
+
+
+class RefreshStats(object):
+    """Counters and wall-clock timing for a refresh run.
+
+    Counters can be incremented from several threads at once.
+
+    .. attribute:: counters
+
+        Mapping of counter name to its current value.
+
+    .. attribute:: time_start
+
+        When the run started (as returned by :func:`time.time`).
+
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.time_start = time.time()
+        self._mutex = threading.Lock()
+
+    def incr(self, name, amount=1):
+        """Increment counter ``name`` by ``amount``."""
+        with self._mutex:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def __getitem__(self, name):
+        return self.counters.get(name, 0)
+
+    @property
+    def elapsed(self):
+        """Seconds since the run started."""
+        return time.time() - self.time_start
+
+    def rate(self, name):
+        """Number of ``name`` events per second since the run started."""
+        elapsed = self.elapsed
+        if not elapsed:
+            return 0.0
+        return self[name] / elapsed
+
+    @property
+    def not_modified_ratio(self):
+        """Fraction of the conditional requests answered with
+        ``304 Not Modified``."""
+        if not self["conditional"]:
+            return 0.0
+        return float(self["not_modified"]) / self["conditional"]
+
+    def summary(self):
+        """Human readable summary of the run."""
+        return ("%d feeds in %.2fs (%.2f feeds/s): %d updated, "
+                "%d not modified (%d%% of conditional requests), "
+                "%d unchanged, %d fresh, %d errors" % (
+                    self["feeds"], self.elapsed, self.rate("feeds"),
+                    self["updated"], self["not_modified"],
+                    self.not_modified_ratio * 100, self["unchanged"],
+                    self["fresh"], self["errors"]))
@@ -1,55 +1,149 @@
+from datetime import datetime, timedelta
+
 from django.core.cache import cache
+from django.utils.timezone import utc
 
-from celery.utils import noop, chunks
+from celery.utils import chunks
 from celery.decorators import task
 
 from djangofeeds import conf
+from djangofeeds import locks
+from djangofeeds import maintenance
+from djangofeeds.exceptions import HostRateLimitedError
 from djangofeeds.models import Feed
 from djangofeeds.importers import FeedImporter
+from djangofeeds.ratelimit import host_for_url
+
+ENABLE_LOCKS = True
+
 
-ENABLE_LOCKS = False
+def feed_lock(feed_url):
+    """The lock for refreshing the feed at ``feed_url``, see
+    :data:`~djangofeeds.conf.FEED_LOCK`."""
+    if not ENABLE_LOCKS:
+        return None
+    return locks.feed_lock(feed_url, cache=cache)
 
 
 @task(ignore_result=True)
-def refresh_feed(feed_url, feed_id=None, importer_cls=None, **kwargs):
+def refresh_feed(feed_url, feed_id=None, importer_cls=None, force=True,
+        ignore_validators=False, scheduled=False, **kwargs):
     """Refresh a djangofeed feed, supports multiprocessing.
 
     :param feed_url: The URL of the feed to refresh.
-    :keyword feed_id: Optional id of the feed, if not specified
-        the ``feed_url`` is used instead.
+    :keyword feed_id: Not used, feeds are always locked by URL so
+        every task refreshing a feed uses the same lock.
+    :keyword force: Refresh even if the feed was refreshed recently
+        or is backing off after errors.
+    :keyword ignore_validators: Download the whole feed, even if the
+        server says it has not been modified since the last refresh.
+    :keyword scheduled: The feed was sent because it is due for refresh,
+        see :meth:`~djangofeeds.importers.FeedImporter.update_feed`.
+
+    Feeds already being refreshed by someone else are skipped
+    (see :data:`~djangofeeds.conf.FEED_LOCK`).
+
+    The task is retried after
+    :data:`~djangofeeds.conf.HOST_LIMIT_RETRY_DELAY` if there are too
+    many requests to the feed's host (see
+    :data:`~djangofeeds.conf.HOST_LIMITER`), for new and existing
+    feeds alike.
 
     """
     importer_cls = importer_cls or FeedImporter
-    feed_id = feed_id or feed_url
-    lock_id = conf.FEED_LOCK_CACHE_KEY_FMT % feed_id
-    lock_expires = conf.FEED_LOCK_EXPIRE
-
-    if ENABLE_LOCKS:
-        is_locked = lambda: str(cache.get(lock_id)) == "true"
-        acquire_lock = lambda: cache.set(lock_id, "true", lock_expires)
-        release_lock = lambda: cache.set(lock_id, "nil", 1)
-    else:
-        acquire_lock = release_lock = noop
-        is_locked = lambda: False
+    lock = feed_lock(feed_url)
 
     logger = refresh_feed.get_logger(**kwargs)
-    print("Importing feed %s" % feed_url)
-    if is_locked():
+    logger.info("Importing feed %s" % feed_url)
+    if lock is not None and not lock.acquire():
         logger.error("Feed is already being imported by another process.")
         return feed_url
 
-    acquire_lock()
     try:
-        importer = importer_cls(update_on_import=True, logger=logger)
-        feed_obj = importer.import_feed(feed_url, force=True)
-        if feed_obj is not None:
-            feed_obj.expire_old_posts()
-    finally:
-        release_lock()
+        try:
+            importer = importer_cls(update_on_import=True, logger=logger,
+                                    postpone_rate_limited=False)
+            feed_obj = importer.import_feed(feed_url, force=force,
+                                    ignore_validators=ignore_validators,
+                                    scheduled=scheduled)
+            if feed_obj is not None:
+                feed_obj.expire_old_posts()
+        finally:
+            if lock is not None:
+                lock.release()
+    except HostRateLimitedError, exc:
+        # The lock is released first, so the retry can take it.
+        return refresh_feed.retry(exc=exc,
+                                  countdown=conf.HOST_LIMIT_RETRY_DELAY)
 
     return feed_url
 
 
+@task(ignore_result=True)
+def refresh_feed_batch(feed_ids, host=None, importer_cls=None, force=False,
+        ignore_validators=False, scheduled=False, **kwargs):
+    """Refresh a batch of feeds, usually all on the same host (see
+    :func:`batches_by_host`).
+
+    All the feeds are refreshed by the same importer, so connections
+    to the host are reused for the whole batch.  Feeds already being
+    refreshed by someone else are skipped, and feeds on a rate limited
+    host are postponed (see
+    :attr:`~djangofeeds.importers.FeedImporter.postpone_rate_limited`).
+
+    :param feed_ids: Ids of the feeds to refresh.
+    :keyword host: Host the feeds are on, only used for logging.
+    :keyword force: Refresh even if the feed was refreshed recently
+        or is backing off after errors.
+    :keyword ignore_validators: See :func:`refresh_feed`.
+    :keyword scheduled: See :func:`refresh_feed`.
+
+    :returns: :class:`dict` with the number of feeds, the time it took
+        and the counters of :class:`~djangofeeds.stats.RefreshStats`.
+
+    """
+    importer_cls = importer_cls or FeedImporter
+    logger = refresh_feed_batch.get_logger(**kwargs)
+    importer = importer_cls(update_on_import=True, logger=logger)
+    for feed_obj in Feed.objects.filter(pk__in=feed_ids).iterator():
+        lock = feed_lock(feed_obj.feed_url)
+        if lock is not None and not lock.acquire():
+            importer.stats.incr("locked")
+            continue
+        try:
+            feed_obj = importer.update_feed(feed_obj, force=force,
+                                ignore_validators=ignore_validators,
+                                scheduled=scheduled)
+            if feed_obj is not None:
+                feed_obj.expire_old_posts()
+        finally:
+            if lock is not None:
+                lock.release()
+    logger.info("Refreshed batch on %s: %s" % (
+                    host, importer.stats.summary()))
+    return dict(importer.stats.counters, host=host,
+                batch_size=len(feed_ids), elapsed=importer.stats.elapsed)
+
+
+def batches_by_host(feeds, batch_size=None):
+    """Group feeds by host, in batches of at most ``batch_size`` feeds.
+
+    :param feeds: Iterable of ``(feed_id, feed_url)`` tuples.
+    :keyword batch_size: Default is
+        :data:`~djangofeeds.conf.REFRESH_BATCH_SIZE`.
+
+    :returns: List of ``(host, feed_ids)`` tuples.
+
+    """
+    batch_size = batch_size or conf.REFRESH_BATCH_SIZE
+    by_host = {}
+    for feed_id, feed_url in feeds:
+        by_host.setdefault(host_for_url(feed_url), []).append(feed_id)
+    return [(host, feed_ids[i:i + batch_size])
+                for host, feed_ids in sorted(by_host.items())
+                    for i in xrange(0, len(feed_ids), batch_size)]
+
+
 @task(ignore_result=True)
 def update_frequency_chunk(feeds, post_limit=10):
     for feed in feeds:
@@ -60,3 +154,68 @@ def update_frequency_chunk(feeds, post_limit=10):
 def collect_frequencies(chunksize=10, post_limit=10):
     for chunk in chunks(Feed.objects.all().iterator(), chunksize):
         update_frequency_chunk.delay(chunk, post_limit=post_limit)
+
+
+@task(ignore_result=True)
+def dispatch_due_feeds(limit=None, **kwargs):
+    """Send a :func:`refresh_feed` task for every feed due for refresh
+    (see :meth:`djangofeeds.managers.FeedManager.due`).
+
+    The dispatched feeds are rescheduled
+    :data:`~djangofeeds.conf.FEED_LOCK_EXPIRE` seconds ahead, so they are
+    not sent again while waiting in the queue.
+    The refresh itself sets the real schedule, and is not skipped for
+    feeds backing off after errors, as they are only due once the
+    backoff has passed.
+
+    :keyword limit: Max number of feeds to dispatch.
+
+    """
+    due = lease_due_feeds(limit)
+    for _, feed_url in due:
+        refresh_feed.delay(feed_url, force=False, scheduled=True)
+    return len(due)
+
+
+@task(ignore_result=True)
+def dispatch_due_feed_batches(limit=None, batch_size=None, **kwargs):
+    """Like :func:`dispatch_due_feeds`, but sends the feeds grouped by
+    host to :func:`refresh_feed_batch`.
+
+    :keyword limit: Max number of feeds to dispatch.
+    :keyword batch_size: Max number of feeds in a batch, default is
+        :data:`~djangofeeds.conf.REFRESH_BATCH_SIZE`.
+
+    :returns: The number of batches sent.
+
+    """
+    batches = batches_by_host(lease_due_feeds(limit), batch_size)
+    for host, feed_ids in batches:
+        refresh_feed_batch.delay(feed_ids, host=host, force=False,
+                                 scheduled=True)
+    return len(batches)
+
+
+def lease_due_feeds(limit=None):
+    """Select the feeds due for refresh, and reschedule them
+    :data:`~djangofeeds.conf.FEED_LOCK_EXPIRE` seconds ahead.
+
+    :returns: List of ``(feed_id, feed_url)`` tuples.
+
+    """
+    now = datetime.utcnow().replace(tzinfo=utc)
+    due = list(Feed.objects.due(now).values_list("id", "feed_url")[:limit])
+    Feed.objects.filter(pk__in=[feed_id for feed_id, _ in due]).update(
+            next_refresh_at=now + timedelta(seconds=conf.FEED_LOCK_EXPIRE))
+    return due
+
+
+@task(ignore_result=True)
+def probe_suspended_feeds(limit=None, **kwargs):
+    """Activate suspended feeds responding again, see
+    :func:`djangofeeds.maintenance.probe_suspended_feeds`.
+
+    :keyword limit: Max number of feeds to probe.
+
+    """
+    return maintenance.probe_suspended_feeds(limit=limit)
@@ -0,0 +1,70 @@
+import time
+import threading
+import unittest2 as unittest
+
+from djangofeeds.fetcher import Timeout
+from djangofeeds.models import Feed
+from djangofeeds.tests.test_fetcher import FeedServer, FeedHandler
+
+GEVENT_MISSING = False
+try:
+    from djangofeeds.asyncimporter import AsyncFeedImporter
+    from djangofeeds.asyncimporter import AsyncFeedRefresher
+except ImportError:
+    GEVENT_MISSING = True
+
+
+@unittest.skipIf(GEVENT_MISSING, "gevent is not installed")
+class TestAsyncFeedRefresher(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FeedServer(("127.0.0.1", 0), FeedHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Feed.objects.all().delete()
+
+    def create_feeds(self, *paths):
+        return [Feed.objects.create(name=path, feed_url="http://%s:%d%s" % (
+                                        "127.0.0.1", self.server.server_port,
+                                        path))
+                    for path in paths]
+
+    def test_refresh(self):
+        feeds = self.create_feeds("/feed", "/gzip", "/missing")
+        refresher = AsyncFeedRefresher(workers=10)
+        refreshed = list(refresher.refresh(iter(feeds)))
+        self.assertItemsEqual([feed_obj.name for feed_obj in refreshed],
+                              ["/feed", "/gzip", "/missing"])
+        self.assertEqual(refresher.stats["updated"], 2)
+        self.assertEqual(refresher.stats["errors"], 1)
+        self.assertEqual(Feed.objects.get(name="/gzip").get_post_count(), 1)
+        refresher.importer.fetcher.pool.clear()
+
+    def test_refresh_concurrently(self):
+        feeds = self.create_feeds(*["/hang?%d" % i for i in range(8)])
+        refresher = AsyncFeedRefresher(workers=10, chunksize=2)
+        time_start = time.time()
+        list(refresher.refresh(feeds))
+        # Every request takes a second, at most 4 at a time to one host.
+        self.assertLess(time.time() - time_start, 4)
+        self.assertEqual(refresher.stats["updated"], 8)
+        refresher.importer.fetcher.pool.clear()
+
+    def test_refresh_timeout(self):
+        feeds = self.create_feeds("/hang", "/feed")
+        importer = AsyncFeedImporter(timeout=Timeout(connect=1, read=0.2))
+        refresher = AsyncFeedRefresher(importer)
+        refreshed = dict((feed_obj.name, feed_obj)
+                            for feed_obj in refresher.refresh(feeds))
+        self.assertTrue(refreshed["/hang"].last_error)
+        self.assertFalse(refreshed["/feed"].last_error)
+        importer.fetcher.pool.clear()
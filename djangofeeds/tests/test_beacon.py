@@ -89,3 +89,70 @@ class test_BeaconRemover(unittest.TestCase):
 
     def assertIsBeacons(self, urls):
         map(self.assertIsBeacon, urls)
+
+
+class test_StreamingBeaconRemover(test_BeaconRemover):
+
+    def setUp(self):
+        self.tracker_remover = optimization.StreamingContentOptimizer()
+
+    def test_same_as_beautifulsoup(self):
+        soup_optimizer = optimization.PostContentOptimizer()
+        for html in ["""<p>a<p>b<table><tr><td>x<td>y</table>""",
+                     """<script>if (a<b) { x("<p>"); }</script>&amp;""",
+                     """<pre>  </pre> \n <!-- c --><![CDATA[x]]>""",
+                     """<div title='say "hi"' alt="it's">AT&T</div>""",
+                     """<a href="%s"><img src="a.png">x</a>text""" % IMG3,
+                     u"""<b>\u2603</b> &nbsp; &#169;""",
+                     """<a< <img src="test"> a < b <i>x</b>""",
+                     """<ul><li>a<li>b<ul><li>c</ul></ul><br><br>x""",
+                     """<p><a href=x title=a&b>y</a><br/><br>""",
+                     """<img src="a.png" width="10%"><img src=b.png>"""]:
+            self.assertEqual(self.tracker_remover.optimize(html),
+                             soup_optimizer.optimize(html))
+
+    def test_get_content_optimizer(self):
+        self.assertIsInstance(
+            optimization.get_content_optimizer("streaming"),
+            optimization.StreamingContentOptimizer)
+        self.assertIsInstance(
+            optimization.get_content_optimizer("beautifulsoup"),
+            optimization.PostContentOptimizer)
+
+
+class test_TrackerMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = optimization.TrackerMatcher([
+            "http://feeds.feedburner.com/~r/",
+            "http://feedads",
+            "host:pixel.example.com",
+            "http://*.feedsportal.com/c/*/mf.gif",
+        ])
+
+    def test_prefix(self):
+        self.assertTrue(self.matcher.match(IMG1))
+        self.assertTrue(self.matcher.match("http://feedads.g.doubleclick.net"))
+        self.assertFalse(self.matcher.match("http://feeds.feedburner.com/"))
+        self.assertFalse(self.matcher.match("http://feed"))
+
+    def test_host(self):
+        self.assertTrue(self.matcher.match("http://pixel.example.com/x.gif"))
+        self.assertTrue(self.matcher.match("https://a.pixel.example.com/"))
+        self.assertTrue(self.matcher.match("http://PIXEL.example.com:80/"))
+        self.assertFalse(self.matcher.match("http://example.com/x.gif"))
+        self.assertFalse(self.matcher.match("http://notpixel.example.com/"))
+        self.assertFalse(self.matcher.match("/pixel.example.com/"))
+
+    def test_glob(self):
+        self.assertTrue(self.matcher.match(
+            "http://rss.feedsportal.com/c/32495/f/479227/mf.gif"))
+        self.assertFalse(self.matcher.match(
+            "http://rss.feedsportal.com/c/32495/f/479227/mf.gif?x"))
+        self.assertFalse(self.matcher.match(
+            "http://rss.feedsportal.com/d/32495/mf.gif"))
+
+    def test_optimizer_uses_matcher(self):
+        optimizer = optimization.PostContentOptimizer(self.matcher)
+        self.assertEqual(optimizer.optimize(
+            """<img src="http://pixel.example.com/t.gif">x"""), "x")
@@ -101,6 +101,21 @@ class test_generate_guid(unittest.TestCase):
             "http://feeds.newsweek.com/newsweek/TopNews"])
 
 
+class test_fingerprint(unittest.TestCase):
+
+    def test_fingerprint(self):
+        now = datetime.now(pytz.utc)
+        fields = dict(title=u"t\xe9st", content=NOT_ENCODEABLE,
+                      date_updated=now, feed=object())
+        fp = feedutil.fingerprint(fields)
+        self.assertEqual(len(fp), 32)
+        self.assertEqual(fp, feedutil.fingerprint(dict(fields,
+                                                     feed=object(),
+                                                     fingerprint=fp)))
+        self.assertNotEqual(fp, feedutil.fingerprint(dict(fields,
+                                                        title="other")))
+
+
 class test_alternate_links(unittest.TestCase):
 
     def test_search_alternate_links_double_function(self):
@@ -0,0 +1,389 @@
+from __future__ import with_statement
+
+import time
+import zlib
+import gzip
+import socket
+import threading
+import httplib as http
+import unittest2 as unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from cStringIO import StringIO
+from urlparse import urlsplit
+
+from djangofeeds.exceptions import FeedTooLargeError
+from djangofeeds.feedutil import search_links_url
+from djangofeeds.fetcher import FeedFetcher, Timeout, Deadline, http_date
+from djangofeeds.fetcher import ConnectionPool, default_fetcher
+from djangofeeds.importers import FeedImporter, ProcessFeedRefresher
+
+FEED = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Fetched</title>
+<item><title>First</title><guid>1</guid></item>
+</channel></rss>"""
+ETAG = '"abc"'
+PAGE = """<html><head><link rel="alternate" type="application/rss+xml"
+href="/feed"></head></html>"""
+
+
+def gzipped(data):
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as file:
+        file.write(data)
+    return buf.getvalue()
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_feed(self, body=FEED, encoding=None, etag=ETAG):
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(http.NOT_MODIFIED)
+            self.end_headers()
+            return
+        self.send_response(http.OK)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, status, location):
+        self.send_response(status)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.server.clients.append(self.client_address)
+        self.server.heads += 1
+        self.send_feed()
+
+    def do_CONNECT(self):
+        self.server.proxied.append((self.path,
+                                self.headers.get("Proxy-Authorization")))
+        self.send_error(http.BAD_GATEWAY)
+
+    def send_page(self, status):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def do_GET(self):
+        self.server.clients.append(self.client_address)
+        if self.path.startswith("http://"):
+            self.server.proxied.append((self.path,
+                                self.headers.get("Proxy-Authorization")))
+            self.path = urlsplit(self.path).path
+        if self.path == "/feed":
+            return self.send_feed()
+        if self.path == "/noetag":
+            return self.send_feed(etag=None)
+        if self.path == "/gzip":
+            return self.send_feed(gzipped(FEED), "gzip")
+        if self.path == "/deflate":
+            # Raw deflate stream, without the zlib header.
+            return self.send_feed(zlib.compress(FEED)[2:-4], "deflate")
+        if self.path == "/page":
+            return self.send_page(http.OK)
+        if self.path == "/gone":
+            return self.send_page(http.GONE)
+        if self.path == "/close":
+            # Drop the connection without telling the client.
+            self.send_feed()
+            self.close_connection = 1
+        elif self.path == "/moved":
+            self.redirect(http.MOVED_PERMANENTLY, "/feed")
+        elif self.path == "/loop":
+            self.redirect(http.FOUND, "/loop")
+        elif self.path == "/endless":
+            # Chunked, without a Content-Length.
+            self.send_response(http.OK)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for _ in xrange(1000):
+                    self.wfile.write("%x\r\n%s\r\n" % (len(FEED), FEED))
+                    self.wfile.flush()
+                    time.sleep(0.01)
+            except socket.error:
+                pass
+            self.close_connection = 1
+        elif self.path == "/drip":
+            self.send_response(http.OK)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for char in FEED:
+                self.wfile.write(char)
+                self.wfile.flush()
+                time.sleep(0.05)
+        elif self.path.startswith("/hang"):
+            time.sleep(1)
+            self.send_feed()
+        else:
+            self.send_error(http.NOT_FOUND)
+
+
+class FeedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    clients = []
+    proxied = []
+    heads = 0
+
+
+class TestFeedFetcher(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FeedServer(("127.0.0.1", 0), FeedHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        default_fetcher.pool.clear()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.clients = []
+        self.server.proxied = []
+        self.server.heads = 0
+
+    def url(self, path):
+        return "http://127.0.0.1:%d%s" % (self.server.server_port, path)
+
+    def test_fetch(self):
+        response = FeedFetcher().fetch(self.url("/feed"))
+        self.assertEqual(response.status, http.OK)
+        self.assertEqual(response.headers["etag"], ETAG)
+        self.assertEqual(response.read(), FEED)
+
+    def test_fetch_reuses_connection(self):
+        fetcher = FeedFetcher()
+        for path in ("/feed", "/moved", "/feed"):
+            self.assertEqual(fetcher.fetch(self.url(path)).read(), FEED)
+        self.assertEqual(len(self.server.clients), 4)
+        self.assertEqual(len(set(self.server.clients)), 1)
+
+        fetcher = FeedFetcher(pool=False)
+        fetcher.fetch(self.url("/feed"))
+        fetcher.fetch(self.url("/feed"))
+        self.assertEqual(len(set(self.server.clients)), 3)
+
+    def test_fetch_reconnects_closed_connection(self):
+        fetcher = FeedFetcher()
+        fetcher.fetch(self.url("/close"))
+        time.sleep(0.1)
+        self.assertEqual(fetcher.fetch(self.url("/feed")).read(), FEED)
+        self.assertEqual(len(set(self.server.clients)), 2)
+
+    def test_fetch_gzip(self):
+        response = FeedFetcher().fetch(self.url("/gzip"))
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(response.read(), FEED)
+
+    def test_fetch_deflate(self):
+        response = FeedFetcher().fetch(self.url("/deflate"))
+        self.assertEqual(response.read(), FEED)
+
+    def test_fetch_maxlen(self):
+        fetcher = FeedFetcher()
+        self.assertEqual(fetcher.fetch(self.url("/gzip"),
+                                       maxlen=len(FEED)).read(), FEED)
+        for path in ("/feed", "/gzip"):
+            with self.assertRaises(FeedTooLargeError):
+                fetcher.fetch(self.url(path), maxlen=len(FEED) - 1)
+
+    def test_fetch_maxlen_chunked(self):
+        time_start = time.time()
+        with self.assertRaises(FeedTooLargeError):
+            FeedFetcher().fetch(self.url("/endless"), maxlen=len(FEED) * 3)
+        # Aborted long before the server is done sending.
+        self.assertLess(time.time() - time_start, 5)
+
+    def test_fetch_not_modified(self):
+        response = FeedFetcher().fetch(self.url("/feed"), etag=ETAG)
+        self.assertEqual(response.status, http.NOT_MODIFIED)
+        self.assertEqual(response.read(), "")
+
+    def test_fetch_redirect(self):
+        response = FeedFetcher().fetch(self.url("/moved"))
+        self.assertEqual(response.status, http.MOVED_PERMANENTLY)
+        self.assertEqual(response.url, self.url("/feed"))
+        self.assertEqual(response.read(), FEED)
+
+    def test_fetch_too_many_redirects(self):
+        with self.assertRaises(Exception):
+            FeedFetcher(max_redirects=2).fetch(self.url("/loop"))
+
+    def test_fetch_error_status(self):
+        response = FeedFetcher().fetch(self.url("/missing"))
+        self.assertEqual(response.status, http.NOT_FOUND)
+
+    def test_proxy(self):
+        fetcher = FeedFetcher(proxies={
+            "http": "http://u:p@127.0.0.1:%d" % self.server.server_port,
+            "https": "127.0.0.1:%d" % self.server.server_port})
+        response = fetcher.fetch("http://feeds.example.com/feed")
+        self.assertEqual(response.read(), FEED)
+        self.assertListEqual(self.server.proxied, [
+            ("http://feeds.example.com/feed", "Basic dTpw")])
+        with self.assertRaises(socket.error):
+            fetcher.fetch("https://feeds.example.com/feed")
+        self.assertEqual(self.server.proxied[-1],
+                         ("feeds.example.com:443", None))
+
+    def test_no_proxy(self):
+        fetcher = FeedFetcher(proxies={"http": "http://127.0.0.1:9"})
+        self.assertTrue(fetcher.proxy_for("http", "feeds.example.com"))
+        self.assertIsNone(fetcher.proxy_for("https", "feeds.example.com"))
+        self.assertFalse(FeedFetcher(proxies={}).proxies)
+
+    def test_search_links_url(self):
+        self.assertListEqual(search_links_url(self.url("/page")),
+                             [self.url("/feed")])
+        self.assertListEqual(search_links_url(self.url("/gone")), [])
+
+    def test_read_timeout(self):
+        with self.assertRaises(socket.timeout):
+            FeedFetcher().fetch(self.url("/hang"),
+                                timeout=Timeout(connect=1, read=0.2))
+
+    def test_total_timeout(self):
+        # Every read is well within the read timeout.
+        with self.assertRaises(socket.timeout):
+            FeedFetcher().fetch(self.url("/drip"),
+                                timeout=Timeout(connect=1, read=1,
+                                                total=0.5))
+
+    def test_parse_feed(self):
+        importer = FeedImporter()
+        feed = importer.parse_feed(self.url("/moved"))
+        self.assertEqual(feed.status, http.MOVED_PERMANENTLY)
+        self.assertEqual(feed.href, self.url("/feed"))
+        self.assertEqual(feed.etag, ETAG)
+        self.assertEqual(feed.channel.title, "Fetched")
+        self.assertEqual(len(feed.entries), 1)
+
+        feed = importer.parse_feed(self.url("/feed"), etag=ETAG)
+        self.assertEqual(feed.status, http.NOT_MODIFIED)
+        self.assertFalse(feed.entries)
+
+    def test_parse_feed_maxlen(self):
+        importer = FeedImporter()
+        feed = importer.parse_feed(self.url("/feed"), maxlen=len(FEED))
+        self.assertEqual(len(feed.entries), 1)
+        with self.assertRaises(FeedTooLargeError):
+            importer.parse_feed(self.url("/endless"), maxlen=len(FEED))
+        # Only a single GET request per feed.
+        self.assertEqual(self.server.heads, 0)
+        self.assertEqual(len(self.server.clients), 2)
+
+    def test_forced_update_sends_validators(self):
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.url("/feed"))
+        feed_obj = importer.update_feed(feed_obj, force=True)
+        self.assertEqual(feed_obj.http_etag, ETAG)
+        self.assertEqual(importer.stats["updated"], 1)
+
+        feed_obj = importer.update_feed(feed_obj, force=True)
+        self.assertEqual(importer.stats["conditional"], 1)
+        self.assertEqual(importer.stats["not_modified"], 1)
+        self.assertEqual(importer.stats.not_modified_ratio, 1.0)
+
+        importer.update_feed(feed_obj, force=True, ignore_validators=True)
+        self.assertEqual(importer.stats["conditional"], 1)
+        self.assertEqual(importer.stats["updated"], 2)
+
+    def test_update_unchanged_body(self):
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.url("/noetag"))
+        feed_obj = importer.update_feed(feed_obj, force=True)
+        self.assertEqual(len(feed_obj.http_body_digest), 40)
+        self.assertEqual(importer.stats["updated"], 1)
+
+        feed = importer.fetch_feed(feed_obj)
+        self.assertTrue(feed["body_unchanged"])
+        self.assertNotIn("entries", feed)
+        importer.update_feed(feed_obj, feed=feed, force=True)
+        self.assertEqual(importer.stats["unchanged"], 1)
+        self.assertEqual(importer.stats["not_modified"], 0)
+        self.assertEqual(importer.stats["updated"], 1)
+
+        feed = importer.fetch_feed(feed_obj, ignore_validators=True)
+        self.assertEqual(len(feed.entries), 1)
+
+    def test_process_refresher(self):
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.url("/gzip"))
+        refresher = ProcessFeedRefresher(FeedImporter(), workers=1,
+                                         processes=1)
+        refreshed = list(refresher.refresh([feed_obj]))
+        self.assertEqual(refreshed[0].get_post_count(), 1)
+        self.assertEqual(len(refreshed[0].http_body_digest), 40)
+
+    def test_not_modified_not_sent_to_parsers(self):
+        importer = FeedImporter()
+        feed = importer.parse_feed(self.url("/feed"), etag=ETAG,
+                                   parse=False)
+        self.assertIsInstance(feed, dict)
+        self.assertEqual(feed["status"], http.NOT_MODIFIED)
+        self.assertEqual(feed["href"], self.url("/feed"))
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    class MockConnection(object):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    def test_get_put(self):
+        pool = ConnectionPool(maxsize=1)
+        first, second = self.MockConnection(), self.MockConnection()
+        self.assertIsNone(pool.get("a"))
+        pool.put("a", first)
+        pool.put("a", second)
+        self.assertTrue(second.closed)
+        self.assertIsNone(pool.get("b"))
+        self.assertIs(pool.get("a"), first)
+        self.assertIsNone(pool.get("a"))
+
+    def test_max_idle(self):
+        pool = ConnectionPool(max_idle=0.01)
+        conn = self.MockConnection()
+        pool.put("a", conn)
+        time.sleep(0.02)
+        self.assertIsNone(pool.get("a"))
+        self.assertTrue(conn.closed)
+
+
+class TestTimeout(unittest.TestCase):
+
+    def test_coerce(self):
+        timeout = Timeout.coerce(3)
+        self.assertEqual((timeout.connect, timeout.read), (3, 3))
+        self.assertIs(Timeout.coerce(timeout), timeout)
+
+    def test_deadline(self):
+        self.assertEqual(Deadline(None).cap(10), 10)
+        self.assertLessEqual(Deadline(5).cap(10), 5)
+        self.assertEqual(Deadline(5).cap(1), 1)
+        with self.assertRaises(socket.timeout):
+            Deadline(-1).cap(10)
+
+    def test_http_date(self):
+        self.assertEqual(http_date((2009, 2, 6, 12, 30, 0, 4, 37, 0)),
+                         "Fri, 06 Feb 2009 12:30:00 GMT")
@@ -14,9 +14,11 @@ from UserDict import UserDict
 from contextlib import nested
 from django.contrib.auth import authenticate
 
-from djangofeeds.importers import FeedImporter
+from djangofeeds.importers import FeedImporter, ThreadedFeedRefresher
+from djangofeeds.importers import ProcessFeedRefresher
 from djangofeeds.exceptions import FeedCriticalError
 from djangofeeds.exceptions import TimeoutError, FeedNotFoundError
+from djangofeeds.exceptions import HostRateLimitedError
 from djangofeeds import models
 from djangofeeds.models import Feed, Post
 from djangofeeds import feedutil
@@ -180,6 +182,36 @@ src="http://www.labandepasdessinee.com/bpd/images/saison3/261
         self.assertEqual(feed_obj2.get_post_count(), 20,
                         "Re-importing feed doesn't give duplicates")
 
+    def test_reimport_skips_unchanged_posts(self):
+        Feed.objects.all().delete()
+        feed_obj = self.importer.import_feed(self.feed, local=True)
+        post = feed_obj.post_set.all()[0]
+        self.assertTrue(post.fingerprint)
+        Post.objects.filter(pk=post.pk).update(title="untouched")
+
+        self.importer.import_feed(self.feed, local=True, force=True)
+        self.assertEqual(Post.objects.get(pk=post.pk).title, "untouched")
+
+    def test_reimport_only_optimizes_changed_posts(self):
+        optimized = []
+
+        class _Verify(FeedImporter):
+
+            def optimize_post_fields(self, fields):
+                optimized.append(fields["guid"])
+                return super(_Verify, self).optimize_post_fields(fields)
+
+        Feed.objects.all().delete()
+        importer = _Verify()
+        importer.import_feed(self.feed, local=True)
+        self.assertEqual(len(optimized), 20)
+        self.assertEqual(importer.stats["entries_written"], 20)
+
+        importer.import_feed(self.feed, local=True, force=True)
+        self.assertEqual(len(optimized), 20)
+        self.assertEqual(importer.stats["entries"], 40)
+        self.assertEqual(importer.stats["entries_written"], 20)
+
     def test_404_feed_raises_ok(self):
         importer = self.importer
         with self.assertRaises(FeedNotFoundError):
@@ -273,6 +305,101 @@ src="http://www.labandepasdessinee.com/bpd/images/saison3/261
         feed_obj = importer.import_feed(self.feed, local=True, force=True)
         self.assertTrue(_Verify().update_feed(feed_obj=feed_obj, force=False))
 
+    def test_update_feed_not_modified_backs_off(self):
+        Feed.objects.all().delete()
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.feed, local=True, force=True)
+        self.assertEqual(feed_obj.not_modified_count, 0)
+        not_modified = feedparser.FeedParserDict(status=http.NOT_MODIFIED)
+        importer.update_feed(feed_obj=feed_obj, feed=not_modified)
+        indb = Feed.objects.get(pk=feed_obj.pk)
+        self.assertEqual(indb.not_modified_count, 1)
+        self.assertIsNotNone(indb.next_refresh_at)
+
+        # New posts reset the backoff, a refresh without any backs off.
+        importer.update_feed(feed_obj=indb,
+                             feed=importer.parse_feed(self.feed), force=True)
+        self.assertEqual(indb.not_modified_count, 0)
+        importer.update_feed(feed_obj=indb,
+                             feed=importer.parse_feed(self.feed), force=True)
+        self.assertEqual(Feed.objects.get(pk=feed_obj.pk).not_modified_count,
+                         1)
+
+    def test_update_feed_backing_off(self):
+        Feed.objects.all().delete()
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.feed, local=True, force=True)
+        feed_obj.save_timeout_error()
+        feed = importer.parse_feed(self.feed)
+        importer.update_feed(feed_obj=feed_obj, feed=feed)
+        self.assertEqual(importer.stats["backoff"], 1)
+        self.assertEqual(feed_obj.post_count, 0)
+
+        importer.update_feed(feed_obj=feed_obj, feed=feed, force=True)
+        indb = Feed.objects.get(pk=feed_obj.pk)
+        self.assertEqual(indb.failure_count, 0)
+        self.assertEqual(indb.last_error, "")
+        self.assertTrue(indb.post_count)
+
+    def test_update_feed_scheduled(self):
+        Feed.objects.all().delete()
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.feed, local=True, force=True)
+        feed_obj.save_timeout_error()
+        # Dispatching the due feed moved its schedule ahead again.
+        self.assertTrue(feed_obj.is_backing_off())
+        importer.update_feed(feed_obj=feed_obj,
+                             feed=importer.parse_feed(self.feed),
+                             scheduled=True)
+        self.assertEqual(importer.stats["backoff"], 0)
+        indb = Feed.objects.get(pk=feed_obj.pk)
+        self.assertEqual(indb.failure_count, 0)
+        self.assertTrue(indb.post_count)
+
+    def test_update_feed_reactivates_suspended(self):
+        from djangofeeds import conf
+        Feed.objects.all().delete()
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.feed, local=True, force=True)
+        not_modified = feedparser.FeedParserDict(status=http.NOT_MODIFIED)
+        for feed in (not_modified, importer.parse_feed(self.feed)):
+            feed_obj.failure_count = conf.SUSPEND_AFTER_FAILURES - 1
+            feed_obj.save_generic_error()
+            self.assertTrue(feed_obj.is_suspended)
+            importer.update_feed(feed_obj=feed_obj, feed=feed, force=True)
+            indb = Feed.objects.get(pk=feed_obj.pk)
+            self.assertTrue(indb.is_active)
+            self.assertEqual(indb.failure_count, 0)
+            self.assertIn(indb, Feed.objects.due(indb.next_refresh_at))
+
+    def test_update_feed_rate_limited(self):
+
+        class _LimitedFeedImporter(FeedImporter):
+
+            def parse_feed(self, *args, **kwargs):
+                raise HostRateLimitedError("example.com")
+
+        Feed.objects.all().delete()
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.feed, local=True, force=True)
+
+        limited = _LimitedFeedImporter()
+        feed_obj = limited.update_feed(feed_obj=feed_obj, force=True)
+        self.assertEqual(limited.stats["rate_limited"], 1)
+        self.assertEqual(limited.stats["errors"], 0)
+        indb = Feed.objects.get(pk=feed_obj.pk)
+        self.assertEqual(indb.failure_count, 0)
+        self.assertEqual(indb.last_error, "")
+        self.assertIsNotNone(indb.next_refresh_at)
+
+        with self.assertRaises(HostRateLimitedError):
+            limited.import_feed("http://example.com/new.rss")
+
+        retrying = _LimitedFeedImporter(postpone_rate_limited=False)
+        with self.assertRaises(HostRateLimitedError):
+            retrying.update_feed(feed_obj=feed_obj, force=True)
+        self.assertEqual(retrying.stats["rate_limited"], 1)
+
     def test_update_feed_error_status(self):
 
         class _Verify(FeedImporter):
@@ -435,3 +562,87 @@ src="http://www.labandepasdessinee.com/bpd/images/saison3/261
                                                             force=True)
         self.assertEqual(imported_feed.post_set.count(), post_count,
             "Posts seems to be imported twice.")
+
+
+class _BrokenFeedImporter(FeedImporter):
+    # Module level, so it can be used in ProcessFeedRefresher's workers.
+
+    def parse_fields(self, *args, **kwargs):
+        raise KeyError("foo")
+
+
+class TestThreadedFeedRefresher(unittest.TestCase):
+
+    def setUp(self):
+        self.feed = get_data_filename("example_feed.rss")
+
+    def test_refresh(self):
+        Feed.objects.all().delete()
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.feed, local=True, force=True)
+
+        refresher = ThreadedFeedRefresher(FeedImporter(), workers=2)
+        refreshed = list(refresher.refresh([feed_obj]))
+        self.assertEqual(len(refreshed), 1)
+        self.assertEqual(refreshed[0].get_post_count(), 20)
+        self.assertTrue(refreshed[0].date_last_refresh)
+        self.assertEqual(refresher.stats["feeds"], 1)
+        self.assertEqual(refresher.stats["updated"], 1)
+
+        # Refreshed just now, so it's skipped the second time around.
+        list(refresher.refresh([refreshed[0]]))
+        self.assertEqual(refresher.stats["fresh"], 1)
+
+    def test_refresh_fetch_error(self):
+
+        class _TimeoutFeedImporter(FeedImporter):
+
+            def parse_feed(self, *args, **kwargs):
+                raise socket.timeout(1)
+
+        Feed.objects.all().delete()
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.feed, local=True, force=True)
+
+        refresher = ThreadedFeedRefresher(_TimeoutFeedImporter(), workers=2)
+        refreshed = list(refresher.refresh([feed_obj]))
+        self.assertEqual(refreshed[0].last_error, models.FEED_TIMEDOUT_ERROR)
+        self.assertEqual(refresher.stats["errors"], 1)
+
+
+class TestProcessFeedRefresher(unittest.TestCase):
+
+    def setUp(self):
+        self.feed = get_data_filename("example_feed.rss")
+
+    def test_refresh(self):
+        Feed.objects.all().delete()
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.feed, local=True, force=True)
+
+        refresher = ProcessFeedRefresher(FeedImporter(), workers=2,
+                                         processes=2)
+        refreshed = list(refresher.refresh([feed_obj]))
+        self.assertEqual(len(refreshed), 1)
+        self.assertEqual(refreshed[0].get_post_count(), 20)
+        self.assertEqual(refresher.stats["updated"], 1)
+        self.assertEqual(refresher.stats["entries_written"], 20)
+
+        # Unchanged posts are not written again.
+        refreshed[0].date_last_refresh = None
+        list(refresher.refresh(refreshed))
+        self.assertEqual(refresher.stats["updated"], 2)
+        self.assertEqual(refresher.stats["entries_written"], 20)
+        self.assertEqual(Feed.objects.get(pk=feed_obj.pk).get_post_count(),
+                         20)
+
+    def test_refresh_parse_error(self):
+        Feed.objects.all().delete()
+        importer = FeedImporter(update_on_import=False)
+        feed_obj = importer.import_feed(self.feed, local=True, force=True)
+
+        refresher = ProcessFeedRefresher(_BrokenFeedImporter(), workers=2,
+                                         processes=1)
+        refreshed = list(refresher.refresh([feed_obj]))
+        self.assertEqual(refreshed[0].last_error, models.FEED_GENERIC_ERROR)
+        self.assertEqual(refresher.stats["errors"], 1)
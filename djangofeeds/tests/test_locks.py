@@ -0,0 +1,116 @@
+import time
+import threading
+import unittest2 as unittest
+
+from djangofeeds import locks
+from djangofeeds.locks import CacheLock, RedisLock, feed_lock
+
+
+class LockCase(object):
+
+    def create_lock(self, key="a", expire=1):
+        raise NotImplementedError()
+
+    def test_acquire(self):
+        first, second = self.create_lock(), self.create_lock()
+        contended = locks.stats["contended"]
+        self.assertTrue(first.acquire())
+        try:
+            self.assertFalse(second.acquire())
+            self.assertEqual(locks.stats["contended"], contended + 1)
+            # Other keys are not locked.
+            other = self.create_lock(key="b")
+            self.assertTrue(other.acquire())
+            other.release()
+        finally:
+            first.release()
+        self.assertTrue(second.acquire())
+        second.release()
+
+    def test_release_only_own_lock(self):
+        first, second = self.create_lock(), self.create_lock()
+        self.assertTrue(first.acquire())
+        try:
+            second.release()
+            self.assertFalse(self.create_lock().acquire())
+        finally:
+            first.release()
+
+    def test_renew(self):
+        lock = self.create_lock(expire=0.3)
+        self.assertTrue(lock.acquire())
+        try:
+            # Renewed in the background, so it outlives the expire time.
+            time.sleep(0.5)
+            self.assertFalse(self.create_lock().acquire())
+        finally:
+            lock.release()
+        self.assertFalse(lock.renew())
+
+    def test_shared_renewer(self):
+        held = [self.create_lock(key="many%d" % i, expire=0.3)
+                    for i in xrange(10)]
+        for lock in held:
+            self.assertTrue(lock.acquire())
+        try:
+            renewers = [thread for thread in threading.enumerate()
+                            if thread.name == "djangofeeds-lock-renewer"]
+            self.assertEqual(len(renewers), 1)
+            time.sleep(0.5)
+            for i in xrange(10):
+                self.assertFalse(
+                        self.create_lock(key="many%d" % i).acquire())
+        finally:
+            for lock in held:
+                lock.release()
+
+    def test_context(self):
+        with self.create_lock() as acquired:
+            self.assertTrue(acquired)
+            with self.create_lock() as acquired:
+                self.assertFalse(acquired)
+        with self.create_lock() as acquired:
+            self.assertTrue(acquired)
+
+
+class TestCacheLock(unittest.TestCase, LockCase):
+
+    def create_lock(self, key="a", expire=1):
+        return CacheLock("djangofeeds.test.%s" % (key, ), expire)
+
+    def test_renew(self):
+        # The cache only has a resolution of seconds.
+        lock = self.create_lock(expire=1)
+        self.assertTrue(lock.acquire())
+        try:
+            self.assertTrue(lock.renew())
+        finally:
+            lock.release()
+        self.assertFalse(lock.renew())
+
+
+class TestRedisLock(unittest.TestCase, LockCase):
+
+    def setUp(self):
+        try:
+            import redis
+            self.client = redis.Redis(db=1)
+            self.client.ping()
+        except Exception, exc:
+            self.skipTest("Can't connect to redis server: %s" % (exc, ))
+        self.client.delete("djangofeeds:test:a", "djangofeeds:test:b")
+
+    def create_lock(self, key="a", expire=1):
+        return RedisLock("djangofeeds:test:%s" % (key, ), expire,
+                         client=self.client)
+
+
+class TestFeedLock(unittest.TestCase):
+
+    def test_feed_lock(self):
+        self.assertIsInstance(feed_lock("http://a.com/"), CacheLock)
+        self.assertIsInstance(feed_lock("http://a.com/", lock="redis",
+                                        client=object()), RedisLock)
+        self.assertIsNone(feed_lock("http://a.com/", lock=False))
+        self.assertEqual(feed_lock(" http://a.com/rss\n").key,
+                         feed_lock("http://a.com/rss").key)
@@ -0,0 +1,83 @@
+import unittest2 as unittest
+import pytz
+import httplib as http
+from datetime import datetime
+from uuid import uuid4
+
+from djangofeeds import conf
+from djangofeeds import models
+from djangofeeds.importers import FeedImporter
+from djangofeeds.maintenance import expire_posts, update_post_counts
+from djangofeeds.maintenance import probe_suspended_feeds
+
+
+def gen_unique_id():
+    return str(uuid4())
+
+
+class TestExpirePosts(unittest.TestCase):
+
+    def create_feed(self, num_posts):
+        now = datetime.now(pytz.utc)
+        feed = models.Feed.objects.create(name=gen_unique_id(),
+                                          feed_url=gen_unique_id(), sort=0)
+        for i in range(num_posts):
+            models.Post.objects.create(feed=feed, title=gen_unique_id(),
+                                       date_published=now, date_updated=now)
+        return feed
+
+    def test_expire_posts(self):
+        models.Feed.objects.all().delete()
+        small, large, larger = map(self.create_feed, (4, 6, 8))
+        update_post_counts()
+        self.assertEqual(expire_posts(min_posts=3, max_posts=5,
+                                      commit_every=2), 3 + 5)
+        self.assertEqual(small.post_set.count(), 4)
+        self.assertEqual(large.post_set.count(), 3)
+        self.assertEqual(larger.post_set.count(), 3)
+        self.assertEqual(expire_posts(min_posts=3, max_posts=5), 0)
+        self.assertListEqual(
+            [models.Feed.objects.get(pk=feed.pk).post_count
+                for feed in (small, large, larger)], [4, 3, 3])
+
+    def test_update_post_counts(self):
+        feed = self.create_feed(2)
+        self.assertEqual(feed.post_count, 0)
+        update_post_counts()
+        feed = models.Feed.objects.get(pk=feed.pk)
+        self.assertEqual(feed.post_count, 2)
+        self.assertEqual(feed.date_newest_post, datetime.now(pytz.utc).date())
+
+
+class MockProbeImporter(FeedImporter):
+    failing = ()
+
+    def parse_feed(self, feed_url, **kwargs):
+        if feed_url in self.failing:
+            raise IOError("connection refused")
+        return {"status": http.NOT_MODIFIED}
+
+
+class TestProbeSuspendedFeeds(unittest.TestCase):
+
+    def create_suspended_feed(self):
+        feed = models.Feed.objects.create(name=gen_unique_id(),
+                                          feed_url=gen_unique_id(), sort=0)
+        feed.failure_count = conf.SUSPEND_AFTER_FAILURES - 1
+        return feed.save_generic_error()
+
+    def test_probe_suspended_feeds(self):
+        models.Feed.objects.all().delete()
+        alive = self.create_suspended_feed()
+        dead = self.create_suspended_feed()
+        importer = MockProbeImporter()
+        importer.failing = (dead.feed_url, )
+        # Not due for a probe yet.
+        self.assertEqual(probe_suspended_feeds(importer=importer), 0)
+
+        models.Feed.objects.update(next_refresh_at=None)
+        self.assertEqual(probe_suspended_feeds(importer=importer), 1)
+        self.assertTrue(models.Feed.objects.get(pk=alive.pk).is_active)
+        dead = models.Feed.objects.get(pk=dead.pk)
+        self.assertTrue(dead.is_suspended)
+        self.assertGreater(dead.next_refresh_at, datetime.now(pytz.utc))
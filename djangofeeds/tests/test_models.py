@@ -1,7 +1,7 @@
 import unittest2 as unittest
 import httplib as http
 import pytz
-from datetime import datetime
+from datetime import datetime, timedelta
 from uuid import uuid4
 
 from djangofeeds import models
@@ -62,6 +62,102 @@ class TestPost(unittest.TestCase):
         post = models.Post(feed=self.feed, title="baz", date_updated=now)
         self.assertEqual(post.date_updated_naturaldate, naturaldate(now))
 
+    def post_fields(self, guid, **fields):
+        now = datetime.now(pytz.utc)
+        return dict({"guid": guid, "title": guid, "link": guid,
+                     "content": "", "author": "", "feed": self.feed,
+                     "date_published": now, "date_updated": now}, **fields)
+
+    def test_bulk_upsert(self):
+        posts = models.Post.objects.bulk_upsert(self.feed, [
+                    self.post_fields("a"), self.post_fields("b")])
+        self.assertListEqual([post.guid for post in posts], ["a", "b"])
+        self.assertTrue(all(post.pk for post in posts))
+        self.assertEqual(self.feed.post_set.count(), 2)
+
+        posts2 = models.Post.objects.bulk_upsert(self.feed, [
+                    self.post_fields("c"),
+                    self.post_fields("a", title="changed")])
+        self.assertEqual(posts2[1].pk, posts[0].pk)
+        self.assertEqual(self.feed.post_set.count(), 3)
+        self.assertEqual(models.Post.objects.get(pk=posts[0].pk).title,
+                         "changed")
+
+    def test_bulk_upsert_updates_in_batch(self):
+        posts = models.Post.objects.bulk_upsert(self.feed, [
+                    self.post_fields(guid) for guid in "abc"])
+        posts = models.Post.objects.bulk_upsert(self.feed, [
+                    self.post_fields("a", title="A"),
+                    self.post_fields("b", title="B", author="x"),
+                    self.post_fields("c", title="C"),
+                    self.post_fields("d")], fetch_pks=False)
+        self.assertEqual(
+            list(self.feed.post_set.order_by("guid").values_list(
+                    "title", "author")),
+            [("A", ""), ("B", "x"), ("C", ""), ("d", "")])
+        self.assertTrue(all(post.pk for post in posts[:3]))
+        # The new post was not fetched again.
+        self.assertIsNone(posts[3].pk)
+        self.assertEqual(posts[3].guid, "d")
+
+    def test_bulk_upsert_skips_unchanged(self):
+        fields = self.post_fields("same", fingerprint="0" * 32)
+        post, = models.Post.objects.bulk_upsert(self.feed, [fields])
+        models.Post.objects.filter(pk=post.pk).update(title="untouched")
+
+        models.Post.objects.bulk_upsert(self.feed, [fields])
+        self.assertEqual(models.Post.objects.get(pk=post.pk).title,
+                         "untouched")
+
+        models.Post.objects.bulk_upsert(self.feed, [
+            dict(fields, fingerprint="1" * 32)])
+        self.assertEqual(models.Post.objects.get(pk=post.pk).title, "same")
+
+    def test_bulk_upsert_removes_duplicates(self):
+        now = datetime.now(pytz.utc)
+        for i in range(2):
+            models.Post.objects.create(feed=self.feed, guid="dup",
+                                       title="dup", date_published=now,
+                                       date_updated=now)
+        self.feed.recount_posts()
+        posts = models.Post.objects.bulk_upsert(self.feed, [
+                    self.post_fields("dup", title="deduped")])
+        self.assertEqual(self.feed.post_set.count(), 1)
+        self.assertEqual(posts[0].title, "deduped")
+        self.assertEqual(models.Feed.objects.get(pk=self.feed.pk).post_count,
+                         1)
+
+    def test_update_or_create_counts_new_posts(self):
+        post = models.Post.objects.update_or_create(self.feed,
+                                                    **self.post_fields("a"))
+        self.assertTrue(post.pk)
+        again = models.Post.objects.update_or_create(self.feed,
+                    **self.post_fields("a", title="changed"))
+        self.assertEqual(again.pk, post.pk)
+        self.assertEqual(models.Post.objects.get(pk=post.pk).title,
+                         "changed")
+        self.assertEqual(models.Feed.objects.get(pk=self.feed.pk).post_count,
+                         1)
+
+    def test_bulk_upsert_counts_new_posts(self):
+        yesterday = datetime.now(pytz.utc) - timedelta(days=1)
+        models.Post.objects.bulk_upsert(self.feed, [
+                    self.post_fields("a"),
+                    self.post_fields("b", date_published=yesterday)])
+        models.Post.objects.bulk_upsert(self.feed, [
+                    self.post_fields("a", title="changed"),
+                    self.post_fields("c", date_published=yesterday)])
+        self.assertEqual(self.feed.post_count, 3)
+        self.assertEqual(self.feed.date_newest_post,
+                         datetime.now(pytz.utc).date())
+
+    def test_get_posts_fields(self):
+        models.Post.objects.bulk_upsert(self.feed, [
+                    self.post_fields("a", content="long content")])
+        post, = self.feed.get_posts(fields=["guid", "title"])
+        self.assertEqual(post.title, "a")
+        self.assertNotIn("content", post.__dict__)
+
 
 class TestFeed(unittest.TestCase):
 
@@ -122,6 +218,87 @@ class TestFeed(unittest.TestCase):
                 models.Feed.objects.ratio(min=0.23, max=0.25).count(), 1)
         self.assertEqual(models.Feed.objects.ratio(max=0.24).count(), 2)
 
+    def test_refresh_interval(self):
+        from djangofeeds import conf
+        now = datetime.now(pytz.utc)
+        f = models.Feed(name="foo", feed_url="http://example.com/i.rss",
+                        sort=0, freq=3600, date_last_requested=now)
+        self.assertEqual(f.refresh_interval(now), timedelta(hours=1))
+        f.not_modified_count = 2
+        self.assertEqual(f.refresh_interval(now),
+                         timedelta(seconds=3600 *
+                                   conf.NOT_MODIFIED_BACKOFF ** 2))
+        f.not_modified_count = 1000
+        self.assertEqual(f.refresh_interval(now), conf.MAX_REFRESH_INTERVAL)
+        f.not_modified_count, f.freq = 0, 1
+        self.assertEqual(f.refresh_interval(now), conf.MIN_REFRESH_INTERVAL)
+        f.freq, f.last_error = 3600, models.FEED_GENERIC_ERROR
+        self.assertEqual(f.refresh_interval(now), timedelta(hours=2))
+
+    def test_schedule_refresh(self):
+        now = datetime.now(pytz.utc)
+        f = models.Feed.objects.create(name="foo",
+                feed_url=gen_unique_id(), sort=0, freq=3600,
+                date_last_requested=now)
+        f.not_modified_count = 3
+        f.schedule_refresh(now, save=True)
+        self.assertEqual(f.next_refresh_at, now + f.refresh_interval(now))
+        indb = models.Feed.objects.get(pk=f.pk)
+        self.assertEqual(indb.next_refresh_at, f.next_refresh_at)
+        self.assertEqual(indb.not_modified_count, 3)
+
+    def test_objects_due(self):
+        now = datetime.now(pytz.utc)
+        models.Feed.objects.all().delete()
+        models.Feed.objects.create(name="never",
+                feed_url=gen_unique_id(), sort=0)
+        models.Feed.objects.create(name="past",
+                feed_url=gen_unique_id(), sort=0,
+                next_refresh_at=now - timedelta(minutes=1))
+        models.Feed.objects.create(name="future",
+                feed_url=gen_unique_id(), sort=0,
+                next_refresh_at=now + timedelta(minutes=1))
+        models.Feed.objects.create(name="inactive",
+                feed_url=gen_unique_id(), sort=0, is_active=False)
+        self.assertItemsEqual(
+                models.Feed.objects.due(now).values_list("name", flat=True),
+                ["never", "past"])
+
+    def test_save_error_backs_off(self):
+        from djangofeeds import conf
+        now = datetime.now(pytz.utc)
+        f = models.Feed.objects.create(name="foo",
+                feed_url=gen_unique_id(), sort=0, freq=3600,
+                date_last_requested=now)
+        f.save_timeout_error()
+        f.save_timeout_error()
+        indb = models.Feed.objects.get(pk=f.pk)
+        self.assertEqual(indb.failure_count, 2)
+        self.assertTrue(indb.is_active)
+        self.assertTrue(indb.is_backing_off())
+        self.assertEqual(indb.refresh_interval(now),
+                         timedelta(hours=conf.ERROR_BACKOFF ** 2))
+        self.assertFalse(indb.is_backing_off(indb.next_refresh_at))
+
+    def test_save_error_suspends(self):
+        from djangofeeds import conf
+        f = models.Feed.objects.create(name="foo",
+                feed_url=gen_unique_id(), sort=0)
+        f.failure_count = conf.SUSPEND_AFTER_FAILURES - 1
+        f.save_generic_error()
+        indb = models.Feed.objects.get(pk=f.pk)
+        self.assertFalse(indb.is_active)
+        self.assertTrue(indb.is_suspended)
+        self.assertIn(indb, models.Feed.objects.suspended())
+        self.assertNotIn(indb, models.Feed.objects.due())
+
+        indb.reactivate()
+        indb = models.Feed.objects.get(pk=f.pk)
+        self.assertTrue(indb.is_active)
+        self.assertEqual(indb.failure_count, 0)
+        self.assertEqual(indb.last_error, "")
+        self.assertIn(indb, models.Feed.objects.due())
+
     def test_expire_old_posts_no_posts(self):
         f = models.Feed.objects.create(name="foozalaz",
                 feed_url=gen_unique_id(), sort=0)
@@ -140,3 +317,75 @@ class TestFeed(unittest.TestCase):
         self.assertEqual(models.Post.objects.filter(feed=f).count(), 5)
         self.assertEqual(f.expire_old_posts(min_posts=3, max_posts=3), 2)
         self.assertEqual(models.Post.objects.filter(feed=f).count(), 3)
+
+    def test_expire_old_posts_max_below_min(self):
+        now = datetime.now(pytz.utc)
+        f = models.Feed.objects.create(name="foozalaz",
+                feed_url=gen_unique_id(), sort=0)
+        [models.Post.objects.create(feed=f,
+                                    title=gen_unique_id(),
+                                    date_published=now,
+                                    date_updated=now)
+                    for i in range(25)]
+        self.assertEqual(f.expire_old_posts(min_posts=30, max_posts=20), 0)
+        self.assertEqual(models.Post.objects.filter(feed=f).count(), 25)
+        self.assertEqual(f.expire_old_posts(min_posts=22, max_posts=20), 3)
+        self.assertEqual(models.Post.objects.filter(feed=f).count(), 22)
+
+    def test_post_stats_atomic(self):
+        now = datetime.now(pytz.utc)
+        f = models.Feed.objects.create(name="foozalaz",
+                feed_url=gen_unique_id(), sort=0, post_count=10)
+        refreshing = models.Feed.objects.get(pk=f.pk)
+        expiring = models.Feed.objects.get(pk=f.pk)
+        expiring.posts_removed(4)
+        refreshing.posts_added(3, now)
+        refreshing.save_state()
+        indb = models.Feed.objects.get(pk=f.pk)
+        self.assertEqual(indb.post_count, 9)
+        self.assertEqual(indb.date_newest_post, now.date())
+        refreshing.posts_added(1, now - timedelta(days=1))
+        expiring.reactivate()
+        indb = models.Feed.objects.get(pk=f.pk)
+        self.assertEqual(indb.post_count, 10)
+        self.assertEqual(indb.date_newest_post, now.date())
+        expiring.posts_removed(20)
+        indb = models.Feed.objects.get(pk=f.pk)
+        self.assertEqual(indb.post_count, 0)
+        self.assertIsNone(indb.date_newest_post)
+
+    def test_expire_old_posts_related(self):
+        now = datetime.now(pytz.utc)
+        f = models.Feed.objects.create(name="foozalaz",
+                feed_url=gen_unique_id(), sort=0)
+        category = models.Category.objects.create(name=gen_unique_id())
+        enclosure = models.Enclosure.objects.create(
+                        url="http://e.com/media/i.jpg", type="image/jpeg")
+        for days in (2, 1, 0):
+            post = models.Post.objects.create(feed=f, title=str(days),
+                                    date_published=now - timedelta(days),
+                                    date_updated=now)
+            post.categories.add(category)
+            post.enclosures.add(enclosure)
+        self.assertEqual(f.expire_old_posts(min_posts=1, max_posts=1), 2)
+        self.assertListEqual(list(category.post_set.all()), [post])
+        self.assertListEqual(list(enclosure.post_set.all()), [post])
+        through = models.Post.categories.through
+        self.assertEqual(through.objects.filter(category=category).count(),
+                         1)
+
+    def test_expire_old_posts_keeps_newest(self):
+        now = datetime.now(pytz.utc)
+        f = models.Feed.objects.create(name="foozalaz",
+                feed_url=gen_unique_id(), sort=0)
+        for days in (3, 0, 5, 1, 0, 2):
+            models.Post.objects.create(feed=f, title=str(days),
+                                       date_published=now - timedelta(days),
+                                       date_updated=now)
+        self.assertEqual(f.expire_old_posts(min_posts=3, max_posts=6), 0)
+        self.assertEqual(f.expire_old_posts(min_posts=3, max_posts=5), 3)
+        self.assertEqual(models.Feed.objects.get(pk=f.pk).post_count, 0)
+        self.assertItemsEqual(
+                models.Post.objects.filter(feed=f).values_list("title",
+                                                               flat=True),
+                ["0", "0", "1"])
@@ -0,0 +1,97 @@
+from __future__ import with_statement
+
+import time
+import threading
+import unittest2 as unittest
+
+from djangofeeds.exceptions import HostRateLimitedError
+from djangofeeds.ratelimit import LocalHostLimiter, RedisHostLimiter
+from djangofeeds.ratelimit import host_for_url, limiter_or_default
+
+
+class LimiterCase(object):
+
+    def create_limiter(self, **kwargs):
+        raise NotImplementedError()
+
+    def test_burst(self):
+        limiter = self.create_limiter(concurrency=10, rate=1, burst=3)
+        tokens = [limiter.try_acquire("a")[0] for _ in range(4)]
+        self.assertTrue(all(tokens[:3]))
+        self.assertIsNone(tokens[3])
+        # Other hosts have their own limits.
+        self.assertTrue(limiter.try_acquire("b")[0])
+
+    def test_rate(self):
+        limiter = self.create_limiter(concurrency=10, rate=20, burst=1)
+        self.assertTrue(limiter.try_acquire("a")[0])
+        token, wait = limiter.try_acquire("a")
+        self.assertIsNone(token)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.05)
+        time.sleep(wait)
+        limiter.acquire("a", timeout=1)
+
+    def test_concurrency(self):
+        limiter = self.create_limiter(concurrency=1, rate=100, burst=10)
+        with limiter.limit("a"):
+            with self.assertRaises(HostRateLimitedError):
+                limiter.acquire("a", timeout=0.2)
+        with limiter.limit("a", timeout=0):
+            pass
+
+    def test_concurrency_wait(self):
+        limiter = self.create_limiter(concurrency=1, rate=100, burst=10)
+        token = limiter.acquire("a")
+        timer = threading.Timer(0.2, limiter.release, ("a", token))
+        timer.start()
+        try:
+            limiter.release("a", limiter.acquire("a", timeout=5))
+        finally:
+            timer.join()
+
+
+class TestLocalHostLimiter(unittest.TestCase, LimiterCase):
+
+    def create_limiter(self, **kwargs):
+        return LocalHostLimiter(**kwargs)
+
+
+class TestRedisHostLimiter(unittest.TestCase, LimiterCase):
+
+    def setUp(self):
+        try:
+            import redis
+            self.client = redis.Redis(db=1)
+            self.client.ping()
+        except Exception, exc:
+            self.skipTest("Can't connect to redis server: %s" % (exc, ))
+
+    def create_limiter(self, **kwargs):
+        limiter = RedisHostLimiter(client=self.client, **kwargs)
+        limiter.prefix = "djangofeeds:test:%s" % (id(self), )
+        for host in ("a", "b"):
+            self.client.delete(*limiter.keys(host))
+        return limiter
+
+    def test_lease(self):
+        limiter = self.create_limiter(concurrency=1, rate=100, burst=10,
+                                      lease=0.1)
+        limiter.acquire("a")
+        time.sleep(0.15)
+        # The first request was never released, but the lease expired.
+        limiter.acquire("a", timeout=0)
+
+
+class TestLimiterOrDefault(unittest.TestCase):
+
+    def test_limiter_or_default(self):
+        limiter = LocalHostLimiter()
+        self.assertIs(limiter_or_default(limiter), limiter)
+        self.assertIsInstance(limiter_or_default("local"), LocalHostLimiter)
+        self.assertIs(limiter_or_default("local"),
+                      limiter_or_default("local"))
+
+    def test_host_for_url(self):
+        self.assertEqual(host_for_url("http://u:p@Feeds.Example.com:81/x"),
+                         "feeds.example.com:81")
@@ -9,6 +9,8 @@ import socket
 
 from nose import SkipTest
 
+from djangofeeds.models import Feed
+
 
 try:
     from redis.exceptions import ConnectionError
@@ -34,6 +36,7 @@ def skip_if_redis_not_running(fun):
             return fun(*args, **kwargs)
         except ConnectionError, exc:
             raise SkipTest("Can't connect to redis server: %s" % (exc, ))
+    return _inner
 
 
 class TestRedisBackend(unittest.TestCase):
@@ -47,7 +50,7 @@ class TestRedisBackend(unittest.TestCase):
                     timestamp=datetime.now(pytz.utc))
 
     def setUp(self):
-        self.b = Entries()
+        self.b = Entries(db=1)
         self.b.clear()
 
     def create_post(self, delta=None, **fields):
@@ -59,6 +62,7 @@ class TestRedisBackend(unittest.TestCase):
         fields.setdefault("date_updated", fields["timestamp"])
         if delta is not None:
             fields["timestamp"] = fields["timestamp"] + delta
+            fields["date_updated"] = fields["date_updated"] + delta
         ret = dict(self.test_data, **fields)
         return ret
 
@@ -71,11 +75,7 @@ class TestRedisBackend(unittest.TestCase):
                  self.create_post(feed_url=f, delta=timedelta(hours=-4)),
                  self.create_post(feed_url=f, delta=timedelta(hours=-5))]
 
-        class MockFeed(object):
-            def __init__(self, feed_url):
-                self.feed_url = feed_url
-
-        entries = [self.b.update_or_create(MockFeed(f), **fields)
+        entries = [self.b.update_or_create(Feed(feed_url=f), **fields)
                         for fields in posts]
 
         ordered = self.b.all_by_order(entries[0].feed_url)
@@ -109,3 +109,99 @@ class TestRedisBackend(unittest.TestCase):
         stored.delete()
         with self.assertRaises(KeyError):
             posts.get(stored.id)
+
+    @skip_if_redis_not_running
+    def test_bulk_upsert(self):
+        f = "http://google.com/reader/rss/456"
+
+        posts = [self.create_post(feed_url=f, fingerprint=str(i),
+                                  delta=timedelta(hours=-i))
+                    for i in range(5)]
+        entries = self.b.bulk_upsert(Feed(feed_url=f), posts)
+        self.assertEqual(len(set(entry.id for entry in entries)), 5)
+        self.assertEqual(len(self.b.all_by_order(f)), 5)
+
+        posts[2] = dict(posts[2], title="Changed", fingerprint="changed")
+        again = self.b.bulk_upsert(Feed(feed_url=f), posts)
+        self.assertListEqual([entry.id for entry in again],
+                             [entry.id for entry in entries])
+        self.assertEqual(self.b.get_by_guid(f, posts[2]["guid"]).title,
+                         "Changed")
+        self.assertEqual(len(self.b.all_by_order(f)), 5)
+        self.assertItemsEqual(
+                self.b.api.hvals(self.b.get_fingerprint_map(f).name),
+                ["0", "1", "changed", "3", "4"])
+
+    @skip_if_redis_not_running
+    def test_all_by_order_fields(self):
+        f = "http://google.com/reader/rss/789"
+        for i in range(3):
+            self.b.Entry(**self.create_post(feed_url=f)).save()
+        ordered = self.b.all_by_order(f, limit=2, fields=["guid", "title"])
+        self.assertEqual(len(ordered), 2)
+        self.assertItemsEqual(ordered[0].keys(), ["guid", "title"])
+        self.assertListEqual(self.b.all_by_order(f, limit=0), [])
+        self.assertEqual(len(self.b.all_by_order(f, limit=None)), 3)
+
+    @skip_if_redis_not_running
+    def test_fsck(self):
+        f = "http://google.com/reader/rss/fsck"
+
+        entries = self.b.bulk_upsert(Feed(feed_url=f), [
+                        self.create_post(feed_url=f) for i in range(3)])
+        self.assertEqual(self.b.fsck(full=True), 0)
+
+        self.b.api.delete(entries[0].id)
+        self.b.api.hdel(self.b.get_guid_map(f).name, entries[1].guid)
+        self.assertEqual(self.b.fsck(recent=True, clean=False), 2)
+        self.assertEqual(self.b.fsck(full=True), 3)
+        self.assertEqual(self.b.fsck(full=True), 0)
+        self.assertEqual(len(self.b.all_by_order(f)), 1)
+
+    @skip_if_redis_not_running
+    def test_fsck_fingerprints(self):
+        f = "http://google.com/reader/rss/fsck/fingerprints"
+
+        entries = self.b.bulk_upsert(Feed(feed_url=f), [
+                        self.create_post(feed_url=f, fingerprint=str(i))
+                            for i in range(3)])
+        self.b.api.delete(entries[0].id)
+        self.b.api.hdel(self.b.get_guid_map(f).name, entries[1].guid)
+        self.assertEqual(self.b.fsck([f], full=True), 4)
+        self.assertEqual(self.b.fsck([f], full=True), 0)
+        self.assertItemsEqual(
+                self.b.api.hvals(self.b.get_fingerprint_map(f).name),
+                ["2"])
+
+    @skip_if_redis_not_running
+    def test_fsck_post_count(self):
+        f = "http://google.com/reader/rss/fsck/%d" % (self.next_id(), )
+        feed = Feed.objects.create(name="fsck", feed_url=f, sort=0)
+        try:
+            entries = self.b.bulk_upsert(feed, [
+                            self.create_post(feed_url=f) for i in range(3)])
+            self.assertEqual(Feed.objects.get(pk=feed.pk).post_count, 3)
+
+            self.b.api.delete(entries[0].id)
+            self.b.api.hdel(self.b.get_guid_map(f).name, entries[1].guid)
+            self.assertEqual(self.b.fsck(full=True), 3)
+            self.assertEqual(Feed.objects.get(pk=feed.pk).post_count, 1)
+        finally:
+            feed.delete()
+
+    @skip_if_redis_not_running
+    def test_expire(self):
+        f = "http://google.com/reader/rss/expire"
+
+        self.b.bulk_upsert(Feed(feed_url=f), [
+            self.create_post(feed_url=f, delta=timedelta(hours=-i),
+                             fingerprint=str(i))
+                for i in range(10)])
+        self.assertEqual(self.b.expire(f, limit=3, max_posts=10), 0)
+        self.assertEqual(self.b.expire(f, limit=3), 7)
+        self.assertEqual(len(self.b.all_by_order(f)), 3)
+        self.assertEqual(len(self.b.get_guid_map(f).keys()), 3)
+        self.assertEqual(len(self.b.keys("Entry:*")), 3)
+        self.assertItemsEqual(
+                self.b.api.hvals(self.b.get_fingerprint_map(f).name),
+                ["0", "1", "2"])
@@ -1,4 +1,13 @@
 import unittest2 as unittest
+import httplib as http
+from datetime import datetime, timedelta
+
+import feedparser
+from django.utils.timezone import utc
+
+from djangofeeds.exceptions import HostRateLimitedError
+from djangofeeds.importers import FeedImporter
+from djangofeeds.models import Feed
 
 CELERY_MISSING = False
 try:
@@ -17,6 +26,35 @@ class MockImporter(object):
         self.__class__.imported.append(url)
 
 
+class MockLimitedImporter(MockImporter):
+
+    def __init__(self, *args, **kwargs):
+        self.postpone = kwargs.get("postpone_rate_limited", True)
+
+    def import_feed(self, url, **kwargs):
+        # Existing feeds are only postponed, unless asked to raise.
+        if not self.postpone:
+            raise HostRateLimitedError("example.com")
+
+
+class MockBatchImporter(MockImporter):
+    updated = []
+
+    def __init__(self, *args, **kwargs):
+        from djangofeeds.stats import RefreshStats
+        self.stats = RefreshStats()
+
+    def update_feed(self, feed_obj, **kwargs):
+        self.__class__.updated.append(feed_obj.pk)
+        self.stats.incr("feeds")
+
+
+class MockNotModifiedImporter(FeedImporter):
+
+    def fetch_feed(self, feed_obj, **kwargs):
+        return feedparser.FeedParserDict(status=http.NOT_MODIFIED)
+
+
 class TestRefreshFeed(unittest.TestCase):
 
     @unittest.skipIf(CELERY_MISSING, "Celery is missing")
@@ -49,12 +87,77 @@ class TestRefreshFeed(unittest.TestCase):
             def get(self, key, *args, **kwargs):
                 return "true"
 
+            def add(self, key, *args, **kwargs):
+                return False
+
         prev = tasks.cache
         tasks.cache = MockCache()
         try:
-            tasks.refresh_feed.apply(args=["http://example.com/t.rss"],
+            tasks.refresh_feed.apply(args=["http://example.com/l.rss"],
                                 kwargs={"importer_cls": MockImporter}).get()
-            self.assertIn(
-                    "http://example.com/t.rss", MockImporter.imported)
+            self.assertNotIn(
+                    "http://example.com/l.rss", MockImporter.imported)
         finally:
             tasks.cache = prev
+
+    @unittest.skipIf(CELERY_MISSING, "Celery is missing")
+    def test_refresh_rate_limited(self):
+        res = tasks.refresh_feed.apply(args=["http://example.com/t.rss"],
+                                kwargs={"importer_cls": MockLimitedImporter})
+        self.assertIsInstance(res.result, HostRateLimitedError)
+        lock = tasks.feed_lock("http://example.com/t.rss")
+        if lock is not None:
+            self.assertTrue(lock.acquire())
+            lock.release()
+
+
+class TestDispatchDueFeeds(unittest.TestCase):
+
+    @unittest.skipIf(CELERY_MISSING, "Celery is missing")
+    def test_dispatch_backing_off(self):
+        Feed.objects.all().delete()
+        now = datetime.utcnow().replace(tzinfo=utc)
+        feed = Feed.objects.create(name="due", feed_url="http://a.com/due",
+                                   failure_count=1,
+                                   next_refresh_at=now - timedelta(1))
+        sent = []
+        prev = tasks.refresh_feed.delay
+        tasks.refresh_feed.delay = lambda *args, **kwargs: sent.append(
+                                                        (args, kwargs))
+        try:
+            self.assertEqual(tasks.dispatch_due_feeds.apply().get(), 1)
+        finally:
+            tasks.refresh_feed.delay = prev
+        self.assertTrue(Feed.objects.get(pk=feed.pk).is_backing_off())
+
+        for args, kwargs in sent:
+            tasks.refresh_feed.apply(args=args, kwargs=dict(kwargs,
+                        importer_cls=MockNotModifiedImporter)).get()
+        indb = Feed.objects.get(pk=feed.pk)
+        self.assertEqual(indb.failure_count, 0)
+        self.assertEqual(indb.not_modified_count, 1)
+
+
+class TestRefreshFeedBatch(unittest.TestCase):
+
+    @unittest.skipIf(CELERY_MISSING, "Celery is missing")
+    def test_batches_by_host(self):
+        feeds = [(1, "http://a.com/1"), (2, "http://b.com/1"),
+                 (3, "http://a.com/2"), (4, "http://A.com/3")]
+        self.assertEqual(tasks.batches_by_host(feeds, batch_size=2),
+                         [("a.com", [1, 3]), ("a.com", [4]),
+                          ("b.com", [2])])
+
+    @unittest.skipIf(CELERY_MISSING, "Celery is missing")
+    def test_refresh_batch(self):
+        feeds = [Feed.objects.create(name="batch%d" % i,
+                                     feed_url="http://a.com/%d" % i)
+                    for i in range(3)]
+        res = tasks.refresh_feed_batch.apply(
+                args=[[feed.pk for feed in feeds]],
+                kwargs={"host": "a.com",
+                        "importer_cls": MockBatchImporter}).get()
+        self.assertItemsEqual(MockBatchImporter.updated,
+                              [feed.pk for feed in feeds])
+        self.assertEqual(res["feeds"], 3)
+        self.assertEqual(res["host"], "a.com")
@@ -120,6 +120,21 @@ class TestNaturalDate(unittest.TestCase):
 
         self.assertEqual(improper_list, entries_by_date(improper_list))
 
+    def test_entries_by_date_limit(self):
+        now = datetime.now(pytz.utc)
+        entries = [{"title": "old", "date_parsed": now - timedelta(days=1)},
+                   {"title": "tie 1", "date_parsed": now},
+                   {"title": "undated"},
+                   {"title": "tie 2", "date_parsed": now},
+                   {"title": "new", "date_parsed": now + timedelta(days=1)}]
+        titles = lambda entries: [entry["title"] for entry in entries]
+        # Same date: the last entry in the feed first.
+        self.assertEqual(titles(entries_by_date(entries)),
+                         ["new", "tie 2", "tie 1", "undated", "old"])
+        self.assertEqual(titles(entries_by_date(entries, 3)),
+                         ["new", "tie 2", "tie 1"])
+        self.assertEqual(entries_by_date(entries, 0), [])
+
     def test_missing_guid(self):
         entries = [
             {"title": u"first",